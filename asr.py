@@ -1,25 +1,315 @@
+import asyncio
+import functools
+import hashlib
+import io
+import mimetypes
 import os
 import logging
-import random
+import shutil
+import threading
+import wave
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+PROVIDERS = ('groq', 'openai', 'gemini')
+
+# Per-provider timeout (seconds) for a single transcription attempt
+DEFAULT_TIMEOUTS = {'groq': 30, 'openai': 60, 'gemini': 90}
+
+# Gemini rejects requests over 20 MB, so larger audio goes through the File API
+GEMINI_INLINE_AUDIO_LIMIT = 15 * 1024 * 1024
+
+GEMINI_TRANSCRIBE_PROMPT = "Please transcribe this audio file exactly as it is spoken. Do not add any other text."
+
+# File API processing is polled with exponential backoff between these bounds
+GEMINI_POLL_INITIAL_S = 0.25
+GEMINI_POLL_MAX_S = 2.0
+
+DEFAULT_AUDIO_FILENAME = 'audio.m4a'
+
+# Long clips are decoded to 16 kHz mono PCM and cut into overlapping WAV segments
+SEGMENT_SAMPLE_RATE = 16000
+SEGMENT_SAMPLE_WIDTH = 2
+
+
+def read_audio(audio):
+    """Return raw bytes for `audio`, which may be bytes, a file-like object or a path."""
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        return bytes(audio)
+    if hasattr(audio, 'read'):
+        return audio.read()
+    with open(audio, 'rb') as f:
+        return f.read()
+
+
+async def decode_to_pcm(audio):
+    """Decode any audio container to raw 16 kHz mono s16le PCM.
+
+    WAV input already in that format is unpacked directly; everything else
+    goes through ffmpeg on stdin/stdout so nothing is written to disk.
+    """
+    try:
+        with wave.open(io.BytesIO(audio)) as w:
+            if (w.getframerate(), w.getnchannels(), w.getsampwidth()) == (SEGMENT_SAMPLE_RATE, 1, SEGMENT_SAMPLE_WIDTH):
+                return w.readframes(w.getnframes())
+    except (wave.Error, EOFError):
+        pass
+
+    if not shutil.which('ffmpeg'):
+        raise RuntimeError("ffmpeg not installed")
+    proc = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+        '-ac', '1', '-ar', str(SEGMENT_SAMPLE_RATE), '-f', 's16le', 'pipe:1',
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    pcm, err = await proc.communicate(audio)
+    if proc.returncode != 0 or not pcm:
+        raise RuntimeError(f"ffmpeg decode failed: {err.decode(errors='replace')[:200]}")
+    return pcm
+
+
+def split_pcm_to_wav(pcm, segment_s, overlap_s):
+    """Cut PCM into WAV clips of `segment_s` seconds, each overlapping the previous by `overlap_s`."""
+    bytes_per_s = SEGMENT_SAMPLE_RATE * SEGMENT_SAMPLE_WIDTH
+    seg_len = int(segment_s * bytes_per_s)
+    # An overlap as long as the segment would never advance: always move at least 1 s
+    step = max(bytes_per_s, int((segment_s - overlap_s) * bytes_per_s))
+    step -= step % SEGMENT_SAMPLE_WIDTH
+    segments = []
+    for start in range(0, len(pcm), step):
+        buf = io.BytesIO()
+        with wave.open(buf, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(SEGMENT_SAMPLE_WIDTH)
+            w.setframerate(SEGMENT_SAMPLE_RATE)
+            w.writeframes(pcm[start:start + seg_len])
+        segments.append(buf.getvalue())
+        if start + seg_len >= len(pcm):
+            break
+    return segments
+
+
+def stitch_transcripts(parts, max_overlap_chars=60, min_overlap_chars=4):
+    """Join segment transcripts in order, dropping text repeated across the overlap."""
+    result = ''
+    for part in parts:
+        part = (part or '').strip()
+        if not part:
+            continue
+        if not result:
+            result = part
+            continue
+        overlap = 0
+        for k in range(min(len(result), len(part), max_overlap_chars), min_overlap_chars - 1, -1):
+            if result[-k:].lower() == part[:k].lower():
+                overlap = k
+                break
+        part = part[overlap:].lstrip()
+        if not part:
+            continue
+        # Whisper output for CJK has no spaces; only Latin words need a separator
+        sep = ' ' if result[-1].isascii() and result[-1].isalnum() and part[0].isascii() and part[0].isalnum() else ''
+        result = result + sep + part
+    return result
+
+
+def audio_digest(audio):
+    return hashlib.sha256(audio).hexdigest()
+
+
+class TranscriptCache:
+    """LRU of transcripts keyed by the SHA-256 of the audio bytes.
+
+    `backend` is an optional persistent store with `get(key)` / `set(key, text)`;
+    it is consulted on a memory miss and written through on every new entry.
+    """
+
+    def __init__(self, max_entries=256, backend=None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_memory(self, key):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def _set_memory(self, key, text):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        text = self._get_memory(key)
+        if text is None and self.backend is not None:
+            try:
+                text = self.backend.get(key)
+            except Exception as e:
+                logger.warning(f"Transcript cache backend read failed: {e}")
+            if text is not None:
+                self._set_memory(key, text)
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return text
+
+    def set(self, key, text):
+        self._set_memory(key, text)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, text)
+            except Exception as e:
+                logger.warning(f"Transcript cache backend write failed: {e}")
+
+    def snapshot(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class ProviderStats:
+    """Rolling latency / error tracking with a circuit breaker for one ASR provider.
+
+    The breaker opens after `failure_threshold` consecutive failures and stays
+    open for `cooldown_s`; after that calls are let through again (half-open)
+    and the next outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, name, prior_latency_s, window=20, failure_threshold=3, cooldown_s=60.0, alpha=0.3):
+        self.name = name
+        self.prior_latency_s = prior_latency_s
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.alpha = alpha
+        self.latency_ewma = None
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.successes = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def state(self, now=None):
+        if self.opened_at is None:
+            return 'closed'
+        now = time.monotonic() if now is None else now
+        if now - self.opened_at >= self.cooldown_s:
+            return 'half_open'
+        return 'open'
+
+    def allow(self, now=None):
+        return self.state(now) != 'open'
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return 1.0 - sum(self.outcomes) / len(self.outcomes)
+
+    def expected_latency(self):
+        """Expected seconds until a successful transcript, penalising flaky providers."""
+        latency = self.prior_latency_s if self.latency_ewma is None else self.latency_ewma
+        return latency / max(0.1, 1.0 - self.error_rate())
+
+    def record(self, ok, latency_s, now=None):
+        with self._lock:
+            self.outcomes.append(1 if ok else 0)
+            if ok:
+                self.successes += 1
+                self.consecutive_failures = 0
+                self.opened_at = None
+                if self.latency_ewma is None:
+                    self.latency_ewma = latency_s
+                else:
+                    self.latency_ewma = self.alpha * latency_s + (1 - self.alpha) * self.latency_ewma
+            else:
+                self.failures += 1
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= self.failure_threshold or self.opened_at is not None:
+                    self.opened_at = time.monotonic() if now is None else now
+
+    def snapshot(self):
+        return {
+            'state': self.state(),
+            'latency_ewma_s': None if self.latency_ewma is None else round(self.latency_ewma, 3),
+            'expected_latency_s': round(self.expected_latency(), 3),
+            'error_rate': round(self.error_rate(), 3),
+            'consecutive_failures': self.consecutive_failures,
+            'successes': self.successes,
+            'failures': self.failures,
+        }
+
+
+def guess_audio_mime(filename):
+    if filename.lower().endswith('.m4a'):
+        return 'audio/mp4'
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
 class ASRHandler:
-    def __init__(self):
+    def __init__(self, cache_backend=None):
         self.groq_key = os.getenv('ASR_GROQ_API_KEY')
         self.openai_key = os.getenv('ASR_OPENAI_API_KEY')
         self.gemini_key = os.getenv('ASR_GEMINI_API_KEY') or os.getenv('GEMINI_API_KEY')
         self.default_provider = os.getenv('ASR_DEFAULT_PROVIDER', 'groq').lower()
-        
+        self.timeouts = {
+            name: float(os.getenv(f'ASR_TIMEOUT_{name.upper()}', default))
+            for name, default in DEFAULT_TIMEOUTS.items()
+        }
+        self.max_concurrency = int(os.getenv('ASR_MAX_CONCURRENCY', '4'))
+        self.gemini_inline_limit = int(os.getenv('ASR_GEMINI_INLINE_LIMIT', GEMINI_INLINE_AUDIO_LIMIT))
+        self.segment_threshold_s = float(os.getenv('ASR_SEGMENT_THRESHOLD', '60'))
+        self.segment_s = float(os.getenv('ASR_SEGMENT_SECONDS', '30'))
+        self.segment_overlap_s = float(os.getenv('ASR_SEGMENT_OVERLAP', '1.5'))
+        if self.segment_overlap_s >= self.segment_s:
+            logger.warning(
+                f"ASR_SEGMENT_OVERLAP ({self.segment_overlap_s}s) must be shorter than "
+                f"ASR_SEGMENT_SECONDS ({self.segment_s}s); segments will advance by 1s"
+            )
+        # Blocking SDK calls run here so they never stall the event loop. A call
+        # abandoned by a provider timeout keeps its thread until the SDK's own
+        # HTTP timeout ends it, so the pool has room beyond the concurrency cap
+        # for such stragglers instead of queueing new clips behind them.
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(2 * self.max_concurrency, self.max_concurrency + 4), thread_name_prefix='asr'
+        )
+        self._semaphore = None
+        self.cache = TranscriptCache(int(os.getenv('ASR_CACHE_SIZE', '256')), backend=cache_backend)
+        self._inflight = {}
+
+        # Before any call is measured, the default provider is assumed fastest
+        failure_threshold = int(os.getenv('ASR_BREAKER_FAILURES', '3'))
+        cooldown_s = float(os.getenv('ASR_BREAKER_COOLDOWN', '60'))
+        self.stats = {
+            name: ProviderStats(
+                name,
+                prior_latency_s=1.0 if name == self.default_provider else 2.0,
+                failure_threshold=failure_threshold,
+                cooldown_s=cooldown_s,
+            )
+            for name in PROVIDERS
+        }
+
         self.groq_client = None
         self.openai_client = None
         
         if self.groq_key:
             try:
                 from groq import Groq
-                self.groq_client = Groq(api_key=self.groq_key)
+                self.groq_client = Groq(api_key=self.groq_key, timeout=self.timeouts['groq'])
             except ImportError:
                 logger.error("Groq library not installed")
             except Exception as e:
@@ -28,7 +318,7 @@ class ASRHandler:
         if self.openai_key:
             try:
                 from openai import OpenAI
-                self.openai_client = OpenAI(api_key=self.openai_key)
+                self.openai_client = OpenAI(api_key=self.openai_key, timeout=self.timeouts['openai'])
             except ImportError:
                 logger.error("OpenAI library not installed")
             except Exception as e:
@@ -41,79 +331,289 @@ class ASRHandler:
             except Exception as e:
                 logger.error(f"Failed to configure Gemini: {e}")
 
-    def transcribe_groq(self, file_path):
+    def transcribe_groq(self, audio, filename=DEFAULT_AUDIO_FILENAME):
         if not self.groq_client:
             raise Exception("Groq client not initialized (Check ASR_GROQ_API_KEY)")
         
-        with open(file_path, "rb") as file:
-            # Groq Whisper implementation
-            transcription = self.groq_client.audio.transcriptions.create(
-                file=file,
-                model="whisper-large-v3",
-                temperature=0,
-                response_format="text"
-            )
+        # Groq Whisper implementation; (filename, bytes) is sent as multipart without touching disk
+        transcription = self.groq_client.audio.transcriptions.create(
+            file=(filename, read_audio(audio)),
+            model="whisper-large-v3",
+            temperature=0,
+            response_format="text"
+        )
         return str(transcription)
 
-    def transcribe_openai(self, file_path):
+    def transcribe_openai(self, audio, filename=DEFAULT_AUDIO_FILENAME):
         if not self.openai_client:
             raise Exception("OpenAI client not initialized (Check ASR_OPENAI_API_KEY)")
             
-        with open(file_path, "rb") as audio_file:
-            transcription = self.openai_client.audio.transcriptions.create(
-                model="whisper-1", 
-                file=audio_file
-            )
+        transcription = self.openai_client.audio.transcriptions.create(
+            model="whisper-1", 
+            file=(filename, read_audio(audio))
+        )
         return transcription.text
 
-    def transcribe_gemini(self, file_path):
-        if not self.gemini_key:
-            raise Exception("Gemini key not configured")
-            
+    def _gemini_generate(self, audio_part):
         import google.generativeai as genai
         # Gemini 1.5 Flash is efficient for audio
         model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Upload the file
-        logger.info(f"Uploading file to Gemini: {file_path}")
-        audio_file = genai.upload_file(path=file_path)
-        
-        # Wait for processing if necessary (usually fast)
-        while audio_file.state.name == "PROCESSING":
-            time.sleep(1)
-            audio_file = genai.get_file(audio_file.name)
-
-        if audio_file.state.name == "FAILED":
-            raise Exception("Gemini file processing failed")
-
         response = model.generate_content(
-            ["Please transcribe this audio file exactly as it is spoken. Do not add any other text.", audio_file]
+            [GEMINI_TRANSCRIBE_PROMPT, audio_part],
+            request_options={"timeout": self.timeouts['gemini']},
         )
-        
         return response.text
 
-    def transcribe(self, file_path):
-        providers = [self.default_provider]
-        others = ['groq', 'openai', 'gemini']
-        if self.default_provider in others:
-            others.remove(self.default_provider)
-        random.shuffle(others)
-        providers.extend(others)
-        
+    def _gemini_upload(self, data, mime_type, filename):
+        import google.generativeai as genai
+        logger.info(f"Uploading {len(data)} bytes to Gemini: {filename}")
+        return genai.upload_file(path=io.BytesIO(data), mime_type=mime_type, display_name=filename)
+
+    def _gemini_get_file(self, name):
+        import google.generativeai as genai
+        return genai.get_file(name)
+
+    def _gemini_delete_file(self, name):
+        import google.generativeai as genai
+        try:
+            genai.delete_file(name)
+        except Exception as e:
+            logger.warning(f"Failed to delete Gemini file {name}: {e}")
+
+    def _gemini_prepare(self, audio, filename):
+        if not self.gemini_key:
+            raise Exception("Gemini key not configured")
+        data = read_audio(audio)
+        mime_type = guess_audio_mime(filename)
+        # Small clips go inline with the prompt: one request, no upload or polling
+        inline = len(data) <= self.gemini_inline_limit
+        return data, mime_type, inline
+
+    def transcribe_gemini(self, audio, filename=DEFAULT_AUDIO_FILENAME):
+        data, mime_type, inline = self._gemini_prepare(audio, filename)
+        if inline:
+            return self._gemini_generate({"mime_type": mime_type, "data": data})
+
+        audio_file = self._gemini_upload(data, mime_type, filename)
+        try:
+            delay = GEMINI_POLL_INITIAL_S
+            while audio_file.state.name == "PROCESSING":
+                time.sleep(delay)
+                delay = min(delay * 2, GEMINI_POLL_MAX_S)
+                audio_file = self._gemini_get_file(audio_file.name)
+
+            if audio_file.state.name == "FAILED":
+                raise Exception("Gemini file processing failed")
+
+            return self._gemini_generate(audio_file)
+        finally:
+            self._gemini_delete_file(audio_file.name)
+
+    async def transcribe_gemini_async(self, audio, filename=DEFAULT_AUDIO_FILENAME):
+        """Async `transcribe_gemini`: File API polling sleeps on the event loop, not in a pool thread."""
+        loop = asyncio.get_running_loop()
+        run = functools.partial(loop.run_in_executor, self._executor)
+
+        data, mime_type, inline = self._gemini_prepare(audio, filename)
+        if inline:
+            return await run(self._gemini_generate, {"mime_type": mime_type, "data": data})
+
+        # The upload finishes in its thread even if this attempt is cancelled
+        # meanwhile, so it is shielded and its file deleted in `finally` whenever
+        # it completes
+        upload = run(self._gemini_upload, data, mime_type, filename)
+        try:
+            audio_file = await asyncio.shield(upload)
+            delay = GEMINI_POLL_INITIAL_S
+            while audio_file.state.name == "PROCESSING":
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, GEMINI_POLL_MAX_S)
+                audio_file = await run(self._gemini_get_file, audio_file.name)
+
+            if audio_file.state.name == "FAILED":
+                raise Exception("Gemini file processing failed")
+
+            return await run(self._gemini_generate, audio_file)
+        finally:
+            # Shielded so the upload is deleted even when the provider timeout
+            # cancels this attempt mid-upload or mid-poll
+            await asyncio.shield(self._delete_upload(upload))
+
+    async def _delete_upload(self, upload):
+        try:
+            audio_file = await upload
+        except Exception:
+            return  # the upload itself failed; nothing to delete
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._gemini_delete_file, audio_file.name)
+
+    def _is_configured(self, provider):
+        return {
+            'groq': self.groq_client is not None,
+            'openai': self.openai_client is not None,
+            'gemini': bool(self.gemini_key),
+        }.get(provider, False)
+
+    def _provider_order(self):
+        """Configured providers by expected latency, skipping open breakers.
+
+        When every breaker is open they are all tried anyway rather than
+        failing the message outright.
+        """
+        providers = [p for p in PROVIDERS if self._is_configured(p)] or list(PROVIDERS)
+        providers.sort(key=lambda p: self.stats[p].expected_latency())
+        return [p for p in providers if self.stats[p].allow()] or providers
+
+    def provider_stats(self):
+        """Per-provider health (plus transcript cache counters) for the /metrics endpoint."""
+        stats = {name: stats.snapshot() for name, stats in self.stats.items()}
+        stats['cache'] = self.cache.snapshot()
+        return stats
+
+    def _provider_func(self, provider):
+        return {
+            'groq': self.transcribe_groq,
+            'openai': self.transcribe_openai,
+            'gemini': self.transcribe_gemini,
+        }.get(provider)
+
+    def _async_provider_func(self, provider):
+        """Coroutine function for `provider`; sync SDK calls are wrapped onto the ASR pool."""
+        if provider == 'gemini':
+            return self.transcribe_gemini_async
+        func = self._provider_func(provider)
+        if func is None:
+            return None
+
+        async def run(audio, filename):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, audio, filename))
+        return run
+
+    def transcribe(self, audio, filename=DEFAULT_AUDIO_FILENAME):
+        """Transcribe `audio` (bytes, file-like object or path), falling back across providers."""
+        audio = read_audio(audio)
+        key = audio_digest(audio)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
         last_error = None
         
-        for provider in providers:
+        for provider in self._provider_order():
+            func = self._provider_func(provider)
+            if func is None:
+                continue
+            started = time.monotonic()
             try:
                 logger.info(f"Attempting ASR with {provider}")
-                if provider == 'groq':
-                    return self.transcribe_groq(file_path)
-                elif provider == 'openai':
-                    return self.transcribe_openai(file_path)
-                elif provider == 'gemini':
-                    return self.transcribe_gemini(file_path)
+                text = func(audio, filename)
+                self.stats[provider].record(True, time.monotonic() - started)
+                self.cache.set(key, text)
+                return text
             except Exception as e:
+                self.stats[provider].record(False, time.monotonic() - started)
                 logger.warning(f"ASR failed with {provider}: {e}")
                 last_error = e
                 continue
         
         raise Exception(f"All ASR providers failed. Last error: {last_error}")
+
+    async def transcribe_async(self, audio, filename=DEFAULT_AUDIO_FILENAME, duration_ms=None):
+        """Same fallback chain as `transcribe`, without blocking the event loop.
+
+        Clips longer than ASR_SEGMENT_THRESHOLD seconds (per `duration_ms`, as
+        reported by LINE) are split into overlapping segments transcribed
+        concurrently and stitched back in order. A clip seen before (same
+        bytes, e.g. a forwarded voice message) is answered from the cache,
+        and identical clips arriving together share one transcription.
+        """
+        audio = read_audio(audio)
+        key = audio_digest(audio)
+
+        # The shared transcription is its own task, owned by no caller: one
+        # caller being cancelled never cancels the others. It is only
+        # cancelled when every caller waiting on it has gone away.
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.create_task(self._transcribe_shared(key, audio, filename, duration_ms))
+            entry = self._inflight[key] = {'task': task, 'waiters': 0}
+            task.add_done_callback(functools.partial(self._inflight_done, key))
+        entry['waiters'] += 1
+        try:
+            return await asyncio.shield(entry['task'])
+        except asyncio.CancelledError:
+            if entry['waiters'] == 1:
+                entry['task'].cancel()
+            raise
+        finally:
+            entry['waiters'] -= 1
+
+    async def _transcribe_shared(self, key, audio, filename, duration_ms):
+        text = await self._cache_call(self.cache.get, key)
+        if text is None:
+            text = await self._transcribe_uncached_async(audio, filename, duration_ms)
+            await self._cache_call(self.cache.set, key, text)
+        return text
+
+    def _inflight_done(self, key, task):
+        if self._inflight.get(key, {}).get('task') is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark retrieved so a failure nobody awaited is not logged as unhandled
+            task.exception()
+
+    async def _cache_call(self, func, *args):
+        # Only a persistent backend does I/O; the in-memory LRU is called inline
+        if self.cache.backend is None:
+            return func(*args)
+        return await asyncio.to_thread(func, *args)
+
+    async def _transcribe_uncached_async(self, audio, filename, duration_ms):
+        if duration_ms and duration_ms / 1000 > self.segment_threshold_s:
+            try:
+                return await self._transcribe_segmented_async(audio)
+            except Exception as e:
+                logger.warning(f"Segmented ASR failed, retrying as a single clip: {e}")
+        return await self._transcribe_single_async(audio, filename)
+
+    async def _transcribe_segmented_async(self, audio):
+        pcm = await decode_to_pcm(audio)
+        segments = split_pcm_to_wav(pcm, self.segment_s, self.segment_overlap_s)
+        logger.info(f"Transcribing {len(segments)} segments of {self.segment_s}s concurrently")
+        parts = await asyncio.gather(*(
+            self._transcribe_single_async(segment, f"segment_{i:03d}.wav")
+            for i, segment in enumerate(segments)
+        ))
+        return stitch_transcripts(parts)
+
+    async def _transcribe_single_async(self, audio, filename):
+        """One clip through the provider chain.
+
+        At most ASR_MAX_CONCURRENCY clips run at once; each provider attempt
+        is bounded by its ASR_TIMEOUT_<PROVIDER> setting.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        last_error = None
+
+        async with self._semaphore:
+            for provider in self._provider_order():
+                func = self._async_provider_func(provider)
+                if func is None:
+                    continue
+                started = time.monotonic()
+                try:
+                    logger.info(f"Attempting ASR with {provider}")
+                    text = await asyncio.wait_for(func(audio, filename), timeout=self.timeouts[provider])
+                    self.stats[provider].record(True, time.monotonic() - started)
+                    return text
+                except asyncio.TimeoutError:
+                    self.stats[provider].record(False, time.monotonic() - started)
+                    logger.warning(f"ASR timed out with {provider} after {self.timeouts[provider]}s")
+                    last_error = TimeoutError(f"{provider} timed out")
+                except Exception as e:
+                    self.stats[provider].record(False, time.monotonic() - started)
+                    logger.warning(f"ASR failed with {provider}: {e}")
+                    last_error = e
+
+        raise Exception(f"All ASR providers failed. Last error: {last_error}")
@@ -0,0 +1,195 @@
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+# handler(ctx) -> reply text, or a prebuilt FlexMessage ('' when the handler
+# already replied or has nothing to say)
+CommandHandler = Callable[["CommandContext"], Awaitable[Any]]
+
+COMMAND_PREFIX = "!"
+
+
+def normalize(text: str) -> str:
+    """Trim and fold the full-width prefix (！) to ASCII, once per message."""
+    return (text or "").strip().replace("！", COMMAND_PREFIX)
+
+
+@dataclass(frozen=True)
+class Command:
+    name: str
+    aliases: tuple
+    handler: CommandHandler
+    # False: neither the command nor its reply is kept in the conversation history.
+    records_history: bool = True
+    # True: does slow model work, so 1:1 chats get LINE's loading animation first.
+    slow: bool = False
+    # Admission-control path (e.g. 'llm') checked before the handler runs;
+    # None for cheap commands, which are never shed.
+    quota: Optional[str] = None
+    # Scheduler lane the whole event runs in ('interactive', 'llm', 'image', ...).
+    lane: str = "interactive"
+
+
+@dataclass
+class CommandMatch:
+    command: Command
+    alias: str
+    args: str
+
+    @property
+    def records_history(self) -> bool:
+        return self.command.records_history
+
+
+@dataclass
+class CommandContext:
+    """Everything a command handler may need from the webhook."""
+
+    event: Any
+    text: str
+    args: str
+    user_id: str
+    fdb: Any
+    user_chat_path: str
+    line_bot_api: Any
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    # time.monotonic() when the webhook arrived; decides reply vs push
+    received_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def group_id(self) -> Optional[str]:
+        return self.event.source.group_id if self.event.source.type == "group" else None
+
+
+def _is_ascii_word(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+def _command_start(text: str) -> int:
+    """Index of the command prefix, skipping only leading @mention tokens.
+
+    Returns -1 unless the prefix is the first non-space character after the
+    mentions, so `@Alice 聽說 !清空` (a quoted command) is not a command.
+    """
+    pos = 0
+    while pos < len(text):
+        if text[pos].isspace():
+            pos += 1
+        elif text[pos] == "@":
+            while pos < len(text) and not text[pos].isspace():
+                pos += 1
+        else:
+            break
+    return pos if text.startswith(COMMAND_PREFIX, pos) else -1
+
+
+def _strip_mentions(text: str, mentionees: Iterable[Any]) -> str:
+    """Drop the mention spans that open the message.
+
+    `index`/`length` come from LINE's `message.mention.mentionees` and count
+    UTF-16 code units, so a display name with spaces (`@David Chen`) is
+    removed whole. Mentions after the first other text are left in place.
+    """
+    spans = sorted(
+        (m.index, m.length) for m in mentionees
+        if getattr(m, "index", None) is not None and getattr(m, "length", None) is not None
+    )
+    if not spans:
+        return text
+    # UTF-16 offset -> str index; only differs when the text has astral characters (emoji)
+    offsets = []
+    for i, ch in enumerate(text):
+        offsets.append(i)
+        if ord(ch) > 0xFFFF:
+            offsets.append(i)
+    offsets.append(len(text))
+
+    def to_index(unit: int) -> int:
+        return offsets[min(unit, len(offsets) - 1)]
+
+    pos = 0
+    for index, length in spans:
+        start = to_index(index)
+        if start < pos or text[pos:start].strip():
+            break
+        pos = to_index(index + length)
+    return text[pos:]
+
+
+class CommandRouter:
+    """Maps `!alias [args]` messages to registered command handlers.
+
+    Aliases live in a character trie, so matching walks at most the length
+    of the longest alias no matter how many commands are registered. The
+    longest alias wins (e.g. `!生成圖片` over a hypothetical `!生成`). ASCII
+    aliases need a word boundary (`!clean` does not match `!cleanup`), CJK
+    ones may be followed directly by their argument (`!畫圖貓`). The command
+    must open the message, optionally after leading @mentions.
+    """
+
+    def __init__(self):
+        self._trie: Dict[str, Any] = {}
+        self.commands: List[Command] = []
+
+    def register(self, command: Command) -> Command:
+        for alias in command.aliases:
+            node = self._trie
+            for ch in alias.lower():
+                node = node.setdefault(ch, {})
+            if "" in node:
+                raise ValueError(f"Command alias {alias!r} already registered by {node[''].name}")
+            node[""] = command
+        self.commands.append(command)
+        return command
+
+    def command(
+        self, *aliases: str, records_history: bool = True, slow: bool = False,
+        quota: Optional[str] = None, lane: str = "interactive",
+    ) -> Callable[[CommandHandler], CommandHandler]:
+        """Decorator: `@router.command('help', '幫助', records_history=False)`."""
+
+        def decorator(handler: CommandHandler) -> CommandHandler:
+            self.register(Command(
+                name=aliases[0],
+                aliases=tuple(aliases),
+                handler=handler,
+                records_history=records_history,
+                slow=slow,
+                quota=quota,
+                lane=lane,
+            ))
+            return handler
+
+        return decorator
+
+    def match(self, text: str, mentionees: Optional[Iterable[Any]] = None) -> Optional[CommandMatch]:
+        """Match `text`; pass `message.mention.mentionees` so leading mentions are cut by span."""
+        if mentionees:
+            text = _strip_mentions(text or "", mentionees)
+        normalized = normalize(text)
+        start = _command_start(normalized)
+        if start < 0:
+            return None
+
+        lowered = normalized.lower()
+        node = self._trie
+        best: Optional[Command] = None
+        best_end = 0
+        pos = start + 1
+        while pos < len(lowered):
+            node = node.get(lowered[pos])
+            if node is None:
+                break
+            pos += 1
+            command = node.get("")
+            if command is not None and not (
+                _is_ascii_word(lowered[pos - 1]) and pos < len(lowered) and _is_ascii_word(lowered[pos])
+            ):
+                best, best_end = command, pos
+        if best is None:
+            return None
+        return CommandMatch(
+            command=best,
+            alias=normalized[start + 1:best_end],
+            args=normalized[best_end:].strip(),
+        )
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import line_content
+
+logger = logging.getLogger(__name__)
+
+# consumer(chunks) -> result; it reads the shared download as an async iterator.
+Consumer = Callable[[AsyncIterator[bytes]], Awaitable[Any]]
+
+# factory(context) -> Consumer, or None to sit this message out.
+ConsumerFactory = Callable[[Dict[str, Any]], Optional[Consumer]]
+
+# Chunks buffered per consumer before the download waits for it. With
+# 256 KiB LINE reads this bounds memory to ~1 MiB per consumer.
+DEFAULT_MAX_BUFFERED_CHUNKS = 4
+
+_END = object()
+
+
+class _SourceFailed:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+async def _drain(queue: asyncio.Queue) -> AsyncIterator[bytes]:
+    while True:
+        item = await queue.get()
+        if item is _END:
+            return
+        if isinstance(item, _SourceFailed):
+            raise item.exc
+        yield item
+
+
+async def _offer(queue: asyncio.Queue, task: asyncio.Task, item: Any) -> None:
+    # Wait for room in the consumer's queue, unless the consumer finishes (or dies) first.
+    if task.done():
+        return
+    put = asyncio.ensure_future(queue.put(item))
+    await asyncio.wait({put, task}, return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+
+
+async def fan_out(
+    chunks: AsyncIterable[bytes],
+    consumers: Dict[str, Consumer],
+    *,
+    max_buffered_chunks: int = DEFAULT_MAX_BUFFERED_CHUNKS,
+) -> Dict[str, Any]:
+    """Stream one chunk source to every consumer concurrently.
+
+    Each consumer reads from its own bounded queue, so the source advances
+    at the pace of the slowest consumer still reading and nothing buffers
+    more than `max_buffered_chunks`. A consumer that fails or returns early
+    is simply no longer fed; the others carry on.
+
+    Returns {name: result or exception}. If the source itself fails, every
+    consumer sees the error from its iterator and it is re-raised here.
+    """
+    queues = {name: asyncio.Queue(maxsize=max(1, max_buffered_chunks)) for name in consumers}
+    tasks = {name: asyncio.create_task(consumer(_drain(queues[name]))) for name, consumer in consumers.items()}
+    source_error: Optional[BaseException] = None
+    try:
+        try:
+            async for chunk in chunks:
+                live = [name for name, task in tasks.items() if not task.done()]
+                if not live:
+                    break
+                await asyncio.gather(*(_offer(queues[name], tasks[name], chunk) for name in live))
+            end: Any = _END
+        except Exception as e:
+            source_error = e
+            end = _SourceFailed(e)
+        await asyncio.gather(*(_offer(queues[name], task, end) for name, task in tasks.items()))
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    finally:
+        for task in tasks.values():
+            if not task.done():
+                task.cancel()
+
+    if source_error is not None:
+        raise source_error
+    return dict(zip(tasks, results))
+
+
+async def ingest_message_content(
+    *,
+    message_id: str,
+    access_token: str,
+    consumers: Dict[str, Consumer],
+    skip: int = 0,
+    max_buffered_chunks: int = DEFAULT_MAX_BUFFERED_CHUNKS,
+) -> Dict[str, Any]:
+    """Download a LINE message's content once and fan it out to `consumers`."""
+    return await fan_out(
+        line_content.iter_message_content(message_id=message_id, access_token=access_token, skip=skip),
+        consumers,
+        max_buffered_chunks=max_buffered_chunks,
+    )
+
+
+# -- stock consumers -----------------------------------------------------------
+
+
+async def sha256_consumer(chunks: AsyncIterator[bytes]) -> Tuple[str, int]:
+    """(hex digest, byte count) of the content."""
+    digest = hashlib.sha256()
+    size = 0
+    async for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class StreamDigest:
+    """SHA-256 taken in passing by a consumer that also forwards the bytes.
+
+    `tap(chunks)` yields the chunks unchanged, so a Drive upload can hash
+    its own stream instead of a second consumer (or download) doing it.
+    """
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    async def tap(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in chunks:
+            self._hash.update(chunk)
+            self.size += len(chunk)
+            yield chunk
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+def collect_consumer(max_bytes: Optional[int] = None) -> Consumer:
+    """Gather the content into memory, for consumers that need the whole body (e.g. ASR)."""
+
+    async def collect(chunks: AsyncIterator[bytes]) -> bytes:
+        buf = bytearray()
+        async for chunk in chunks:
+            buf += chunk
+            if max_bytes is not None and len(buf) > max_bytes:
+                raise ValueError(f"content exceeds {max_bytes} bytes")
+        return bytes(buf)
+
+    return collect
+
+
+class ConsumerRegistry:
+    """Extra consumers that tap into downloads of a given kind ("file", "audio", ...).
+
+    Registered factories are asked per message and may return None to skip
+    it. Their results are logged, never allowed to fail the main consumer.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, List[Tuple[str, ConsumerFactory]]] = {}
+
+    def register(self, kind: str, name: str, factory: ConsumerFactory) -> None:
+        self._factories.setdefault(kind, []).append((name, factory))
+
+    def build(self, kind: str, context: Dict[str, Any]) -> Dict[str, Consumer]:
+        consumers = {}
+        for name, factory in self._factories.get(kind, []):
+            try:
+                consumer = factory(context)
+            except Exception as e:
+                logger.warning(f"Content consumer {name} could not start: {e}")
+                continue
+            if consumer is not None:
+                consumers[name] = consumer
+        return consumers
+
+    @staticmethod
+    def report(results: Dict[str, Any], names: Any) -> None:
+        for name in names:
+            if isinstance(results.get(name), BaseException):
+                logger.warning(f"Content consumer {name} failed: {results[name]}")
@@ -1,24 +1,36 @@
+import asyncio
 import base64
 import hashlib
 import hmac
 import json
-import mimetypes
 import os
 import secrets
+import threading
 import time
-from dataclasses import dataclass
-from typing import Any, Dict, Optional, Tuple
-
-import requests
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import drive_export_async
+from drive_export_async import (  # noqa: F401  (re-exported for existing callers)
+    ACCESS_TOKEN_SAFETY_MARGIN_S,
+    DRIVE_CHUNK_ALIGNMENT,
+    DRIVE_UPLOAD_CHUNK_SIZE,
+    GOOGLE_DRIVE_FILES_URL,
+    GOOGLE_DRIVE_UPLOAD_URL,
+    GOOGLE_OAUTH_TOKEN_URL,
+    OAuthTokens,
+    drive_stream_upload,
+    is_session_expired,
+    is_unauthorized,
+)
+from token_crypto import decrypt_refresh_token, encrypt_refresh_token, get_encryption_key  # noqa: F401
 
 
 GOOGLE_OAUTH_AUTH_URL = "https://accounts.google.com/o/oauth2/v2/auth"
-GOOGLE_OAUTH_TOKEN_URL = "https://oauth2.googleapis.com/token"
-GOOGLE_DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
-GOOGLE_DRIVE_UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files"
 
 DRIVE_SCOPE_FILE = "https://www.googleapis.com/auth/drive.file"
 
+T = TypeVar("T")
+
 
 def now_ts() -> int:
     return int(time.time())
@@ -39,13 +51,6 @@ def generate_bind_code(prefix: str = "GDRIVE", length: int = 5) -> str:
     return f"{prefix}-{suffix}"
 
 
-def get_encryption_key() -> str:
-    key = os.getenv("TOKEN_ENCRYPTION_KEY")
-    if not key:
-        raise RuntimeError("TOKEN_ENCRYPTION_KEY is required")
-    return key
-
-
 def get_state_signing_key() -> str:
     key = os.getenv("OAUTH_STATE_SIGNING_KEY")
     if not key:
@@ -53,28 +58,6 @@ def get_state_signing_key() -> str:
     return key
 
 
-def encrypt_refresh_token(refresh_token: str) -> str:
-    try:
-        import importlib
-
-        Fernet = importlib.import_module("cryptography.fernet").Fernet
-    except Exception as e:
-        raise RuntimeError("cryptography is required for token encryption") from e
-    f = Fernet(get_encryption_key().encode("ascii"))
-    return f.encrypt(refresh_token.encode("utf-8")).decode("ascii")
-
-
-def decrypt_refresh_token(refresh_token_enc: str) -> str:
-    try:
-        import importlib
-
-        Fernet = importlib.import_module("cryptography.fernet").Fernet
-    except Exception as e:
-        raise RuntimeError("cryptography is required for token decryption") from e
-    f = Fernet(get_encryption_key().encode("ascii"))
-    return f.decrypt(refresh_token_enc.encode("ascii")).decode("utf-8")
-
-
 def _hmac_secret() -> bytes:
     return get_state_signing_key().encode("ascii")
 
@@ -151,13 +134,23 @@ def safe_filename(name: str, fallback: str = "file") -> str:
     return name
 
 
-@dataclass(frozen=True)
-class OAuthTokens:
-    access_token: str
-    expires_in: int
-    refresh_token: Optional[str]
-    scope: Optional[str]
-    token_type: Optional[str]
+# -- Sync API ---------------------------------------------------------------
+#
+# Thin wrappers over drive_export_async for callers without an event loop
+# (scripts, worker threads). They all run on one background loop so they
+# share a single pooled HTTP client.
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _run(coro: Awaitable[T]) -> T:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="drive-export-http", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
 
 
 def exchange_code_for_tokens(
@@ -168,52 +161,80 @@ def exchange_code_for_tokens(
     code: str,
     timeout_s: int = 20,
 ) -> OAuthTokens:
-    resp = requests.post(
-        GOOGLE_OAUTH_TOKEN_URL,
-        data={
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "code": code,
-            "redirect_uri": redirect_uri,
-            "grant_type": "authorization_code",
-        },
-        timeout=timeout_s,
-    )
-    resp.raise_for_status()
-    data = resp.json()
-    return OAuthTokens(
-        access_token=data["access_token"],
-        expires_in=int(data.get("expires_in", 0)),
-        refresh_token=data.get("refresh_token"),
-        scope=data.get("scope"),
-        token_type=data.get("token_type"),
-    )
+    return _run(drive_export_async.exchange_code_for_tokens(
+        client_id=client_id,
+        client_secret=client_secret,
+        redirect_uri=redirect_uri,
+        code=code,
+        timeout_s=timeout_s,
+    ))
 
 
-def refresh_access_token(
+def refresh_oauth_tokens(
     *,
     client_id: str,
     client_secret: str,
     refresh_token: str,
     timeout_s: int = 20,
-) -> str:
-    resp = requests.post(
-        GOOGLE_OAUTH_TOKEN_URL,
-        data={
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "refresh_token": refresh_token,
-            "grant_type": "refresh_token",
-        },
-        timeout=timeout_s,
-    )
-    resp.raise_for_status()
-    data = resp.json()
-    return data["access_token"]
+) -> OAuthTokens:
+    return _run(drive_export_async.refresh_oauth_tokens(
+        client_id=client_id,
+        client_secret=client_secret,
+        refresh_token=refresh_token,
+        timeout_s=timeout_s,
+    ))
 
 
-def _drive_headers(access_token: str) -> Dict[str, str]:
-    return {"Authorization": f"Bearer {access_token}"}
+def refresh_access_token(
+    *,
+    client_id: str,
+    client_secret: str,
+    refresh_token: str,
+    timeout_s: int = 20,
+) -> str:
+    return refresh_oauth_tokens(
+        client_id=client_id,
+        client_secret=client_secret,
+        refresh_token=refresh_token,
+        timeout_s=timeout_s,
+    ).access_token
+
+
+class AccessTokenCache:
+    """Sync facade over drive_export_async.AccessTokenCache.
+
+    Calls run on the shared background loop (`_run`), so sync callers get
+    the same reuse, single-flight refresh and 401 retry as async ones.
+    """
+
+    def __init__(self, safety_margin_s: int = ACCESS_TOKEN_SAFETY_MARGIN_S):
+        self._cache = drive_export_async.AccessTokenCache(safety_margin_s)
+
+    def get(self, group_id: str, *, refresh_token_enc: str, client_id: str, client_secret: str) -> str:
+        return _run(self._cache.get(
+            group_id, refresh_token_enc=refresh_token_enc, client_id=client_id, client_secret=client_secret,
+        ))
+
+    def invalidate(self, group_id: str) -> None:
+        self._cache.invalidate(group_id)
+
+    def call(
+        self,
+        group_id: str,
+        func: Callable[[str], T],
+        *,
+        refresh_token_enc: str,
+        client_id: str,
+        client_secret: str,
+    ) -> T:
+        """Run `func(access_token)`; on a 401 drop the cached token and retry once."""
+        return _run(self._cache.call(
+            group_id,
+            lambda access_token: asyncio.to_thread(func, access_token),
+            refresh_token_enc=refresh_token_enc,
+            client_id=client_id,
+            client_secret=client_secret,
+        ))
 
 
 def drive_find_folder(
@@ -223,35 +244,9 @@ def drive_find_folder(
     parent_id: Optional[str] = None,
     timeout_s: int = 20,
 ) -> Optional[Tuple[str, str]]:
-    # Returns (file_id, name) if found.
-
-    def esc(value: str) -> str:
-        # Google Drive query escaping for single-quoted strings.
-        return value.replace("'", "\\'")
-
-    q = [
-        "mimeType='application/vnd.google-apps.folder'",
-        f"name='{esc(name)}'",
-        "trashed=false",
-    ]
-    if parent_id:
-        q.append(f"'{parent_id}' in parents")
-
-    resp = requests.get(
-        GOOGLE_DRIVE_FILES_URL,
-        headers=_drive_headers(access_token),
-        params={
-            "q": " and ".join(q),
-            "fields": "files(id,name)",
-            "pageSize": 1,
-        },
-        timeout=timeout_s,
-    )
-    resp.raise_for_status()
-    files = resp.json().get("files", [])
-    if not files:
-        return None
-    return files[0]["id"], files[0].get("name", name)
+    return _run(drive_export_async.drive_find_folder(
+        access_token=access_token, name=name, parent_id=parent_id, timeout_s=timeout_s
+    ))
 
 
 def drive_create_folder(
@@ -261,20 +256,9 @@ def drive_create_folder(
     parent_id: Optional[str] = None,
     timeout_s: int = 20,
 ) -> Tuple[str, str]:
-    body: Dict[str, Any] = {"name": name, "mimeType": "application/vnd.google-apps.folder"}
-    if parent_id:
-        body["parents"] = [parent_id]
-
-    resp = requests.post(
-        GOOGLE_DRIVE_FILES_URL,
-        headers={**_drive_headers(access_token), "Content-Type": "application/json"},
-        json=body,
-        params={"fields": "id,name"},
-        timeout=timeout_s,
-    )
-    resp.raise_for_status()
-    data = resp.json()
-    return data["id"], data.get("name", name)
+    return _run(drive_export_async.drive_create_folder(
+        access_token=access_token, name=name, parent_id=parent_id, timeout_s=timeout_s
+    ))
 
 
 def drive_ensure_folder(
@@ -283,10 +267,45 @@ def drive_ensure_folder(
     name: str,
     parent_id: Optional[str] = None,
 ) -> Tuple[str, str]:
-    found = drive_find_folder(access_token=access_token, name=name, parent_id=parent_id)
-    if found:
-        return found
-    return drive_create_folder(access_token=access_token, name=name, parent_id=parent_id)
+    return _run(drive_export_async.drive_ensure_folder(
+        access_token=access_token, name=name, parent_id=parent_id
+    ))
+
+
+def drive_start_resumable_session(
+    *,
+    access_token: str,
+    filename: str,
+    folder_id: str,
+    mime_type: Optional[str] = None,
+    size: Optional[int] = None,
+    timeout_s: int = 20,
+) -> str:
+    return _run(drive_export_async.drive_start_resumable_session(
+        access_token=access_token,
+        filename=filename,
+        folder_id=folder_id,
+        mime_type=mime_type,
+        size=size,
+        timeout_s=timeout_s,
+    ))
+
+
+def drive_upload_chunk(
+    *,
+    upload_url: str,
+    chunk: bytes,
+    offset: int,
+    final: bool,
+    timeout_s: int = 60,
+) -> Tuple[int, Optional[str]]:
+    return _run(drive_export_async.drive_upload_chunk(
+        upload_url=upload_url, chunk=chunk, offset=offset, final=final, timeout_s=timeout_s
+    ))
+
+
+def drive_query_upload_status(*, upload_url: str, timeout_s: int = 20) -> Tuple[int, Optional[str]]:
+    return _run(drive_export_async.drive_query_upload_status(upload_url=upload_url, timeout_s=timeout_s))
 
 
 def drive_resumable_upload(
@@ -298,38 +317,11 @@ def drive_resumable_upload(
     mime_type: Optional[str] = None,
     timeout_s: int = 60,
 ) -> str:
-    if not mime_type:
-        mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
-
-    size = os.path.getsize(file_path)
-    metadata = {"name": filename, "parents": [folder_id]}
-
-    init_resp = requests.post(
-        f"{GOOGLE_DRIVE_UPLOAD_URL}?uploadType=resumable",
-        headers={
-            **_drive_headers(access_token),
-            "Content-Type": "application/json; charset=UTF-8",
-            "X-Upload-Content-Type": mime_type,
-            "X-Upload-Content-Length": str(size),
-        },
-        json=metadata,
-        timeout=timeout_s,
-    )
-    init_resp.raise_for_status()
-    upload_url = init_resp.headers.get("Location")
-    if not upload_url:
-        raise RuntimeError("Drive resumable upload did not return Location header")
-
-    with open(file_path, "rb") as f:
-        put_resp = requests.put(
-            upload_url,
-            headers={
-                "Content-Length": str(size),
-                "Content-Type": mime_type,
-            },
-            data=f,
-            timeout=timeout_s,
-        )
-    put_resp.raise_for_status()
-    data = put_resp.json()
-    return data["id"]
+    return _run(drive_export_async.drive_resumable_upload(
+        access_token=access_token,
+        file_path=file_path,
+        filename=filename,
+        folder_id=folder_id,
+        mime_type=mime_type,
+        timeout_s=timeout_s,
+    ))
@@ -0,0 +1,570 @@
+import asyncio
+import importlib.util
+import logging
+import mimetypes
+import os
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import httpx
+
+import token_crypto
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_OAUTH_TOKEN_URL = "https://oauth2.googleapis.com/token"
+GOOGLE_DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+GOOGLE_DRIVE_UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files"
+
+# Cached access tokens are dropped this many seconds before Google says they expire.
+ACCESS_TOKEN_SAFETY_MARGIN_S = 120
+
+# Resumable upload chunks must be multiples of 256 KiB (except the last one).
+DRIVE_CHUNK_ALIGNMENT = 256 * 1024
+DRIVE_UPLOAD_CHUNK_SIZE = 32 * DRIVE_CHUNK_ALIGNMENT  # 8 MiB
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class OAuthTokens:
+    access_token: str
+    expires_in: int
+    refresh_token: Optional[str]
+    scope: Optional[str]
+    token_type: Optional[str]
+
+
+# One pooled client per event loop: httpx clients cannot be shared across loops,
+# and the sync wrappers in drive_export run on their own background loop.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def get_client() -> httpx.AsyncClient:
+    """Shared keep-alive client for googleapis.com on the running loop (HTTP/2 when h2 is installed)."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        http2 = importlib.util.find_spec("h2") is not None
+        if not http2:
+            logger.warning("h2 not installed; Drive export falls back to HTTP/1.1 keep-alive")
+        client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=120),
+            timeout=httpx.Timeout(20.0),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def aclose() -> None:
+    """Close the running loop's client (call on application shutdown)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _tokens_from_json(data: Dict[str, Any]) -> OAuthTokens:
+    return OAuthTokens(
+        access_token=data["access_token"],
+        expires_in=int(data.get("expires_in", 0)),
+        refresh_token=data.get("refresh_token"),
+        scope=data.get("scope"),
+        token_type=data.get("token_type"),
+    )
+
+
+async def exchange_code_for_tokens(
+    *,
+    client_id: str,
+    client_secret: str,
+    redirect_uri: str,
+    code: str,
+    timeout_s: int = 20,
+) -> OAuthTokens:
+    resp = await get_client().post(
+        GOOGLE_OAUTH_TOKEN_URL,
+        data={
+            "client_id": client_id,
+            "client_secret": client_secret,
+            "code": code,
+            "redirect_uri": redirect_uri,
+            "grant_type": "authorization_code",
+        },
+        timeout=timeout_s,
+    )
+    resp.raise_for_status()
+    return _tokens_from_json(resp.json())
+
+
+async def refresh_oauth_tokens(
+    *,
+    client_id: str,
+    client_secret: str,
+    refresh_token: str,
+    timeout_s: int = 20,
+) -> OAuthTokens:
+    resp = await get_client().post(
+        GOOGLE_OAUTH_TOKEN_URL,
+        data={
+            "client_id": client_id,
+            "client_secret": client_secret,
+            "refresh_token": refresh_token,
+            "grant_type": "refresh_token",
+        },
+        timeout=timeout_s,
+    )
+    resp.raise_for_status()
+    return _tokens_from_json(resp.json())
+
+
+async def refresh_access_token(
+    *,
+    client_id: str,
+    client_secret: str,
+    refresh_token: str,
+    timeout_s: int = 20,
+) -> str:
+    tokens = await refresh_oauth_tokens(
+        client_id=client_id,
+        client_secret=client_secret,
+        refresh_token=refresh_token,
+        timeout_s=timeout_s,
+    )
+    return tokens.access_token
+
+
+def _http_status(exc: BaseException) -> Optional[int]:
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_unauthorized(exc: BaseException) -> bool:
+    return _http_status(exc) == 401
+
+
+def is_session_expired(exc: BaseException) -> bool:
+    # Resumable session URIs expire after a week, or once the upload was cancelled.
+    return _http_status(exc) in (404, 410)
+
+
+class AccessTokenCache:
+    """Per-group Google access tokens, reused until shortly before `expires_in`.
+
+    Refreshes are single-flight per group: concurrent uploads for the same
+    group wait for one token request instead of each hitting the OAuth
+    endpoint. An entry is tied to the encrypted refresh token it came from,
+    so rebinding a group to another account never reuses the old token.
+    """
+
+    def __init__(self, safety_margin_s: int = ACCESS_TOKEN_SAFETY_MARGIN_S):
+        self.safety_margin_s = safety_margin_s
+        self._entries: Dict[str, Tuple[str, str, float]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _cached(self, group_id: str, refresh_token_enc: str) -> Optional[str]:
+        entry = self._entries.get(group_id)
+        if entry and entry[0] == refresh_token_enc and time.monotonic() < entry[2]:
+            return entry[1]
+        return None
+
+    async def get(self, group_id: str, *, refresh_token_enc: str, client_id: str, client_secret: str) -> str:
+        token = self._cached(group_id, refresh_token_enc)
+        if token:
+            return token
+        async with self._locks.setdefault(group_id, asyncio.Lock()):
+            token = self._cached(group_id, refresh_token_enc)
+            if token:
+                return token
+            tokens = await refresh_oauth_tokens(
+                client_id=client_id,
+                client_secret=client_secret,
+                refresh_token=token_crypto.decrypt_refresh_token(refresh_token_enc),
+            )
+            expires_at = time.monotonic() + max(0, tokens.expires_in - self.safety_margin_s)
+            self._entries[group_id] = (refresh_token_enc, tokens.access_token, expires_at)
+            return tokens.access_token
+
+    def invalidate(self, group_id: str) -> None:
+        self._entries.pop(group_id, None)
+
+    async def call(
+        self,
+        group_id: str,
+        func: Callable[[str], Awaitable[T]],
+        *,
+        refresh_token_enc: str,
+        client_id: str,
+        client_secret: str,
+    ) -> T:
+        """Await `func(access_token)`; on a 401 drop the cached token and retry once."""
+        creds = {"refresh_token_enc": refresh_token_enc, "client_id": client_id, "client_secret": client_secret}
+        try:
+            return await func(await self.get(group_id, **creds))
+        except Exception as e:
+            if not is_unauthorized(e):
+                raise
+            self.invalidate(group_id)
+            return await func(await self.get(group_id, **creds))
+
+
+def _drive_headers(access_token: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {access_token}"}
+
+
+async def drive_find_folder(
+    *,
+    access_token: str,
+    name: str,
+    parent_id: Optional[str] = None,
+    timeout_s: int = 20,
+) -> Optional[Tuple[str, str]]:
+    # Returns (file_id, name) if found.
+
+    def esc(value: str) -> str:
+        # Google Drive query escaping for single-quoted strings.
+        return value.replace("'", "\\'")
+
+    q = [
+        "mimeType='application/vnd.google-apps.folder'",
+        f"name='{esc(name)}'",
+        "trashed=false",
+    ]
+    if parent_id:
+        q.append(f"'{parent_id}' in parents")
+
+    resp = await get_client().get(
+        GOOGLE_DRIVE_FILES_URL,
+        headers=_drive_headers(access_token),
+        params={
+            "q": " and ".join(q),
+            "fields": "files(id,name)",
+            "pageSize": 1,
+        },
+        timeout=timeout_s,
+    )
+    resp.raise_for_status()
+    files = resp.json().get("files", [])
+    if not files:
+        return None
+    return files[0]["id"], files[0].get("name", name)
+
+
+async def drive_create_folder(
+    *,
+    access_token: str,
+    name: str,
+    parent_id: Optional[str] = None,
+    timeout_s: int = 20,
+) -> Tuple[str, str]:
+    body: Dict[str, Any] = {"name": name, "mimeType": "application/vnd.google-apps.folder"}
+    if parent_id:
+        body["parents"] = [parent_id]
+
+    resp = await get_client().post(
+        GOOGLE_DRIVE_FILES_URL,
+        headers={**_drive_headers(access_token), "Content-Type": "application/json"},
+        json=body,
+        params={"fields": "id,name"},
+        timeout=timeout_s,
+    )
+    resp.raise_for_status()
+    data = resp.json()
+    return data["id"], data.get("name", name)
+
+
+async def drive_ensure_folder(
+    *,
+    access_token: str,
+    name: str,
+    parent_id: Optional[str] = None,
+) -> Tuple[str, str]:
+    found = await drive_find_folder(access_token=access_token, name=name, parent_id=parent_id)
+    if found:
+        return found
+    return await drive_create_folder(access_token=access_token, name=name, parent_id=parent_id)
+
+
+class FolderCache:
+    """Drive folder IDs by (parent_id, name), resolved once per process.
+
+    Resolution is single-flight per folder: a burst of uploads into the same
+    (possibly new) date folder waits for one find-or-create instead of each
+    racing to create its own duplicate folder.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._ids: Dict[Tuple[str, str], str] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+    async def ensure(self, *, access_token: str, name: str, parent_id: str) -> str:
+        key = (parent_id, name)
+        folder_id = self._ids.get(key)
+        if folder_id:
+            return folder_id
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            folder_id = self._ids.get(key)
+            if folder_id:
+                return folder_id
+            folder_id, _ = await drive_ensure_folder(access_token=access_token, name=name, parent_id=parent_id)
+            if len(self._ids) >= self.max_entries:
+                self._ids.clear()
+                self._locks = {k: v for k, v in self._locks.items() if v.locked()}
+            self._ids[key] = folder_id
+            return folder_id
+
+    async def ensure_path(self, *, access_token: str, parent_id: str, path: str) -> str:
+        """Resolve a slash-separated path such as "2026/10" below `parent_id`."""
+        folder_id = parent_id
+        for name in (part.strip() for part in path.split("/")):
+            if name:
+                folder_id = await self.ensure(access_token=access_token, name=name, parent_id=folder_id)
+        return folder_id
+
+    def invalidate(self) -> None:
+        # A deleted folder takes its children with it, so forget everything.
+        self._ids.clear()
+
+
+async def drive_start_resumable_session(
+    *,
+    access_token: str,
+    filename: str,
+    folder_id: str,
+    mime_type: Optional[str] = None,
+    size: Optional[int] = None,
+    timeout_s: int = 20,
+) -> str:
+    """Open a resumable upload session and return its session URI."""
+    if not mime_type:
+        mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    headers = {
+        **_drive_headers(access_token),
+        "Content-Type": "application/json; charset=UTF-8",
+        "X-Upload-Content-Type": mime_type,
+    }
+    if size is not None:
+        headers["X-Upload-Content-Length"] = str(size)
+
+    init_resp = await get_client().post(
+        f"{GOOGLE_DRIVE_UPLOAD_URL}?uploadType=resumable",
+        headers=headers,
+        json={"name": filename, "parents": [folder_id]},
+        timeout=timeout_s,
+    )
+    init_resp.raise_for_status()
+    upload_url = init_resp.headers.get("Location")
+    if not upload_url:
+        raise RuntimeError("Drive resumable upload did not return Location header")
+    return upload_url
+
+
+async def drive_file_exists(*, access_token: str, file_id: str, timeout_s: int = 20) -> bool:
+    """True if the file is still in Drive and not trashed."""
+    resp = await get_client().get(
+        f"{GOOGLE_DRIVE_FILES_URL}/{file_id}",
+        headers=_drive_headers(access_token),
+        params={"fields": "id,trashed"},
+        timeout=timeout_s,
+    )
+    if resp.status_code == 404:
+        return False
+    resp.raise_for_status()
+    return not resp.json().get("trashed", False)
+
+
+async def drive_create_shortcut(
+    *,
+    access_token: str,
+    name: str,
+    target_id: str,
+    folder_id: str,
+    timeout_s: int = 20,
+) -> str:
+    resp = await get_client().post(
+        GOOGLE_DRIVE_FILES_URL,
+        headers={**_drive_headers(access_token), "Content-Type": "application/json"},
+        json={
+            "name": name,
+            "mimeType": "application/vnd.google-apps.shortcut",
+            "parents": [folder_id],
+            "shortcutDetails": {"targetId": target_id},
+        },
+        params={"fields": "id"},
+        timeout=timeout_s,
+    )
+    resp.raise_for_status()
+    return resp.json()["id"]
+
+
+def _committed_bytes(resp: httpx.Response) -> int:
+    # 308 Resume Incomplete carries "Range: bytes=0-N" once anything is stored.
+    committed = resp.headers.get("Range")
+    if not committed:
+        return 0
+    return int(committed.rsplit("-", 1)[1]) + 1
+
+
+async def drive_upload_chunk(
+    *,
+    upload_url: str,
+    chunk: bytes,
+    offset: int,
+    final: bool,
+    timeout_s: int = 60,
+) -> Tuple[int, Optional[str]]:
+    """PUT one chunk of a resumable session.
+
+    Returns (committed_bytes, file_id); file_id is set once Drive has the
+    whole file. Until the final chunk the total size is sent as "*".
+    """
+    end = offset + len(chunk)
+    total = str(end) if final else "*"
+    content_range = f"bytes {offset}-{end - 1}/{total}" if chunk else f"bytes */{total}"
+
+    resp = await get_client().put(
+        upload_url,
+        headers={"Content-Length": str(len(chunk)), "Content-Range": content_range},
+        content=chunk,
+        timeout=timeout_s,
+    )
+    if resp.status_code == 308:
+        return _committed_bytes(resp), None
+    resp.raise_for_status()
+    return end, resp.json()["id"]
+
+
+async def drive_query_upload_status(*, upload_url: str, timeout_s: int = 20) -> Tuple[int, Optional[str]]:
+    """Ask a resumable session how much it has stored: (committed_bytes, file_id_if_complete)."""
+    resp = await get_client().put(
+        upload_url,
+        headers={"Content-Length": "0", "Content-Range": "bytes */*"},
+        timeout=timeout_s,
+    )
+    if resp.status_code == 308:
+        return _committed_bytes(resp), None
+    resp.raise_for_status()
+    data = resp.json()
+    return int(data.get("size", 0)), data["id"]
+
+
+async def drive_cancel_upload(*, upload_url: str, timeout_s: int = 20) -> None:
+    """Abandon a resumable session; Drive discards whatever it stored for it."""
+    resp = await get_client().delete(upload_url, timeout=timeout_s)
+    # Drive answers a cancelled session with 499 Client Closed Request.
+    if resp.status_code not in (499, 404, 410):
+        resp.raise_for_status()
+
+
+async def drive_stream_upload(
+    *,
+    upload_url: str,
+    chunks: AsyncIterable[bytes],
+    chunk_size: int = DRIVE_UPLOAD_CHUNK_SIZE,
+    offset: int = 0,
+    on_commit: Optional[Callable[[int], Awaitable[None]]] = None,
+    before_final: Optional[Callable[[int], Awaitable[bool]]] = None,
+) -> Optional[str]:
+    """Forward an async byte stream into a resumable session with bounded memory.
+
+    At most one Drive chunk plus one incoming piece is held at a time. The
+    last `chunk_size` bytes are held back until the stream ends so the final
+    PUT can declare the total size. To resume a session, pass the committed
+    `offset` and a stream that starts at that byte; `on_commit` is awaited
+    with the committed byte count after every intermediate chunk.
+
+    `before_final` is awaited with the total size once the stream has ended,
+    before the final PUT. If it returns False the session is cancelled
+    instead of completed and None is returned (e.g. the content turned out
+    to be a duplicate).
+    """
+    if chunk_size % DRIVE_CHUNK_ALIGNMENT:
+        raise ValueError("chunk_size must be a multiple of 256 KiB")
+
+    buf = bytearray()
+
+    async def send(piece: bytes, final: bool) -> Optional[str]:
+        nonlocal offset
+        committed, file_id = await drive_upload_chunk(
+            upload_url=upload_url, chunk=piece, offset=offset, final=final
+        )
+        if file_id is None and committed < offset + len(piece):
+            # Drive stored less than we sent; resend the remainder with the next chunk.
+            buf[:0] = piece[committed - offset:]
+        offset = committed
+        return file_id
+
+    async for data in chunks:
+        buf += data
+        while len(buf) > chunk_size:
+            piece = bytes(buf[:chunk_size])
+            del buf[:chunk_size]
+            await send(piece, final=False)
+            if on_commit is not None:
+                await on_commit(offset)
+
+    if before_final is not None and not await before_final(offset + len(buf)):
+        try:
+            await drive_cancel_upload(upload_url=upload_url)
+        except Exception as e:
+            # An abandoned session expires on its own after a week.
+            logger.warning(f"Failed to cancel Drive upload session: {e}")
+        return None
+
+    while True:
+        piece = bytes(buf)
+        buf.clear()
+        file_id = await send(piece, final=True)
+        if file_id:
+            return file_id
+        if not buf:
+            raise RuntimeError("Drive upload did not complete")
+
+
+async def _iter_file(file_path: str, read_size: int = DRIVE_UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    with open(file_path, "rb") as f:
+        while True:
+            data = await asyncio.to_thread(f.read, read_size)
+            if not data:
+                return
+            yield data
+
+
+async def drive_resumable_upload(
+    *,
+    access_token: str,
+    file_path: str,
+    filename: str,
+    folder_id: str,
+    mime_type: Optional[str] = None,
+    timeout_s: int = 60,
+) -> str:
+    if not mime_type:
+        mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    size = os.path.getsize(file_path)
+    upload_url = await drive_start_resumable_session(
+        access_token=access_token,
+        filename=filename,
+        folder_id=folder_id,
+        mime_type=mime_type,
+        size=size,
+        timeout_s=timeout_s,
+    )
+
+    put_resp = await get_client().put(
+        upload_url,
+        headers={
+            "Content-Length": str(size),
+            "Content-Type": mime_type,
+        },
+        content=_iter_file(file_path),
+        timeout=timeout_s,
+    )
+    put_resp.raise_for_status()
+    data = put_resp.json()
+    return data["id"]
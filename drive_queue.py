@@ -0,0 +1,481 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, Union
+
+logger = logging.getLogger(__name__)
+
+# Firebase index of every job that still has work left: {group_id}__{message_id}
+JOBS_INDEX_PATH = "drive_export_jobs"
+
+ACTIVE_STATUSES = ("queued", "running", "pending", "success")
+
+
+def uploads_path(group_id: str) -> str:
+    return f"groups/{group_id}/info/drive_export/uploads"
+
+
+def hashes_path(group_id: str, size: int) -> str:
+    # Content index bucketed by byte size: {sha256: {drive_file_id, message_id, file_name}}
+    return f"groups/{group_id}/info/drive_export/hashes/{size}"
+
+
+class PermanentJobError(Exception):
+    """A failure that retrying cannot fix (e.g. export disabled, content gone)."""
+
+
+class LeaseLostError(Exception):
+    """Another process took the job over; this attempt must stop without saving."""
+
+
+# transaction(path, name, update) -> written record or None. `update(current)`
+# returns the record to write, or None to leave it untouched; it may be called
+# again if another writer got there first.
+Transaction = Callable[[str, str, Callable[[Any], Optional[Dict[str, Any]]]], Optional[Dict[str, Any]]]
+
+
+def firebase_transaction(
+    base_url: str,
+    path: str,
+    name: str,
+    update: Callable[[Any], Optional[Dict[str, Any]]],
+    max_retries: int = 5,
+) -> Optional[Dict[str, Any]]:
+    """Atomic read-modify-write of one Firebase record using REST ETags.
+
+    The PUT only succeeds if the record is unchanged since the GET
+    (`if-match`); on a conflict the record is read again and `update` re-run.
+    """
+    import requests
+
+    url = f"{base_url.rstrip('/')}/{path}/{name}.json"
+    for _ in range(max_retries):
+        response = requests.get(url, headers={"X-Firebase-ETag": "true"}, timeout=10)
+        response.raise_for_status()
+        data = update(response.json())
+        if data is None:
+            return None
+        written = requests.put(url, json=data, headers={"if-match": response.headers["ETag"]}, timeout=10)
+        if written.status_code == 412:
+            continue
+        written.raise_for_status()
+        return data
+    raise RuntimeError(f"Firebase record {path}/{name} kept changing, gave up after {max_retries} tries")
+
+
+@dataclass
+class DriveJob:
+    group_id: str
+    message_id: str
+    file_name: str
+    file_size: Optional[int] = None
+    attempts: int = 0
+    session_uri: Optional[str] = None
+    committed_bytes: int = 0
+    created_at: int = field(default_factory=lambda: int(time.time()))
+
+    @property
+    def key(self) -> str:
+        return f"{self.group_id}__{self.message_id}"
+
+    @classmethod
+    def from_record(cls, group_id: str, message_id: str, record: Dict[str, Any]) -> "DriveJob":
+        return cls(
+            group_id=group_id,
+            message_id=message_id,
+            file_name=record.get("file_name") or f"line_file_{message_id}",
+            file_size=record.get("file_size"),
+            attempts=int(record.get("attempts") or 0),
+            session_uri=record.get("session_uri"),
+            committed_bytes=int(record.get("committed_bytes") or 0),
+            created_at=int(record.get("created_at") or time.time()),
+        )
+
+    def record(self, status: str, **extra: Any) -> Dict[str, Any]:
+        data = {
+            "status": status,
+            "file_name": self.file_name,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "updated_at": int(time.time()),
+        }
+        if self.file_size is not None:
+            data["file_size"] = self.file_size
+        if self.session_uri:
+            data["session_uri"] = self.session_uri
+            data["committed_bytes"] = self.committed_bytes
+        data.update(extra)
+        return data
+
+
+# runner(job, checkpoint) -> drive_file_id, or a dict of fields (including
+# drive_file_id) to store on the success record; checkpoint(job) persists
+# session progress.
+JobRunner = Callable[[DriveJob, Callable[[DriveJob], Awaitable[None]]], Awaitable[Union[str, Dict[str, Any]]]]
+
+
+class DriveUploadQueue:
+    """Durable Drive export queue backed by Firebase.
+
+    Each job lives in its group's `uploads/{message_id}` record (status,
+    attempts, next_attempt_at, resumable session URI and committed bytes)
+    and, while unfinished, in the global `drive_export_jobs` index so any
+    process can pick it up again after a restart. Failed attempts are
+    retried with exponential backoff up to `max_attempts`.
+
+    Up to `workers` jobs run at once, at most `group_concurrency` of them
+    from one group, so a burst of files dropped into a group uploads in
+    parallel without starving every other group.
+
+    Several processes may run the queue against the same Firebase. A job is
+    claimed by writing `owner` and `lease_until` on its record; the lease is
+    renewed while the upload runs, and a `running` job is only taken over
+    once its lease has expired (its owner crashed or hung). Claims, renewals
+    and result writes go through `transaction` — a conditional write such as
+    `firebase_transaction` — so two processes can never both own a job.
+    Without one, plain read-then-write is used, which is only safe when a
+    single process runs the queue.
+
+    `drain()` is the graceful counterpart of `stop()`: no new job starts,
+    running ones get a deadline to finish, and whatever is still uploading
+    after it is put back to `queued` with its resumable session, so the
+    next process continues from the last committed byte.
+    """
+
+    def __init__(
+        self,
+        fdb_factory: Callable[[], Any],
+        runner: JobRunner,
+        *,
+        workers: int = 8,
+        group_concurrency: int = 4,
+        max_attempts: int = 5,
+        retry_base_s: float = 30.0,
+        retry_max_s: float = 3600.0,
+        poll_interval_s: float = 30.0,
+        lease_s: float = 120.0,
+        worker_id: Optional[str] = None,
+        transaction: Optional[Transaction] = None,
+    ):
+        self._fdb_factory = fdb_factory
+        self._runner = runner
+        self._transaction = transaction
+        self.lease_s = lease_s
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.workers = workers
+        self.group_concurrency = max(1, group_concurrency)
+        self.max_attempts = max_attempts
+        self.retry_base_s = retry_base_s
+        self.retry_max_s = retry_max_s
+        self.poll_interval_s = poll_interval_s
+        self._ready: Optional[asyncio.Queue] = None
+        self._queued: Set[str] = set()
+        self._running: Dict[str, int] = defaultdict(int)
+        self._parked: Dict[str, Deque[str]] = defaultdict(deque)
+        self._tasks = []
+        self._inflight: Dict[str, DriveJob] = {}
+        self._draining = False
+        self._idle = asyncio.Event()
+
+    # -- persistence -------------------------------------------------------
+
+    async def _put(self, path: str, name: str, data: Any) -> None:
+        await asyncio.to_thread(lambda: self._fdb_factory().put(path, name, data))
+
+    async def _get(self, path: str, name: Optional[str]) -> Any:
+        return await asyncio.to_thread(lambda: self._fdb_factory().get(path, name))
+
+    async def _delete(self, path: str, name: str) -> None:
+        await asyncio.to_thread(lambda: self._fdb_factory().delete(path, name))
+
+    async def _transact(self, path: str, name: str, update: Callable[[Any], Optional[Dict[str, Any]]]) -> Any:
+        if self._transaction is not None:
+            return await asyncio.to_thread(self._transaction, path, name, update)
+
+        def read_then_write():
+            fdb = self._fdb_factory()
+            data = update(fdb.get(path, name))
+            if data is not None:
+                fdb.put(path, name, data)
+            return data
+
+        return await asyncio.to_thread(read_then_write)
+
+    def _owns(self, record: Any) -> bool:
+        return isinstance(record, dict) and record.get("owner") == self.worker_id
+
+    async def _save_owned(self, job: DriveJob, record: Dict[str, Any]) -> None:
+        """Write a job record only while this process still holds its lease."""
+        written = await self._transact(
+            uploads_path(job.group_id), job.message_id,
+            lambda current: record if self._owns(current) else None,
+        )
+        if written is None:
+            raise LeaseLostError(f"Drive upload {job.key} was taken over by another process")
+
+    async def _save(
+        self, job: DriveJob, status: str, next_attempt_at: Optional[int] = None, *, owned: bool = False, **extra: Any
+    ) -> None:
+        if owned:
+            await self._save_owned(job, job.record(status, **extra))
+        else:
+            await self._put(uploads_path(job.group_id), job.message_id, job.record(status, **extra))
+        await self._index(job, next_attempt_at)
+
+    async def _index(self, job: DriveJob, next_attempt_at: Optional[int]) -> None:
+        if next_attempt_at is None:
+            await self._delete(JOBS_INDEX_PATH, job.key)
+        else:
+            await self._put(JOBS_INDEX_PATH, job.key, {
+                "group_id": job.group_id,
+                "message_id": job.message_id,
+                "next_attempt_at": next_attempt_at,
+            })
+
+    # -- producer side -----------------------------------------------------
+
+    async def enqueue(self, job: DriveJob) -> None:
+        await self._save(job, "queued", next_attempt_at=int(time.time()))
+        self._push(job.key)
+
+    async def reject(self, job: DriveJob, reason: str) -> None:
+        """Record a job as failed without running it (e.g. shed by admission control)."""
+        await self._save(job, "failed", error=reason[:200])
+
+    async def requeue_failed(self, group_id: str) -> int:
+        """Reset every failed upload of a group back to queued (for `!drive retry`)."""
+        uploads = await self._get(uploads_path(group_id), None)
+        if not isinstance(uploads, dict):
+            return 0
+        count = 0
+        for message_id, record in uploads.items():
+            if not isinstance(record, dict) or record.get("status") != "failed":
+                continue
+            job = DriveJob.from_record(group_id, message_id, record)
+            job.attempts = 0
+            await self.enqueue(job)
+            count += 1
+        return count
+
+    def _push(self, key: str) -> None:
+        if self._ready is None or key in self._queued:
+            return
+        self._queued.add(key)
+        self._ready.put_nowait(key)
+
+    # -- workers -----------------------------------------------------------
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._draining = False
+        self._queued.clear()
+        self._running.clear()
+        self._parked.clear()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poller()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def drain(self, timeout_s: float) -> Dict[str, int]:
+        """Finish running uploads within `timeout_s`, checkpoint the rest, then stop.
+
+        Returns how many uploads finished during the drain and how many were
+        interrupted and left resumable.
+        """
+        self._draining = True
+        running = len(self._inflight)
+        if running:
+            logger.info(f"Waiting up to {timeout_s:.0f}s for {running} Drive upload(s)")
+            self._idle.clear()
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout_s)
+            except asyncio.TimeoutError:
+                pass
+        interrupted = len(self._inflight)
+        await self.stop()
+        if interrupted:
+            logger.warning(f"{interrupted} Drive upload(s) interrupted by shutdown, left resumable")
+        return {"finished": running - interrupted, "interrupted": interrupted}
+
+    async def _poller(self) -> None:
+        # Picks up jobs left by a previous process and retries whose backoff has elapsed.
+        while True:
+            try:
+                index = await self._get(JOBS_INDEX_PATH, None)
+                now = int(time.time())
+                for key, entry in (index or {}).items():
+                    if isinstance(entry, dict) and int(entry.get("next_attempt_at") or 0) <= now:
+                        self._push(key)
+            except Exception as e:
+                logger.warning(f"Drive job index scan failed: {e}")
+            await asyncio.sleep(self.poll_interval_s)
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            key = await self._ready.get()
+            if self._draining:
+                # Stays in the Firebase job index for the next process.
+                self._queued.discard(key)
+                continue
+            group_id = key.split("__", 1)[0]
+            if self._running[group_id] >= self.group_concurrency:
+                # Group is at its fan-out limit; resumed when one of its jobs finishes.
+                self._parked[group_id].append(key)
+                continue
+            self._running[group_id] += 1
+            try:
+                await self._process(key)
+            except Exception as e:
+                logger.error(f"Drive worker {n} crashed on {key}: {e}")
+            finally:
+                self._queued.discard(key)
+                self._release(group_id)
+
+    def _release(self, group_id: str) -> None:
+        self._running[group_id] -= 1
+        parked = self._parked.get(group_id)
+        if parked:
+            self._ready.put_nowait(parked.popleft())
+        if not parked:
+            self._parked.pop(group_id, None)
+        if self._running[group_id] <= 0:
+            del self._running[group_id]
+
+    def _backoff(self, attempts: int) -> float:
+        return min(self.retry_max_s, self.retry_base_s * (2 ** max(0, attempts - 1)))
+
+    async def _claim(self, group_id: str, message_id: str) -> Dict[str, Any]:
+        """Take the job's lease; returns {'job': ...}, {'gone': True} or {'held_by': owner}."""
+        now = time.time()
+        outcome: Dict[str, Any] = {}
+
+        def claim(record: Any) -> Optional[Dict[str, Any]]:
+            outcome.clear()
+            if not isinstance(record, dict) or record.get("status") not in ("queued", "running", "pending"):
+                # Finished, disabled or removed since it was indexed.
+                outcome["gone"] = True
+                return None
+            if (
+                record.get("status") == "running"
+                and not self._owns(record)
+                and float(record.get("lease_until") or 0) > now
+            ):
+                outcome["held_by"] = record.get("owner")
+                return None
+            job = DriveJob.from_record(group_id, message_id, record)
+            job.attempts += 1
+            outcome["job"] = job
+            return job.record("running", owner=self.worker_id, lease_until=now + self.lease_s)
+
+        await self._transact(uploads_path(group_id), message_id, claim)
+        return outcome
+
+    async def _renew(self, job: DriveJob, lease: Dict[str, Any]) -> None:
+        # Keeps the lease alive while the upload runs; if another process took
+        # the job over, the next checkpoint or result write raises LeaseLostError.
+        while not lease.get("lost"):
+            await asyncio.sleep(self.lease_s / 3)
+            lease_until = time.time() + self.lease_s
+
+            def renew(record: Any) -> Optional[Dict[str, Any]]:
+                if not self._owns(record) or record.get("status") != "running":
+                    return None
+                return {**record, "lease_until": lease_until, "updated_at": int(time.time())}
+
+            try:
+                async with lease["lock"]:
+                    renewed = await self._transact(uploads_path(job.group_id), job.message_id, renew)
+            except Exception as e:
+                logger.warning(f"Drive upload {job.key} lease renewal failed: {e}")
+                continue
+            if renewed is None:
+                logger.warning(f"Drive upload {job.key} lease lost")
+                lease["lost"] = True
+            else:
+                lease["lease_until"] = lease_until
+
+    async def _process(self, key: str) -> None:
+        group_id, message_id = key.split("__", 1)
+        outcome = await self._claim(group_id, message_id)
+        if outcome.get("gone"):
+            await self._delete(JOBS_INDEX_PATH, key)
+            return
+        if "held_by" in outcome:
+            # Another process is uploading it; the poller looks again after its lease.
+            logger.debug(f"Drive upload {key} is leased by {outcome['held_by']}")
+            return
+
+        job = outcome["job"]
+        # The lock keeps renewals from interleaving with checkpoints of the same job.
+        lease = {"lease_until": time.time() + self.lease_s, "lock": asyncio.Lock()}
+        # If this process dies, other processes take over once the lease expires.
+        await self._index(job, int(lease["lease_until"]))
+
+        async def checkpoint(j: DriveJob) -> None:
+            if lease.get("lost"):
+                raise LeaseLostError(f"Drive upload {j.key} was taken over by another process")
+            async with lease["lock"]:
+                await self._save_owned(j, j.record("running", owner=self.worker_id, lease_until=lease["lease_until"]))
+
+        self._inflight[key] = job
+        renewer = asyncio.create_task(self._renew(job, lease))
+        try:
+            try:
+                result = await self._runner(job, checkpoint)
+            except asyncio.CancelledError:
+                # Interrupted (shutdown): hand the job back right away with its
+                # session and committed bytes; this attempt does not count.
+                job.attempts -= 1
+                await asyncio.shield(self._save_released(job))
+                raise
+            except LeaseLostError as e:
+                logger.warning(f"{e}; abandoning this attempt")
+                return
+            except Exception as e:
+                permanent = isinstance(e, PermanentJobError)
+                try:
+                    if permanent or job.attempts >= self.max_attempts:
+                        logger.error(f"Drive upload {key} failed permanently after {job.attempts} attempts: {e}")
+                        await self._save(job, "failed", owned=True, error=str(e)[:200])
+                    else:
+                        delay = self._backoff(job.attempts)
+                        logger.warning(f"Drive upload {key} failed (attempt {job.attempts}), retry in {delay:.0f}s: {e}")
+                        await self._save(
+                            job, "queued", next_attempt_at=int(time.time() + delay), owned=True, error=str(e)[:200],
+                        )
+                        asyncio.get_running_loop().call_later(delay, self._push, key)
+                except LeaseLostError as lost:
+                    logger.warning(f"{lost}; not recording this attempt's failure")
+                return
+
+            job.session_uri = None
+            if not isinstance(result, dict):
+                result = {"drive_file_id": result}
+            try:
+                await self._save(job, "success", owned=True, **result)
+            except LeaseLostError as e:
+                logger.warning(f"{e}; not recording this attempt's result")
+        finally:
+            renewer.cancel()
+            self._inflight.pop(key, None)
+            if not self._inflight:
+                self._idle.set()
+
+    async def _save_released(self, job: DriveJob) -> None:
+        try:
+            await self._save(
+                job, "queued", next_attempt_at=int(time.time()), owned=True, error="interrupted by shutdown",
+            )
+        except LeaseLostError:
+            pass
@@ -1,15 +1,23 @@
+import re
+from functools import lru_cache
+from typing import List
+
 from linebot.v3.messaging import (
     FlexMessage,
+    FlexCarousel,
     FlexContainer
 )
 
-def create_flex_message(text: str, title: str = "AI 回應", author: str = "Gemini", header_text: str = "AI 助理") -> FlexMessage:
-    """
-    Create a Flex Message with the specified style.
-    """
-    
-    # Construct the Flex Message JSON structure
-    flex_json = {
+DEFAULT_TITLE = "AI 回應"
+DEFAULT_AUTHOR = "Gemini"
+DEFAULT_HEADER_TEXT = "AI 助理"
+
+# Placeholder for every field a reply fills in; the layout itself never changes.
+_PLACEHOLDER = "-"
+
+
+def _bubble_json(text: str, title: str, author: str, header_text: str) -> dict:
+    return {
         "type": "bubble",
         "header": {
             "type": "box",
@@ -85,7 +93,151 @@ def create_flex_message(text: str, title: str = "AI 回應", author: str = "Gemi
         }
     }
 
+
+def _copy(model, **update):
+    # Shallow copy without re-validation (pydantic v2 `model_copy`, v1 `copy`).
+    if hasattr(model, "model_copy"):
+        return model.model_copy(update=update)
+    return model.copy(update=update)
+
+
+class BubbleTemplate:
+    """
+    A bubble layout validated once; replies only swap in their text fields.
+
+    `FlexContainer.from_dict` runs full validation over every component, so
+    it is done here at import time. `render` copies just the four text
+    components that change (header, title, model name, body) and shares
+    every other component with the template.
+    """
+
+    def __init__(self):
+        self.bubble = FlexContainer.from_dict(
+            _bubble_json(_PLACEHOLDER, _PLACEHOLDER, _PLACEHOLDER, _PLACEHOLDER)
+        )
+        header, body = self.bubble.header, self.bubble.body
+        self._icon, self._header_text = header.contents
+        self._title, self._author, self._separator, self._text = body.contents
+
+    def render(self, text: str, title: str, author: str, header_text: str):
+        header = _copy(self.bubble.header, contents=[
+            self._icon,
+            _copy(self._header_text, text=header_text),
+        ])
+        body = _copy(self.bubble.body, contents=[
+            _copy(self._title, text=title),
+            _copy(self._author, text=f"Model: {author}"),
+            self._separator,
+            _copy(self._text, text=text),
+        ])
+        return _copy(self.bubble, header=header, body=body)
+
+
+_REPLY_TEMPLATE = BubbleTemplate()
+
+
+def create_flex_message(text: str, title: str = DEFAULT_TITLE, author: str = DEFAULT_AUTHOR, header_text: str = DEFAULT_HEADER_TEXT) -> FlexMessage:
+    """
+    Create a Flex Message with the specified style.
+    """
     return FlexMessage(
         alt_text=text[:400] if len(text) > 400 else text,
-        contents=FlexContainer.from_dict(flex_json)
+        contents=_REPLY_TEMPLATE.render(text, title, author, header_text)
     )
+
+
+@lru_cache(maxsize=32)
+def static_flex_message(text: str, title: str = DEFAULT_TITLE, author: str = DEFAULT_AUTHOR, header_text: str = DEFAULT_HEADER_TEXT) -> FlexMessage:
+    """
+    Flex Message for constant text (e.g. the help message), built once and reused.
+
+    The returned message is shared between replies and must not be modified.
+    """
+    return create_flex_message(text, title=title, author=author, header_text=header_text)
+
+
+
+# LINE accepts at most 5 messages per reply call.
+MAX_REPLY_MESSAGES = 5
+# Characters of answer text per bubble; keeps each bubble well under LINE's size limit.
+REPLY_PART_CHARS = 1800
+# Bubbles per carousel message when an answer needs more than MAX_REPLY_MESSAGES parts
+# (6 x ~6 KB of CJK text stays inside the carousel size limit).
+CAROUSEL_BUBBLES = 6
+
+TRUNCATED_NOTICE = "…（內容過長，已截斷）"
+
+# Where a part may end, from most to least preferred.
+_BREAKS = ("\n\n", "\n")
+_SENTENCE_END = re.compile(r"[。！？!?]|[.;；](?=\s)")
+
+
+def split_text(text: str, max_chars: int = REPLY_PART_CHARS) -> List[str]:
+    """
+    Split text into parts of at most `max_chars`, preferring paragraph, line
+    and sentence boundaries; only falls back to a hard cut when no boundary
+    exists in the second half of the window.
+    """
+    parts = []
+    rest = text.strip()
+    while len(rest) > max_chars:
+        window = rest[:max_chars]
+        cut = -1
+        for sep in _BREAKS:
+            pos = window.rfind(sep)
+            if pos >= max_chars // 2:
+                cut = pos + len(sep)
+                break
+        if cut < 0:
+            ends = [m.end() for m in _SENTENCE_END.finditer(window, max_chars // 2)]
+            if ends:
+                cut = ends[-1]
+        if cut < 0:
+            pos = window.rfind(" ")
+            cut = pos + 1 if pos >= max_chars // 2 else max_chars
+        parts.append(rest[:cut].rstrip())
+        rest = rest[cut:].lstrip()
+    if rest:
+        parts.append(rest)
+    return parts
+
+
+def compose_reply(
+    text: str,
+    title: str = DEFAULT_TITLE,
+    author: str = DEFAULT_AUTHOR,
+    header_text: str = DEFAULT_HEADER_TEXT,
+    max_messages: int = MAX_REPLY_MESSAGES,
+    part_chars: int = REPLY_PART_CHARS,
+) -> List[FlexMessage]:
+    """
+    Messages for one reply_message call carrying the complete answer.
+
+    Short answers are a single bubble. Longer ones become numbered bubbles
+    (up to `max_messages`) and beyond that carousels of CAROUSEL_BUBBLES
+    bubbles each; only text past what five carousels can hold is cut.
+    """
+    parts = split_text(text, part_chars)
+    if len(parts) <= 1:
+        return [create_flex_message(text, title=title, author=author, header_text=header_text)]
+
+    per_message = 1 if len(parts) <= max_messages else CAROUSEL_BUBBLES
+    capacity = max_messages * per_message
+    if len(parts) > capacity:
+        parts = parts[:capacity]
+        parts[-1] = parts[-1][:part_chars - len(TRUNCATED_NOTICE)] + TRUNCATED_NOTICE
+
+    total = len(parts)
+    bubbles = [
+        _REPLY_TEMPLATE.render(part, f"{title} ({i}/{total})", author, header_text)
+        for i, part in enumerate(parts, start=1)
+    ]
+    messages = []
+    for start in range(0, total, per_message):
+        group = bubbles[start:start + per_message]
+        alt = parts[start]
+        messages.append(FlexMessage(
+            alt_text=alt[:400] if len(alt) > 400 else alt,
+            contents=group[0] if per_message == 1 else FlexCarousel(contents=group),
+        ))
+    return messages
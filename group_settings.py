@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Change feed: {group_id: last_changed_at}. Writers bump it so other processes
+# listening on this small node drop their cached copy.
+CHANGES_PATH = "group_settings_changes"
+
+_MISSING = object()
+
+
+def settings_path(group_id: str) -> str:
+    return f"groups/{group_id}/info"
+
+
+class GroupSettingsCache:
+    """In-process TTL cache of per-group settings nodes (`groups/{group_id}/info/{name}`).
+
+    Absent nodes are cached too, so groups without e.g. Drive export do not
+    hit Firebase on every message. Writes made through this cache update
+    Firebase, drop the local entry and bump the change feed; `listen()`
+    follows that feed so other workers invalidate within a round trip
+    instead of waiting for the TTL.
+
+    The cached value is the whole node as last read. Children written
+    elsewhere (e.g. Drive `uploads` records) may be stale; read those from
+    Firebase directly.
+    """
+
+    def __init__(self, fdb_factory: Callable[[], Any], ttl_s: float = 60.0, max_entries: int = 4096):
+        self._fdb_factory = fdb_factory
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # -- reads ---------------------------------------------------------------
+
+    def _cached(self, key: Tuple[str, str]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() < entry[0]:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return _MISSING
+
+    def _store(self, key: Tuple[str, str], value: Any) -> None:
+        if self.ttl_s <= 0:
+            return
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                now = time.monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[key] = (time.monotonic() + self.ttl_s, value)
+
+    def get(self, group_id: str, name: str) -> Any:
+        """Blocking read; prefer `aget` on the event loop."""
+        key = (group_id, name)
+        value = self._cached(key)
+        if value is _MISSING:
+            value = self._fdb_factory().get(settings_path(group_id), name)
+            self._store(key, value)
+        return value
+
+    async def aget(self, group_id: str, name: str) -> Any:
+        key = (group_id, name)
+        value = self._cached(key)
+        if value is _MISSING:
+            value = await asyncio.to_thread(self._fdb_factory().get, settings_path(group_id), name)
+            self._store(key, value)
+        return value
+
+    # -- writes --------------------------------------------------------------
+
+    def set(self, group_id: str, name: str, value: Any) -> None:
+        fdb = self._fdb_factory()
+        fdb.put(settings_path(group_id), name, value)
+        self._changed(fdb, group_id, name)
+
+    def set_field(self, group_id: str, name: str, field: str, value: Any) -> None:
+        fdb = self._fdb_factory()
+        fdb.put(f"{settings_path(group_id)}/{name}", field, value)
+        self._changed(fdb, group_id, name)
+
+    def delete(self, group_id: str, name: str) -> None:
+        fdb = self._fdb_factory()
+        fdb.delete(settings_path(group_id), name)
+        self._changed(fdb, group_id, name)
+
+    def _changed(self, fdb: Any, group_id: str, name: str) -> None:
+        self.invalidate(group_id, name)
+        try:
+            fdb.put(CHANGES_PATH, group_id, int(time.time() * 1000))
+        except Exception as e:
+            # Other workers fall back to the TTL.
+            logger.warning(f"Failed to publish settings change for {group_id}: {e}")
+
+    def invalidate(self, group_id: Optional[str] = None, name: Optional[str] = None) -> None:
+        with self._lock:
+            if group_id is None:
+                self._entries.clear()
+            elif name is not None:
+                self._entries.pop((group_id, name), None)
+            else:
+                self._entries = {k: v for k, v in self._entries.items() if k[0] != group_id}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    # -- cross-process invalidation -------------------------------------------
+
+    def handle_event(self, event: str, payload: Dict[str, Any]) -> None:
+        """Apply one Firebase streaming event from the change feed."""
+        if event not in ("put", "patch"):
+            if event in ("cancel", "auth_revoked"):
+                self.invalidate()
+            return
+        path = (payload.get("path") or "/").strip("/")
+        if path:
+            self.invalidate(path.split("/", 1)[0])
+        elif event == "patch" and isinstance(payload.get("data"), dict):
+            for group_id in payload["data"]:
+                self.invalidate(group_id)
+        else:
+            # Initial snapshot after (re)connecting: anything may have changed meanwhile.
+            self.invalidate()
+
+    async def listen(self, firebase_url: str, retry_max_s: float = 60.0) -> None:
+        """Follow the change feed over Firebase's REST streaming API until cancelled."""
+        import aiohttp
+
+        url = f"{firebase_url.rstrip('/')}/{CHANGES_PATH}.json"
+        delay = 1.0
+        while True:
+            try:
+                timeout = aiohttp.ClientTimeout(total=None, sock_read=120)
+                async with aiohttp.ClientSession(timeout=timeout) as session:
+                    async with session.get(url, headers={"Accept": "text/event-stream"}) as resp:
+                        resp.raise_for_status()
+                        delay = 1.0
+                        event = None
+                        async for raw in resp.content:
+                            line = raw.decode("utf-8").strip()
+                            if line.startswith("event:"):
+                                event = line[6:].strip()
+                            elif line.startswith("data:") and event:
+                                data = line[5:].strip()
+                                payload = json.loads(data) if data and data != "null" else {}
+                                self.handle_event(event, payload if isinstance(payload, dict) else {})
+                                event = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Group settings listener disconnected: {e}")
+            # Changes may have been missed while disconnected.
+            self.invalidate()
+            await asyncio.sleep(delay)
+            delay = min(retry_max_s, delay * 2)
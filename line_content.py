@@ -0,0 +1,49 @@
+from typing import AsyncIterator
+
+import aiohttp
+
+
+LINE_DATA_API_BASE = "https://api-data.line.me"
+
+# Read size for streamed message content.
+LINE_CONTENT_READ_SIZE = 256 * 1024
+
+
+class ContentGoneError(Exception):
+    """LINE no longer has the message content (expired or deleted)."""
+
+
+async def iter_message_content(
+    *,
+    message_id: str,
+    access_token: str,
+    read_size: int = LINE_CONTENT_READ_SIZE,
+    skip: int = 0,
+    connect_timeout_s: float = 30,
+    read_timeout_s: float = 120,
+) -> AsyncIterator[bytes]:
+    """Stream a message's content (file, audio, ...) from the LINE data API.
+
+    Unlike AsyncMessagingApiBlob.get_message_content this never holds the
+    whole body in memory. The first `skip` bytes are read and discarded,
+    which is how an interrupted upload resumes from its committed offset.
+
+    There is no overall deadline: a large file may take far longer than any
+    fixed total, including the time the consumer spends on each chunk (e.g.
+    a Drive PUT). Only connecting and each socket read are bounded.
+    """
+    url = f"{LINE_DATA_API_BASE}/v2/bot/message/{message_id}/content"
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout_s, sock_read=read_timeout_s)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.get(url, headers={"Authorization": f"Bearer {access_token}"}) as resp:
+            if resp.status in (404, 410):
+                raise ContentGoneError(f"LINE content for {message_id} is gone ({resp.status})")
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(read_size):
+                if skip:
+                    dropped = min(skip, len(chunk))
+                    chunk = chunk[dropped:]
+                    skip -= dropped
+                    if not chunk:
+                        continue
+                yield chunk
@@ -0,0 +1,99 @@
+import logging
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from linebot.v3.messaging import (
+    PushMessageRequest,
+    ReplyMessageRequest,
+    ShowLoadingAnimationRequest,
+)
+
+logger = logging.getLogger(__name__)
+
+# LINE reply tokens are only good for about a minute after the event; past this
+# age a reply is not even attempted.
+DEFAULT_REPLY_TOKEN_TTL_S = 50.0
+
+# The loading animation accepts 5..60 seconds in steps of 5.
+DEFAULT_LOADING_SECONDS = 20
+
+
+def push_target(source: Any) -> Optional[str]:
+    """The chat a push message should go to: the group, room or 1:1 user of the event."""
+    if source.type == 'group':
+        return source.group_id
+    if source.type == 'room':
+        return source.room_id
+    return getattr(source, 'user_id', None)
+
+
+def is_invalid_reply_token(exc: BaseException) -> bool:
+    # LINE answers 400 {"message": "Invalid reply token"} for expired or reused tokens.
+    status = getattr(exc, 'status', None)
+    body = str(getattr(exc, 'body', '') or exc)
+    return status == 400 and 'reply token' in body.lower()
+
+
+class ReplySender:
+    """
+    Sends an event's answer with reply_message while its token is fresh and
+    falls back to push_message once the token is too old or LINE rejects it,
+    so slow Gemini / image work never loses the answer. Push messages count
+    against the monthly quota, so every fallback is counted in `stats()`.
+    """
+
+    def __init__(self, reply_ttl_s: float = DEFAULT_REPLY_TOKEN_TTL_S, loading_seconds: int = DEFAULT_LOADING_SECONDS):
+        self.reply_ttl_s = reply_ttl_s
+        # 0 or less turns the animation off; otherwise LINE accepts multiples of 5 in 5..60
+        loading_seconds = int(loading_seconds)
+        self.loading_seconds = min(60, max(5, loading_seconds // 5 * 5)) if loading_seconds > 0 else 0
+        self._counts = Counter()
+
+    def token_age(self, received_at: float) -> float:
+        return time.monotonic() - received_at
+
+    async def send(self, line_bot_api, event, messages: List[Any], received_at: float) -> str:
+        """Deliver `messages` for `event`; returns 'reply' or 'push'."""
+        reply_token = getattr(event, 'reply_token', None)
+        age = self.token_age(received_at)
+        if reply_token and age < self.reply_ttl_s:
+            try:
+                await line_bot_api.reply_message(ReplyMessageRequest(reply_token=reply_token, messages=messages))
+                self._counts['reply'] += 1
+                return 'reply'
+            except Exception as e:
+                if not is_invalid_reply_token(e):
+                    self._counts['failed'] += 1
+                    raise
+                self._counts['push_invalid_token'] += 1
+                logger.warning(f"Reply token rejected after {age:.1f}s, falling back to push")
+        else:
+            self._counts['push_expired'] += 1
+            logger.info(f"Reply token is {age:.1f}s old, sending as push")
+
+        to = push_target(event.source)
+        if not to:
+            self._counts['failed'] += 1
+            raise RuntimeError('No push target for event')
+        try:
+            await line_bot_api.push_message(PushMessageRequest(to=to, messages=messages))
+        except Exception:
+            self._counts['failed'] += 1
+            raise
+        return 'push'
+
+    async def show_loading(self, line_bot_api, event) -> None:
+        """Show the typing indicator while work runs (LINE only supports it in 1:1 chats)."""
+        if event.source.type != 'user' or self.loading_seconds <= 0:
+            return
+        try:
+            await line_bot_api.show_loading_animation(ShowLoadingAnimationRequest(
+                chat_id=event.source.user_id,
+                loading_seconds=self.loading_seconds,
+            ))
+        except Exception as e:
+            logger.debug(f"Loading animation failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {key: self._counts[key] for key in ('reply', 'push_expired', 'push_invalid_token', 'failed')}
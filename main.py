@@ -3,9 +3,10 @@ import os
 import sys
 import mimetypes
 import uuid
-import tempfile
 import asyncio
+import functools
 import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 if os.getenv('API_ENV') != 'production':
     from dotenv import load_dotenv
@@ -14,34 +15,41 @@ if os.getenv('API_ENV') != 'production':
 
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from linebot.v3.webhook import WebhookParser
 from linebot.v3.messaging import (
     AsyncApiClient,
     AsyncMessagingApi,
-    AsyncMessagingApiBlob,
     Configuration,
-    ReplyMessageRequest,
     PushMessageRequest,
+    FlexMessage,
     ImageMessage)
 from linebot.v3.exceptions import (
     InvalidSignatureError
 )
 from linebot.v3.webhooks import (
+    Event,
     MessageEvent,
     TextMessageContent,
     AudioMessageContent,
     FileMessageContent
 )
-import google.generativeai as genai
-from google import genai as genai_v2
-from google.genai import types
-from google.cloud import storage
-import uvicorn
 from firebase import firebase
-from flex_msg import create_flex_message
+from flex_msg import compose_reply, create_flex_message, static_flex_message
 from asr import ASRHandler
 import drive_export
+import drive_export_async
+import drive_queue
+import line_content
+import content_ingest
+import quota
+import commands
+import line_reply
+import scheduler
+import startup
+import work_queue
+from group_settings import GroupSettingsCache
+from mentions import BotMentionDetector
 
 logging.basicConfig(
     level=os.getenv('LOG', 'INFO'),
@@ -49,10 +57,76 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__file__)
 
-app = FastAPI()
 
-# Initialize ASR Handler
-asr_handler = ASRHandler()
+
+@asynccontextmanager
+async def lifespan(app):
+    global line_api_client, line_bot_api
+    line_api_client = AsyncApiClient(configuration)
+    line_bot_api = AsyncMessagingApi(line_api_client)
+    if not bot_mentions.bot_user_id:
+        warmup.add_step('line_bot_info', load_bot_user_id)
+    # 不等預熱完成就開始服務：/health 立即可用，/ready 在預熱結束後才回 200
+    warmup.start()
+    queue_consumer = None
+    if worker_role != 'intake':
+        drive_upload_queue.start()
+        if shared_queue is not None:
+            queue_consumer = work_queue.WorkQueueConsumer(
+                shared_queue,
+                lanes,
+                handle_queued_event,
+                lease_s=float(os.getenv('WORK_QUEUE_LEASE', work_queue.DEFAULT_LEASE_S)),
+            )
+            queue_consumer.start()
+            logging.info(f"Consuming shared work queue as {queue_consumer.worker_id}")
+    settings_listener = None
+    if firebase_url and os.getenv('GROUP_SETTINGS_LISTEN', '').lower() in ('1', 'true', 'yes'):
+        settings_listener = asyncio.create_task(group_settings.listen(firebase_url))
+    yield
+    await shutdown(queue_consumer, settings_listener)
+
+
+async def shutdown(queue_consumer, settings_listener):
+    """
+    優雅關機：不再接收新工作，在 SHUTDOWN_TIMEOUT 秒內讓排隊與執行中的工作完成，
+    未完成的 Drive 上傳保存續傳進度、共用佇列的事件立即交還給其他 worker，最後關閉連線。
+    """
+    global accepting_events
+    accepting_events = False
+    started = time.monotonic()
+    await warmup.cancel()
+    if settings_listener:
+        settings_listener.cancel()
+    if queue_consumer:
+        await queue_consumer.pause()
+
+    # 事件與 Drive 上傳共用同一個期限同時收尾；事件中新排入的上傳留在 Firebase 索引由下個程序接手
+    lane_report, drive_report = await asyncio.gather(
+        lanes.drain(shutdown_timeout_s),
+        drive_upload_queue.drain(shutdown_timeout_s),
+    )
+    if queue_consumer:
+        await queue_consumer.stop()
+
+    if lane_report['unfinished']:
+        if shared_queue is not None:
+            logging.warning(f"Shutdown: {lane_report['unfinished']} event(s) returned to the shared work queue")
+        else:
+            # 沒有共用佇列時事件只在記憶體中，無法續做
+            logging.error(
+                f"Shutdown: {lane_report['unfinished']} event(s) dropped unfinished: {lane_report['unfinished_keys']}"
+            )
+    logging.info(
+        f"Shutdown finished in {time.monotonic() - started:.1f}s: "
+        f"events finished={lane_report['finished']} unfinished={lane_report['unfinished']}, "
+        f"drive uploads finished={drive_report['finished']} resumable={drive_report['interrupted']}"
+    )
+    await drive_export_async.aclose()
+    await line_api_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 channel_secret = os.getenv('LINE_CHANNEL_SECRET', None)
 channel_access_token = os.getenv('LINE_CHANNEL_ACCESS_TOKEN', None)
@@ -69,9 +143,35 @@ configuration = Configuration(
 
 parser = WebhookParser(channel_secret)
 
+# 共用的 LINE Messaging API client（lifespan 建立與關閉）：lane 中的背景工作在 webhook 回應後仍會使用
+line_api_client = None
+line_bot_api = None
+
 
 firebase_url = os.getenv('FIREBASE_URL')
 
+
+class FirebaseTranscriptStore:
+    """語音轉錄快取的持久層：asr_transcripts/{音訊 SHA-256}"""
+
+    def get(self, key):
+        record = firebase.FirebaseApplication(firebase_url, None).get('asr_transcripts', key)
+        return record.get('text') if isinstance(record, dict) else None
+
+    def set(self, key, text):
+        firebase.FirebaseApplication(firebase_url, None).put('asr_transcripts', key, {
+            'text': text,
+            'created_at': int(time.time()),
+        })
+
+
+# 群組設定快取（drive_export 等），本程序寫入時立即失效，其他 worker 靠 TTL 或變更監聽
+group_settings = GroupSettingsCache(
+    lambda: firebase.FirebaseApplication(firebase_url, None),
+    ttl_s=float(os.getenv('GROUP_SETTINGS_TTL', '60')),
+)
+
+
 # Gemini LLM 設定（文字對話、摘要等）
 gemini_llm_key = os.getenv('GEMINI_LLM_API_KEY')
 gemini_llm_model = os.getenv('GEMINI_LLM_MODEL', 'gemini-flash-latest')
@@ -89,42 +189,137 @@ if not gemini_llm_model and os.getenv('GEMINI_MODEL'):
     gemini_llm_model = os.getenv('GEMINI_MODEL')
 
 bot_line_id = os.getenv('LINE_BOT_ID', '377mwhqu')  # Bot 的 LINE ID
+# Bot 自己的 userId 於啟動時取得（或以 LINE_BOT_USER_ID 指定）
+bot_mentions = BotMentionDetector(bot_user_id=os.getenv('LINE_BOT_USER_ID'), bot_line_id=bot_line_id)
 
 # Google Cloud Storage 設定
 gcs_bucket_name = os.getenv('GCS_BUCKET_NAME')  # 你的 Google Cloud Storage bucket 名稱
 gcs_credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')  # Google Cloud 認證檔案路徑
 
 
-# Initialize the Gemini LLM API
-genai.configure(api_key=gemini_llm_key)
+# 外部 client 延遲建立：匯入 main.py 時不做任何網路呼叫或重量級 import，
+# 改在 lifespan 啟動後於背景平行預熱（STARTUP_WARMUP），預熱完成前的第一次使用則當場建立
+def _init_asr():
+    return ASRHandler(
+        cache_backend=FirebaseTranscriptStore() if os.getenv('ASR_CACHE_BACKEND', '').lower() == 'firebase' else None
+    )
 
-# Initialize Google Cloud Storage client
-if gcs_credentials_path and gcs_bucket_name:
+
+def _init_gemini_llm():
+    # ASRHandler 也會以 ASR 專用 key 呼叫 genai.configure（程序共用設定），
+    # 先建好它再設定 LLM key，維持原本「LLM 設定最後生效」的初始化順序
+    asr_client.get()
+    import google.generativeai as genai
+    genai.configure(api_key=gemini_llm_key)
+    return genai
+
+
+def _init_gemini_image():
+    from google import genai as genai_v2
+    logging.info(f"Creating Gemini Image client with API key: {gemini_image_key[:10]}...{gemini_image_key[-5:]}")
+    return genai_v2.Client(api_key=gemini_image_key)
+
+
+def _init_gcs_bucket():
+    """
+    建立 Google Cloud Storage bucket（含一次 bucket.exists() 網路檢查）
+
+    Returns:
+        Bucket 物件；未設定或連線失敗時返回 None（圖片生成功能停用）
+    """
+    if not (gcs_credentials_path and gcs_bucket_name):
+        logging.warning("Google Cloud Storage not configured. Image generation will be disabled.")
+        logging.warning(f"GCS_BUCKET_NAME: {gcs_bucket_name}")
+        logging.warning(f"GOOGLE_APPLICATION_CREDENTIALS: {gcs_credentials_path}")
+        return None
     try:
         logging.info("Initializing Google Cloud Storage...")
         logging.info(f"GCS bucket name: {gcs_bucket_name}")
         logging.info(f"GCS credentials path: {gcs_credentials_path}")
-        
+
+        from google.cloud import storage
         storage_client = storage.Client()
         bucket = storage_client.bucket(gcs_bucket_name)
-        
+
         # 測試 bucket 是否存在
         if bucket.exists():
             logging.info(f"Successfully connected to GCS bucket: {gcs_bucket_name}")
-        else:
-            logging.error(f"GCS bucket does not exist: {gcs_bucket_name}")
-            bucket = None
-            
+            return bucket
+        logging.error(f"GCS bucket does not exist: {gcs_bucket_name}")
     except Exception as e:
         logging.error(f"Failed to initialize Google Cloud Storage: {e}")
-        storage_client = None
-        bucket = None
-else:
-    logging.warning("Google Cloud Storage not configured. Image generation will be disabled.")
-    logging.warning(f"GCS_BUCKET_NAME: {gcs_bucket_name}")
-    logging.warning(f"GOOGLE_APPLICATION_CREDENTIALS: {gcs_credentials_path}")
-    storage_client = None
-    bucket = None
+    return None
+
+
+asr_client = startup.LazyClient('asr', _init_asr)
+gemini_llm = startup.LazyClient('gemini_llm', _init_gemini_llm)
+gemini_image = startup.LazyClient('gemini_image', _init_gemini_image)
+gcs_bucket = startup.LazyClient('gcs', _init_gcs_bucket)
+warmup = startup.Warmup()
+if os.getenv('STARTUP_WARMUP', 'true').lower() in ('1', 'true', 'yes'):
+    warmup.add(asr_client)
+    warmup.add(gemini_llm)
+    warmup.add(gcs_bucket)
+    if gemini_image_key:
+        warmup.add(gemini_image)
+
+# Drive 轉存檔案大小上限（串流上傳，預設 1 GB）
+drive_export_max_bytes = int(os.getenv('DRIVE_EXPORT_MAX_BYTES', 1024 * 1024 * 1024))
+
+# 共用下載的額外消費者（依內容種類 'file' / 'audio' 登記），每則訊息內容只下載一次
+content_consumers = content_ingest.ConsumerRegistry()
+
+# Google Drive access token 快取（每個群組一份，過期前自動更新）
+drive_tokens = drive_export_async.AccessTokenCache()
+drive_folders = drive_export_async.FolderCache()
+# 依上傳日期分資料夾（strftime 格式，例如 %Y/%m），空字串則直接放在群組資料夾
+drive_date_subfolders = os.getenv('DRIVE_DATE_SUBFOLDERS', '').strip()
+# 重複檔案處理：reference（只記錄既有檔案）、shortcut（建立 Drive 捷徑）、off（一律重新上傳）
+drive_dedup_mode = os.getenv('DRIVE_DEDUP_MODE', 'reference').strip().lower()
+
+# 回覆送出：reply token 過期或失效時改用 push，1:1 對話顯示載入動畫
+reply_sender = line_reply.ReplySender(
+    reply_ttl_s=float(os.getenv('REPLY_TOKEN_TTL', line_reply.DEFAULT_REPLY_TOKEN_TTL_S)),
+    loading_seconds=int(os.getenv('LOADING_ANIMATION_SECONDS', line_reply.DEFAULT_LOADING_SECONDS)),
+)
+
+# 執行 lane：便宜工作（記錄訊息、!help、!drive）與耗時工作（Gemini、圖片、語音轉文字）分開排隊，
+# 各自限制同時執行數；LANE_<NAME>_CONCURRENCY / LANE_<NAME>_QUEUE 可調整
+lanes = scheduler.LaneScheduler([
+    scheduler.lane_from_env('interactive', concurrency=16, max_queue=500, priority=0),
+    scheduler.lane_from_env('llm', concurrency=4, max_queue=100, priority=1),
+    scheduler.lane_from_env('asr', concurrency=2, max_queue=50, priority=2),
+    scheduler.lane_from_env('image', concurrency=2, max_queue=20, priority=3),
+])
+LANE_BUSY_MESSAGE = "⏳ 目前處理中的請求較多，請稍後再試。"
+
+# 跨程序 / 節點的共用工作佇列（可選）：WORK_QUEUE_URL=sqlite:///path/queue.db（單機多 worker）或 redis://...（多節點）
+# 未設定時事件直接在收到 webhook 的程序內執行
+shared_queue = work_queue.open_work_queue(os.getenv('WORK_QUEUE_URL'))
+# 關機時等待排隊與執行中工作完成的秒數（容器平台通常在 SIGTERM 後 10 秒強制結束）
+shutdown_timeout_s = float(os.getenv('SHUTDOWN_TIMEOUT', '8'))
+# 關機開始後新的 webhook 回 503，讓 LINE 重送給其他執行個體
+accepting_events = True
+
+# all：收 webhook 也處理事件；intake：只把事件放進共用佇列；worker：只處理佇列（見 worker.py）
+worker_role = os.getenv('WORKER_ROLE', 'all').strip().lower()
+
+# 准入控制：昂貴路徑（LLM、圖片、語音轉文字、Drive）各自有使用者 / 群組 / 全體三層 token bucket，
+# 超過上限時快速回覆忙碌訊息；!help 等便宜指令不受限制
+admission = quota.AdmissionController({
+    'llm': quota.TokenBucketLimiter('llm', quota.scoped_rules_from_env(
+        'LLM_QUOTA', user=(10, 60), group=(20, 120), total=(30, 900),
+    )),
+    'image': quota.TokenBucketLimiter('image', quota.scoped_rules_from_env(
+        'IMAGE_QUOTA', user=(3, 10), group=(5, 20), total=(10, 60),
+    )),
+    'asr': quota.TokenBucketLimiter('asr', quota.scoped_rules_from_env(
+        'ASR_QUOTA', user=(10, 60), group=(30, 240), total=(30, 600),
+    )),
+    'drive': quota.TokenBucketLimiter('drive', quota.scoped_rules_from_env(
+        'DRIVE_QUOTA', group=(50, 500), total=(200, 3000),
+    )),
+})
 
 
 async def upload_image_to_gcs(image_data, filename, mime_type="image/png"):
@@ -142,6 +337,7 @@ async def upload_image_to_gcs(image_data, filename, mime_type="image/png"):
     logging.info(f"Starting upload_image_to_gcs - filename: {filename}")
     logging.info(f"Image data type: {type(image_data)}, size: {len(image_data) if image_data else 'None'}")
     
+    bucket = await gcs_bucket.aget()
     if not bucket:
         logging.error("Google Cloud Storage not configured - bucket is None")
         logging.error(f"GCS bucket name: {gcs_bucket_name}")
@@ -162,7 +358,7 @@ async def upload_image_to_gcs(image_data, filename, mime_type="image/png"):
         
         logging.info("Starting upload to GCS...")
         # 設定正確的 content_type 以確保圖片能正確顯示
-        blob.upload_from_string(image_data, content_type=mime_type)
+        await asyncio.to_thread(blob.upload_from_string, image_data, content_type=mime_type)
         logging.info(f"Upload completed successfully with content_type: {mime_type}")
         
         # 對於啟用了 uniform bucket-level access 的 bucket，
@@ -203,15 +399,16 @@ async def generate_image_with_gemini(prompt, max_retries=1, retry_delay=15):
     if not gemini_image_key:
         logging.error("Gemini Image API key not configured")
         return False, "圖片生成功能未設定 API Key"
-    
+
+    from google.genai import types
+
     for attempt in range(max_retries + 1):
         if attempt > 0:
             logging.info(f"Retry attempt {attempt}/{max_retries} after {retry_delay} seconds...")
             await asyncio.sleep(retry_delay)
         
         try:
-            logging.info(f"Creating Gemini Image client with API key: {gemini_image_key[:10]}...{gemini_image_key[-5:] if gemini_image_key else 'None'}")
-            client = genai_v2.Client(api_key=gemini_image_key)
+            client = await gemini_image.aget()
             
             # 使用環境變數設定的模型
             model = gemini_image_model
@@ -248,7 +445,7 @@ async def generate_image_with_gemini(prompt, max_retries=1, retry_delay=15):
             text_response = ""
             chunk_count = 0
             
-            for chunk in client.models.generate_content_stream(
+            async for chunk in await client.aio.models.generate_content_stream(
                 model=model,
                 contents=contents,
                 config=generate_content_config,
@@ -350,67 +547,61 @@ async def generate_image_with_gemini(prompt, max_retries=1, retry_delay=15):
     return False, "❌ 經過多次重試仍無法生成圖片，請稍後再試。"
 
 
-def is_bot_mentioned(event, bot_id=None, text=None):
+async def load_bot_user_id():
+    """啟動時透過 bot info API 取得 Bot 自己的 userId，之後提及檢查只比對 mentionee"""
+    try:
+        bot_info = await line_bot_api.get_bot_info()
+        bot_mentions.bot_user_id = bot_info.user_id
+        logging.info(f"Bot userId: {bot_info.user_id}")
+    except Exception as e:
+        # 仍可用 mentionee.is_self 與 LINE ID 文字比對判斷
+        logging.warning(f"Failed to fetch bot info: {e}")
+
+
+def is_bot_mentioned(event, text=None):
     """
     檢查是否 Bot 被提及
-    
+
     Args:
         event: LINE webhook event
-        bot_id: Bot 的 LINE ID（可選）
-        text: 訊息文字（可選，若為 None 則嘗試從 event.message 獲取）
-    
+        text: 訊息文字（可選，若為 None 則使用 event.message.text）
+
     Returns:
         bool: True 如果 Bot 被提及，False 否則
     """
-    if text is None:
-        if not isinstance(event.message, TextMessageContent):
-            return False
-        text = event.message.text
-    
-    mention = getattr(event.message, 'mention', None)
-    
-    # 方法1: 檢查 mention 物件中是否包含特定的用戶ID
-    if mention and hasattr(mention, 'mentionees'):
-        # 注意：這需要知道 Bot 的實際 user_id，通常格式為 U開頭
-        # 但我們可能無法直接獲取到 Bot 自己的 user_id
-        pass
-    
-    # 方法2: 檢查文字中是否包含 Bot 的官方 ID
-    if bot_id:
-        # 檢查是否包含 @bot_id 格式（確保 @ 前面沒有其他字符）
-        import re
-        bot_patterns = [
-            rf'(?<![a-zA-Z0-9])@{re.escape(bot_id)}(?![a-zA-Z0-9])',
-            rf'(?<![a-zA-Z0-9])＠{re.escape(bot_id)}(?![a-zA-Z0-9])',
-            rf'(?<![a-zA-Z0-9])@{re.escape(bot_id.lower())}(?![a-zA-Z0-9])',
-            rf'(?<![a-zA-Z0-9])＠{re.escape(bot_id.lower())}(?![a-zA-Z0-9])'
-        ]
-        
-        for pattern in bot_patterns:
-            if re.search(pattern, text):
-                logging.info(f"Bot mentioned with pattern: {pattern}")
-                return True
-    
-    # 方法3: 檢查是否有 mention 且文字包含關鍵詞
-    if mention:
-        # 檢查常見的 Bot 呼叫方式
-        bot_keywords = ['bot', 'Bot', 'BOT', '機器人', '摘要王']
-        if any(keyword in text for keyword in bot_keywords):
-            logging.info(f"Bot mentioned with keyword in text: {text}")
-            return True
-    
-    return False
+    return bot_mentions.is_mentioned(event.message, text=text)
 
 
 @app.get("/health")
 async def health():
+    """存活檢查：程序與事件迴圈正常即回應，不依賴外部服務"""
     return 'ok'
 
+
+@app.get("/ready")
+async def ready():
+    """就緒檢查：背景預熱完成且仍在接收事件時回 200，否則 503（含各元件初始化耗時與錯誤）"""
+    report = warmup.report()
+    report['accepting_events'] = accepting_events
+    return JSONResponse(report, status_code=200 if report['ready'] and accepting_events else 503)
+
 @app.get("/")
 async def root():
     return {"message": "LINE Bot is running", "status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "asr": asr_client.peek().provider_stats() if asr_client.ready else None,
+        "group_settings": group_settings.stats(),
+        "replies": reply_sender.stats(),
+        "admission": admission.stats(),
+        "lanes": lanes.stats(),
+        "work_queue": shared_queue.stats() if shared_queue is not None else None,
+    }
+
+
 @app.get("/auth/google/callback")
 async def google_oauth_callback(request: Request):
     code = request.query_params.get("code")
@@ -468,7 +659,7 @@ async def google_oauth_callback(request: Request):
         return PlainTextResponse("Bind code nonce mismatch", status_code=400)
 
     try:
-        tokens = drive_export.exchange_code_for_tokens(
+        tokens = await drive_export_async.exchange_code_for_tokens(
             client_id=client_id,
             client_secret=client_secret,
             redirect_uri=redirect_uri,
@@ -494,7 +685,7 @@ async def google_oauth_callback(request: Request):
 
     try:
         folder_name = f"LINE Bot Export - {group_id}"
-        folder_id, folder_name = drive_export.drive_ensure_folder(
+        folder_id, folder_name = await drive_export_async.drive_ensure_folder(
             access_token=tokens.access_token,
             name=folder_name,
             parent_id=None,
@@ -519,15 +710,14 @@ async def google_oauth_callback(request: Request):
     }
 
     try:
-        fdb.put(f'groups/{group_id}/info', 'drive_export', drive_export_cfg)
+        group_settings.set(group_id, 'drive_export', drive_export_cfg)
+        drive_tokens.invalidate(group_id)
         code_record["used_at"] = int(time.time())
         fdb.put('drive_bind_codes', bind_code, code_record)
     except Exception as e:
         logging.error(f"Failed to persist drive export config: {e}")
         return PlainTextResponse("Failed to save configuration", status_code=500)
 
-    async_api_client = AsyncApiClient(configuration)
-    line_bot_api = AsyncMessagingApi(async_api_client)
     try:
         await line_bot_api.push_message(
             PushMessageRequest(
@@ -537,426 +727,232 @@ async def google_oauth_callback(request: Request):
         )
     except Exception as e:
         logging.error(f"Failed to push confirmation message: {e}")
-    finally:
-        await async_api_client.close()
 
     return PlainTextResponse("Drive export enabled. You can close this page.")
 
 
-@app.post("/webhooks/line")
-async def handle_callback(request: Request):
-    signature = request.headers['X-Line-Signature']
-
-    # get request body as text
-    body = await request.body()
-    body = body.decode()
-
-    try:
-        events = parser.parse(body, signature)
-    except InvalidSignatureError:
-        raise HTTPException(status_code=400, detail="Invalid signature")
-
-    # 創建 async client 在 async 函數內
-    async_api_client = AsyncApiClient(configuration)
-    line_bot_api = AsyncMessagingApi(async_api_client)
-    line_bot_api_blob = AsyncMessagingApiBlob(async_api_client)
-    
-    try:
-        for event in events:
-            logging.info(event)
-            if not isinstance(event, MessageEvent):
-                continue
-            
-            user_id = event.source.user_id
-            text = ""
-            
-            if isinstance(event.message, TextMessageContent):
-                text = event.message.text
-            elif isinstance(event.message, AudioMessageContent):
-                # Handle Audio
-                try:
-                    message_id = event.message.id
-                    # Get message content using AsyncMessagingApiBlob
-                    message_content_response = await line_bot_api_blob.get_message_content(message_id)
-                    
-                    # Save to temp file
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.m4a') as tf:
-                        # The response is a stream, read the content
-                        tf.write(message_content_response)
-                        temp_file_path = tf.name
-                    
-                    logging.info(f"Transcribing audio: {temp_file_path}")
-                    text = asr_handler.transcribe(temp_file_path)
-                    logging.info(f"Transcribed text: {text}")
-                    
-                    # Clean up
-                    os.unlink(temp_file_path)
-                    
-                    if not text:
-                        continue
-                        
-                except Exception as e:
-                    logging.error(f"Error handling audio message: {e}")
-                    continue
-            else:
-                if isinstance(event.message, FileMessageContent):
-                    if event.source.type != 'group':
-                        continue
-
-                    group_id = event.source.group_id
-                    message_id = event.message.id
-                    file_name = drive_export.safe_filename(
-                        getattr(event.message, 'file_name', '') or getattr(event.message, 'fileName', ''),
-                        fallback=f"line_file_{message_id}",
-                    )
-                    file_size = getattr(event.message, 'file_size', None)
+async def run_drive_export_job(job, checkpoint):
+    """
+    執行一個 Drive 轉存工作：LINE 檔案串流上傳到群組綁定的資料夾
 
-                    # Simple size guard (avoid extremely large uploads).
-                    if isinstance(file_size, int) and file_size > 50 * 1024 * 1024:
-                        logging.warning(f"File too large for Drive export: {file_size} bytes")
-                        continue
+    若工作帶有先前中斷的 resumable session，會從 Drive 已確認的位置繼續上傳。
+    """
+    fdb = firebase.FirebaseApplication(firebase_url, None)
+    cfg = await group_settings.aget(job.group_id, 'drive_export')
+    if not isinstance(cfg, dict) or not cfg.get('enabled'):
+        raise drive_queue.PermanentJobError('drive_export_disabled')
+
+    google_cfg = cfg.get('google', {}) if isinstance(cfg.get('google'), dict) else {}
+    drive_cfg = cfg.get('drive', {}) if isinstance(cfg.get('drive'), dict) else {}
+    refresh_token_enc = google_cfg.get('refresh_token_enc')
+    folder_id = drive_cfg.get('folder_id')
+    if not refresh_token_enc or not folder_id:
+        raise drive_queue.PermanentJobError('drive_export_not_configured')
+
+    client_id = os.getenv('GOOGLE_OAUTH_CLIENT_ID')
+    client_secret = os.getenv('GOOGLE_OAUTH_CLIENT_SECRET')
+    if not client_id or not client_secret:
+        raise drive_queue.PermanentJobError('google_oauth_env_missing')
+
+    creds = {'refresh_token_enc': refresh_token_enc, 'client_id': client_id, 'client_secret': client_secret}
+
+    async def resolve_folder(access_token):
+        if not drive_date_subfolders:
+            return folder_id
+        # 同一批檔案共用快取的資料夾 ID，不必每個檔案都查詢一次
+        return await drive_folders.ensure_path(
+            access_token=access_token,
+            parent_id=folder_id,
+            path=datetime.fromtimestamp(job.created_at).strftime(drive_date_subfolders),
+        )
 
-                    fdb = firebase.FirebaseApplication(firebase_url, None)
-                    try:
-                        cfg = fdb.get(f'groups/{group_id}/info', 'drive_export')
-                    except Exception as e:
-                        logging.error(f"Failed to read drive_export config: {e}")
-                        continue
+    offset = 0
+    if job.session_uri:
+        try:
+            offset, drive_file_id = await drive_export_async.drive_query_upload_status(
+                upload_url=job.session_uri
+            )
+            if drive_file_id:
+                return drive_file_id
+            logging.info(f"Resuming Drive upload {job.key} at byte {offset}")
+        except Exception as e:
+            if not drive_export_async.is_session_expired(e):
+                raise
+            logging.info(f"Drive upload session for {job.key} expired, starting over")
+            job.session_uri = None
+            offset = 0
 
-                    if not isinstance(cfg, dict) or not cfg.get('enabled'):
-                        continue
+    # 其他登記的消費者（摘要、索引等）只在完整下載的那一次一起接收內容
+    extra_consumers = content_consumers.build('file', {'job': job}) if offset == 0 else {}
 
-                    uploads_path = f'groups/{group_id}/info/drive_export/uploads'
-                    try:
-                        existing = fdb.get(uploads_path, message_id)
-                    except Exception:
-                        existing = None
+    try:
+        if not job.session_uri:
+            async def start_session(access_token):
+                return await drive_export_async.drive_start_resumable_session(
+                    access_token=access_token,
+                    filename=job.file_name,
+                    folder_id=await resolve_folder(access_token),
+                )
 
-                    if isinstance(existing, dict) and existing.get('status') in ('pending', 'success'):
-                        continue
+            try:
+                job.session_uri = await drive_tokens.call(job.group_id, start_session, **creds)
+            except Exception as e:
+                if drive_export_async.is_session_expired(e):
+                    # 快取的資料夾可能已被刪除，下次重試時重新查詢
+                    drive_folders.invalidate()
+                raise
+        job.committed_bytes = offset
+        await checkpoint(job)
+
+        async def on_commit(committed):
+            job.committed_bytes = committed
+            await checkpoint(job)
+
+        # 上傳的串流同時計算 SHA-256（續傳時前段未經過這裡，無法得到完整雜湊）
+        digest = content_ingest.StreamDigest() if offset == 0 else None
+        duplicate = None
+
+        async def check_duplicate(total):
+            # 最後一段送出前比對雜湊：同樣內容已轉存過就取消這次的 session，改記錄既有檔案
+            nonlocal duplicate
+            try:
+                known = await asyncio.to_thread(fdb.get, drive_queue.hashes_path(job.group_id, total), None)
+                if isinstance(known, dict) and known:
+                    duplicate = await link_drive_duplicate(job, known.get(digest.hexdigest()), resolve_folder, creds)
+            except Exception as e:
+                logging.warning(f"Drive dedup check for {job.key} failed, uploading anyway: {e}")
+            return duplicate is None
+
+        async def upload(chunks):
+            return await drive_export_async.drive_stream_upload(
+                upload_url=job.session_uri,
+                chunks=digest.tap(chunks) if digest else chunks,
+                offset=offset,
+                on_commit=on_commit,
+                before_final=check_duplicate if digest and drive_dedup_mode != 'off' else None,
+            )
 
-                    try:
-                        fdb.put(uploads_path, message_id, {
-                            'status': 'pending',
-                            'created_at': int(time.time()),
-                        })
-                    except Exception as e:
-                        logging.error(f"Failed to create upload record: {e}")
-                        continue
+        # LINE 檔案只下載一次，直接串流給 Drive 上傳，記憶體用量與檔案大小無關
+        results = await content_ingest.ingest_message_content(
+            message_id=job.message_id,
+            access_token=channel_access_token,
+            consumers={'drive': upload, **extra_consumers},
+            skip=offset,
+        )
+        content_consumers.report(results, extra_consumers)
+    except line_content.ContentGoneError as e:
+        raise drive_queue.PermanentJobError('line_content_unavailable') from e
+
+    if isinstance(results['drive'], BaseException):
+        raise results['drive']
+    if duplicate:
+        duplicate['content_sha256'] = digest.hexdigest()
+        return duplicate
+    drive_file_id = results['drive']
+    if digest is None:
+        return drive_file_id
+    try:
+        await asyncio.to_thread(fdb.put, drive_queue.hashes_path(job.group_id, digest.size), digest.hexdigest(), {
+            'drive_file_id': drive_file_id,
+            'message_id': job.message_id,
+            'file_name': job.file_name,
+        })
+    except Exception as e:
+        logging.warning(f"Failed to index Drive upload {job.key} by hash: {e}")
+    return {'drive_file_id': drive_file_id, 'content_sha256': digest.hexdigest()}
 
-                    try:
-                        message_content = await line_bot_api_blob.get_message_content(message_id)
-                    except Exception as e:
-                        logging.error(f"Failed to download LINE file content: {e}")
-                        try:
-                            fdb.put(uploads_path, message_id, {
-                                'status': 'failed',
-                                'error': 'line_download_failed',
-                                'created_at': int(time.time()),
-                            })
-                        except Exception:
-                            pass
-                        continue
-
-                    with tempfile.NamedTemporaryFile(delete=False) as tf:
-                        tf.write(message_content)
-                        temp_file_path = tf.name
 
-                    try:
-                        google_cfg = cfg.get('google', {}) if isinstance(cfg.get('google'), dict) else {}
-                        drive_cfg = cfg.get('drive', {}) if isinstance(cfg.get('drive'), dict) else {}
-                        refresh_token_enc = google_cfg.get('refresh_token_enc')
-                        folder_id = drive_cfg.get('folder_id')
+async def link_drive_duplicate(job, entry, resolve_folder, creds):
+    """
+    內容相同的檔案已在 Drive 上：記錄參照（或建立捷徑），回傳要寫入 uploads 的欄位
 
-                        if not refresh_token_enc or not folder_id:
-                            raise RuntimeError('drive_export_not_configured')
+    原檔已被刪除或移到垃圾桶時回傳 None，改為正常上傳。
+    """
+    if not isinstance(entry, dict) or not entry.get('drive_file_id'):
+        return None
+    target_id = entry['drive_file_id']
+
+    async def link(access_token):
+        if not await drive_export_async.drive_file_exists(access_token=access_token, file_id=target_id):
+            return None
+        if drive_dedup_mode == 'shortcut':
+            return await drive_export_async.drive_create_shortcut(
+                access_token=access_token,
+                name=job.file_name,
+                target_id=target_id,
+                folder_id=await resolve_folder(access_token),
+            )
+        return target_id
 
-                        client_id = os.getenv('GOOGLE_OAUTH_CLIENT_ID')
-                        client_secret = os.getenv('GOOGLE_OAUTH_CLIENT_SECRET')
-                        if not client_id or not client_secret:
-                            raise RuntimeError('google_oauth_env_missing')
+    drive_file_id = await drive_tokens.call(job.group_id, link, **creds)
+    if not drive_file_id:
+        return None
+    logging.info(f"Drive upload {job.key} duplicates {entry.get('message_id')}, not re-uploading")
+    return {'drive_file_id': drive_file_id, 'duplicate_of': entry.get('message_id') or target_id}
+
+
+drive_upload_queue = drive_queue.DriveUploadQueue(
+    lambda: firebase.FirebaseApplication(firebase_url, None),
+    run_drive_export_job,
+    workers=int(os.getenv('DRIVE_UPLOAD_WORKERS', '8')),
+    group_concurrency=int(os.getenv('DRIVE_UPLOAD_GROUP_CONCURRENCY', '4')),
+    max_attempts=int(os.getenv('DRIVE_UPLOAD_MAX_ATTEMPTS', '5')),
+    retry_base_s=float(os.getenv('DRIVE_UPLOAD_RETRY_BASE', '30')),
+    # 每個非 intake 程序都會執行 Drive 佇列；以 Firebase 條件寫入取得租約，同一筆上傳只會由一個程序執行
+    lease_s=float(os.getenv('DRIVE_UPLOAD_LEASE', '120')),
+    transaction=functools.partial(drive_queue.firebase_transaction, firebase_url) if firebase_url else None,
+)
 
-                        def do_upload() -> str:
-                            refresh_token = drive_export.decrypt_refresh_token(refresh_token_enc)
-                            access_token = drive_export.refresh_access_token(
-                                client_id=client_id,
-                                client_secret=client_secret,
-                                refresh_token=refresh_token,
-                            )
-                            return drive_export.drive_resumable_upload(
-                                access_token=access_token,
-                                file_path=temp_file_path,
-                                filename=file_name,
-                                folder_id=folder_id,
-                            )
 
-                        drive_file_id = await asyncio.to_thread(do_upload)
+# 指令路由：每則訊息只正規化一次，以 trie 比對指令別名
+command_router = commands.CommandRouter()
 
-                        fdb.put(uploads_path, message_id, {
-                            'status': 'success',
-                            'drive_file_id': drive_file_id,
-                            'created_at': int(time.time()),
-                        })
-                    except Exception as e:
-                        logging.error(f"Drive upload failed: {e}")
-                        try:
-                            fdb.put(uploads_path, message_id, {
-                                'status': 'failed',
-                                'error': str(e)[:200],
-                                'created_at': int(time.time()),
-                            })
-                        except Exception:
-                            pass
-                    finally:
-                        try:
-                            os.unlink(temp_file_path)
-                        except Exception:
-                            pass
 
-                    continue
+@command_router.command('清空', 'clean')
+async def clear_command(ctx):
+    reply_msg = ""
+    try:
+        await asyncio.to_thread(ctx.fdb.delete, ctx.user_chat_path, 'messages')
+        reply_msg = '------對話歷史紀錄已經清空------'
+        # 清空後重置 messages
+        ctx.messages = []
+    except Exception as e:
+        logging.error(f"Failed to clear Firebase data: {e}")
+        reply_msg = '清空對話記錄時發生錯誤，請稍後再試'
+    return reply_msg
 
-                continue
 
-            fdb = firebase.FirebaseApplication(firebase_url, None)
-            
-            # 設定 Firebase 路徑
-            if event.source.type == 'group':
-                user_chat_path = f'groups/{event.source.group_id}'
-            else:
-                user_chat_path = f'users/{user_id}'
-            
-            # 決定是否要回應
-            should_reply = False
-            is_ai_question = False  # 是否為 AI 問答模式
-            is_drive_command = False
-            special_commands = ['!清空', '!clean',  '!摘要','!總結','!summary', '！清空', '！摘要', '!help', '!幫助', '！help', '！幫助', '!畫圖', '!生成圖片', '！畫圖', '！生成圖片', '!image', '!draw', '!drive', '！drive']
-            
-            if event.source.type == 'group':
-                # 檢查是否真的提及了 Bot
-                bot_mentioned = is_bot_mentioned(event, bot_line_id, text=text)
-                
-                # 檢查是否包含特殊指令
-                has_special_command = any(cmd in text.lower() for cmd in special_commands)
-                
-                if bot_mentioned and not has_special_command:
-                    # Bot 被提及但不是特殊指令 = AI 問答模式
-                    should_reply = True
-                    is_ai_question = True
-                    logging.info(f"Bot mentioned - AI question mode: '{text}'")
-                elif has_special_command:
-                    # 特殊指令
-                    should_reply = True
-                    logging.info(f"Group message with special command: '{text}'")
-                else:
-                    logging.info(f"Recording group message (no reply): '{text}'")
-            else:
-                # 私人對話：所有訊息都回應
-                should_reply = True
-                # 檢查是否為特殊指令
-                has_special_command = any(cmd in text.lower() for cmd in special_commands)
-                if not has_special_command:
-                    # 一般對話模式
-                    logging.info(f"Private conversation mode: '{text}'")
-                else:
-                    logging.info(f"Private message with special command: '{text}'")
-            
-            # 獲取現有對話記錄
-            try:
-                chatgpt = fdb.get(user_chat_path, 'messages')
-                if chatgpt is None:
-                    messages = []
-                else:
-                    messages = chatgpt if isinstance(chatgpt, list) else []
-            except Exception as e:
-                logging.warning(f"Failed to get messages from Firebase: {e}")
-                messages = []
+@command_router.command('摘要', '總結', 'summary', slow=True, quota='llm', lane='llm')
+async def summary_command(ctx):
+    messages, event = ctx.messages, ctx.event
+    reply_msg = ""
+    if len(messages) > 1:  # 確保有對話內容可以摘要
+        try:
+            model = (await gemini_llm.aget()).GenerativeModel(gemini_llm_model)
+            # 準備給 Gemini 的訊息格式（移除 timestamp 欄位）
+            gemini_messages = []
+            for msg in messages:
+                gemini_msg = {
+                    'role': msg['role'],
+                    'parts': msg['parts']
+                }
+                gemini_messages.append(gemini_msg)
+
+            response = await model.generate_content_async(
+                f'Summary the following message in Traditional Chinese by less 5 list points. \n{gemini_messages}')
+            reply_msg = response.text
+            # 記錄摘要回應
+            messages.append({'role': 'model', 'parts': [reply_msg], 'timestamp': str(event.timestamp)})
+        except Exception as e:
+            logging.error(f"Error generating summary: {e}")
+            reply_msg = "抱歉，產生摘要時發生錯誤，請稍後再試。"
+    else:
+        reply_msg = '目前沒有足夠的對話紀錄可以摘要'
+        messages.append({'role': 'model', 'parts': [reply_msg], 'timestamp': str(event.timestamp)})
+    return reply_msg
 
-            if text:
-                # 所有訊息都記錄到 Firebase
-                messages.append({'role': 'user', 'parts': [text], 'timestamp': str(event.timestamp)})
-                
-                reply_msg = ""
-                
-                # 只有在需要回應時才處理
-                if should_reply:
-                    normalized = text.strip().replace('！', '!')
-                    lowered = normalized.lower()
-
-                    if lowered.startswith('!drive'):
-                        is_drive_command = True
-                        tokens = normalized.split()
-
-                        # Ensure drive commands do not pollute conversation history
-                        messages.pop()
-
-                        if event.source.type == 'group':
-                            group_id = event.source.group_id
-
-                            if len(tokens) < 2:
-                                reply_msg = "用法：!drive bind | !drive status | !drive off"
-                            else:
-                                subcmd = tokens[1].lower()
-                                if subcmd == 'bind':
-                                    try:
-                                        existing = fdb.get(f'groups/{group_id}/info', 'drive_export')
-                                    except Exception:
-                                        existing = None
-
-                                    if isinstance(existing, dict) and existing.get('owner_line_user_id'):
-                                        reply_msg = "此群組已有人綁定 Drive。請用 !drive status 查看，或請 owner 執行 !drive off 後再重新綁定。"
-                                    else:
-                                        bind_code = drive_export.generate_bind_code()
-                                        expires_at = int(time.time()) + 10 * 60
-                                        record = {
-                                            'group_id': group_id,
-                                            'requested_by_line_user_id': user_id,
-                                            'expires_at': expires_at,
-                                        }
-                                        try:
-                                            fdb.put('drive_bind_codes', bind_code, record)
-                                            fdb.put(f'groups/{group_id}/info/drive_export', 'bind', {
-                                                'active_code': bind_code,
-                                                'expires_at': expires_at,
-                                                'requested_by_line_user_id': user_id,
-                                            })
-                                            reply_msg = (
-                                                "請私訊我以下指令完成綁定（10 分鐘內有效）：\n"
-                                                f"!drive link {bind_code}"
-                                            )
-                                        except Exception as e:
-                                            logging.error(f"Failed to create bind code: {e}")
-                                            reply_msg = "建立綁定碼失敗，請稍後再試。"
-
-                                elif subcmd == 'status':
-                                    try:
-                                        cfg = fdb.get(f'groups/{group_id}/info', 'drive_export')
-                                    except Exception:
-                                        cfg = None
-
-                                    if not isinstance(cfg, dict) or not cfg.get('enabled'):
-                                        owner = cfg.get('owner_line_user_id') if isinstance(cfg, dict) else None
-                                        bind = cfg.get('bind') if isinstance(cfg, dict) else None
-                                        msg = "Drive 轉存：未啟用"
-                                        if owner:
-                                            msg += f"\nOwner: {owner}"
-                                        if isinstance(bind, dict) and bind.get('active_code'):
-                                            msg += f"\n綁定碼：{bind.get('active_code')}（到期：{bind.get('expires_at')}）"
-                                        reply_msg = msg
-                                    else:
-                                        drive_cfg = cfg.get('drive', {}) if isinstance(cfg.get('drive'), dict) else {}
-                                        reply_msg = (
-                                            "Drive 轉存：已啟用\n"
-                                            f"Owner: {cfg.get('owner_line_user_id')}\n"
-                                            f"Folder ID: {drive_cfg.get('folder_id')}"
-                                        )
-
-                                elif subcmd == 'off':
-                                    try:
-                                        cfg = fdb.get(f'groups/{group_id}/info', 'drive_export')
-                                    except Exception:
-                                        cfg = None
-
-                                    if not isinstance(cfg, dict) or not cfg.get('owner_line_user_id'):
-                                        reply_msg = "此群組尚未啟用 Drive 轉存。"
-                                    elif cfg.get('owner_line_user_id') != user_id:
-                                        reply_msg = "只有 owner 可以關閉 Drive 轉存。"
-                                    else:
-                                        try:
-                                            fdb.delete(f'groups/{group_id}/info', 'drive_export')
-                                            reply_msg = "已關閉 Drive 轉存，群組已可重新綁定。"
-                                        except Exception as e:
-                                            logging.error(f"Failed to disable drive export: {e}")
-                                            reply_msg = "關閉失敗，請稍後再試。"
-
-                                else:
-                                    reply_msg = "用法：!drive bind | !drive status | !drive off"
 
-                        else:
-                            # Private chat
-                            if len(tokens) < 3:
-                                reply_msg = "用法：!drive link <BIND_CODE>"
-                            else:
-                                subcmd = tokens[1].lower()
-                                if subcmd != 'link':
-                                    reply_msg = "用法：!drive link <BIND_CODE>"
-                                else:
-                                    bind_code = tokens[2].strip()
-                                    code_record = fdb.get('drive_bind_codes', bind_code)
-                                    if not isinstance(code_record, dict):
-                                        reply_msg = "綁定碼不存在。"
-                                    else:
-                                        expires_at = code_record.get('expires_at')
-                                        if not isinstance(expires_at, int) or int(time.time()) > expires_at:
-                                            reply_msg = "綁定碼已過期，請回群組重新執行 !drive bind。"
-                                        elif code_record.get('used_at'):
-                                            reply_msg = "綁定碼已使用，請回群組重新執行 !drive bind。"
-                                        elif code_record.get('requested_by_line_user_id') != user_id:
-                                            reply_msg = "此綁定碼不是由你建立。請由建立者完成綁定或重新產生綁定碼。"
-                                        else:
-                                            client_id = os.getenv('GOOGLE_OAUTH_CLIENT_ID')
-                                            redirect_base = os.getenv('OAUTH_REDIRECT_BASE')
-                                            if not client_id or not redirect_base or not os.getenv('OAUTH_STATE_SIGNING_KEY'):
-                                                reply_msg = "伺服器尚未設定 Google OAuth（缺少環境變數）。"
-                                            else:
-                                                redirect_uri = redirect_base.rstrip('/') + '/auth/google/callback'
-                                                nonce = uuid.uuid4().hex
-                                                exp = int(time.time()) + 10 * 60
-                                                payload = {
-                                                    'group_id': code_record.get('group_id'),
-                                                    'line_user_id': user_id,
-                                                    'bind_code': bind_code,
-                                                    'nonce': nonce,
-                                                    'exp': exp,
-                                                }
-                                                state = drive_export.sign_state(payload)
-
-                                                code_record['oauth_nonce'] = nonce
-                                                fdb.put('drive_bind_codes', bind_code, code_record)
-
-                                                oauth_url = drive_export.build_google_oauth_url(
-                                                    client_id=client_id,
-                                                    redirect_uri=redirect_uri,
-                                                    state=state,
-                                                )
-                                                reply_msg = f"請點選以下連結授權 Google Drive：\n{oauth_url}"
-
-                    elif text.lower() in ['!清空', '！清空', '!clean']:
-                        try:
-                            fdb.delete(user_chat_path, 'messages')
-                            reply_msg = '------對話歷史紀錄已經清空------'
-                            # 清空後重置 messages
-                            messages = []
-                        except Exception as e:
-                            logging.error(f"Failed to clear Firebase data: {e}")
-                            reply_msg = '清空對話記錄時發生錯誤，請稍後再試'
-
-                    elif text.lower() in ['!摘要', '！摘要', '!總結', '！總結', '！summary']:
-                        if len(messages) > 1:  # 確保有對話內容可以摘要
-                            try:
-                                model = genai.GenerativeModel(gemini_llm_model)
-                                # 準備給 Gemini 的訊息格式（移除 timestamp 欄位）
-                                gemini_messages = []
-                                for msg in messages:
-                                    gemini_msg = {
-                                        'role': msg['role'],
-                                        'parts': msg['parts']
-                                    }
-                                    gemini_messages.append(gemini_msg)
-                                
-                                response = model.generate_content(
-                                    f'Summary the following message in Traditional Chinese by less 5 list points. \n{gemini_messages}')
-                                reply_msg = response.text
-                                # 記錄摘要回應
-                                messages.append({'role': 'model', 'parts': [reply_msg], 'timestamp': str(event.timestamp)})
-                            except Exception as e:
-                                logging.error(f"Error generating summary: {e}")
-                                reply_msg = "抱歉，產生摘要時發生錯誤，請稍後再試。"
-                        else:
-                            reply_msg = '目前沒有足夠的對話紀錄可以摘要'
-                            messages.append({'role': 'model', 'parts': [reply_msg], 'timestamp': str(event.timestamp)})
-                    
-                    elif text.lower() in ['!help', '!幫助', '！help', '！幫助']:
-                        reply_msg = """🤖 群組摘要王 使用說明
+HELP_MESSAGE = """🤖 群組摘要王 使用說明
 
 **群組功能：**
 • @ 機器人 + 問題：進入 AI 問答模式
@@ -965,7 +961,7 @@ async def handle_callback(request: Request):
 • !摘要 或 ！摘要：產生對話摘要
 • !清空 或 ！清空：清空對話記錄
 • !drive bind：啟用此群組 Google Drive 轉存（owner 制）
-  其他：!drive status / !drive off
+  其他：!drive status / !drive retry / !drive off
 • !畫圖 [描述] 或 ！畫圖 [描述]：生成圖片
   例：!畫圖 可愛的貓咪在花園裡玩耍
   提示：使用具體、詳細的描述效果更好
@@ -980,133 +976,594 @@ async def handle_callback(request: Request):
 • AI 問答為一次性回答，不會記錄到對話歷史
 • 所有訊息都會被記錄以供摘要功能使用
 • 圖片生成需要 Google Cloud Storage 設定"""
-                        # 幫助訊息不記錄到對話歷史
-                        
-                    elif any(cmd in text.lower() for cmd in ['!畫圖', '！畫圖', '!生成圖片', '！生成圖片', '!image', '!draw']):
-                        # 圖片生成功能
-                        logging.info(f"Image generation command detected: {text}")
-                        
-                        if not bucket:
-                            logging.error("Image generation requested but GCS not configured")
-                            reply_msg = "抱歉，圖片生成功能目前無法使用，請聯繫管理員設定 Google Cloud Storage。"
-                        else:
-                            # 提取圖片描述
-                            prompt = text
-                            for cmd in ['!畫圖', '！畫圖', '!生成圖片', '！生成圖片', '!image', '!draw']:
-                                if cmd in text.lower():
-                                    prompt = text.lower().replace(cmd, '').strip()
-                                    logging.info(f"Extracted prompt using command '{cmd}': '{prompt}'")
-                                    break
-                            
-                            if not prompt:
-                                logging.warning("No prompt provided for image generation")
-                                reply_msg = "請提供圖片描述，例如：!畫圖 可愛的貓咪在花園裡玩耍"
-                            else:
-                                logging.info(f"Starting image generation process with prompt: '{prompt}'")
-                                
-                                # 不先發送"生成中"訊息，直接生成圖片後一次回覆
-                                logging.info("Calling generate_image_with_gemini...")
-                                success, result = await generate_image_with_gemini(prompt)
-                                logging.info(f"Image generation result - success: {success}, result: {result}")
-                                
-                                if success:
-                                    logging.info("Image generation successful, sending reply with image")
-                                    # 使用 reply_message 一次發送文字和圖片（避免 push_message 額度問題）
-                                    image_message = ImageMessage(
-                                        original_content_url=result,
-                                        preview_image_url=result
-                                    )
-                                    success_text = create_flex_message(f"🎨 圖片生成完成：{prompt}", title="圖片生成", header_text="AI 畫家")
-                                    
-                                    await line_bot_api.reply_message(
-                                        ReplyMessageRequest(
-                                            reply_token=event.reply_token,
-                                            messages=[success_text, image_message]
-                                        )
-                                    )
-                                    logging.info("Image and text sent successfully via reply_message")
-                                    reply_msg = ""  # 已經回覆了
-                                else:
-                                    logging.error(f"Image generation failed: {result}")
-                                    # 使用 reply_message 發送錯誤訊息
-                                    reply_msg = f"❌ 圖片生成失敗：{result}"
-                        
-                        # 圖片生成指令不記錄到對話歷史
-                        messages.pop()  # 移除剛才加入的用戶訊息
-                        logging.info("Removed image generation command from conversation history")
-                        
-                    elif is_ai_question:
-                        # AI 問答模式：一次性回答，不記錄到對話歷史（群組中的 @ 提及）
-                        try:
-                            model = genai.GenerativeModel(gemini_llm_model)
-                            # 移除 @ 提及部分，只保留問題
-                            clean_question = text
-                            if hasattr(event.message, 'mention') and event.message.mention:
-                                # 如果有 mention 資訊，移除被提及的部分
-                                mention = event.message.mention
-                                for mentioned_user in mention.mentionees:
-                                    if mentioned_user.user_id:
-                                        # 簡單的文字清理，移除可能的 @ 符號
-                                        clean_question = text.replace('@', '').strip()
-                            
-                            response = model.generate_content(f"請用繁體中文回答以下問題：{clean_question}")
-                            reply_msg = response.text
-                            # AI 問答不記錄到對話歷史，所以移除剛加入的訊息
-                            messages.pop()  # 移除剛才加入的用戶訊息
-                        except Exception as e:
-                            logging.error(f"Error in AI question mode: {e}")
-                            reply_msg = "抱歉，處理您的問題時發生錯誤，請稍後再試。"
-                            messages.pop()  # 移除剛才加入的用戶訊息
-                            
-                    else:
-                        # 一般對話（私人對話或群組中的其他情況）
-                        try:
-                            model = genai.GenerativeModel(gemini_llm_model)
-                            # 準備給 Gemini 的訊息格式（移除 timestamp 欄位）
-                            gemini_messages = []
-                            for msg in messages:
-                                gemini_msg = {
-                                    'role': msg['role'],
-                                    'parts': msg['parts']
-                                }
-                                gemini_messages.append(gemini_msg)
-                            
-                            response = model.generate_content(gemini_messages)
-                            reply_msg = response.text
-                            messages.append({'role': 'model', 'parts': [reply_msg], 'timestamp': str(event.timestamp)})
-                            logging.info(f"Generated AI response for general conversation: {reply_msg[:50]}...")
-                        except Exception as e:
-                            logging.error(f"Error in general conversation: {e}")
-                            reply_msg = "抱歉，處理您的訊息時發生錯誤，請稍後再試。"
-                
-                # 更新 Firebase 中的對話紀錄
-                # AI 問答模式、幫助訊息和圖片生成指令不記錄到對話歷史
-                should_save_to_firebase = not is_ai_question and not (
-                    text.lower() in ['!help', '!幫助', '！help', '！幫助'] or
-                    any(cmd in text.lower() for cmd in ['!畫圖', '！畫圖', '!生成圖片', '！生成圖片', '!image', '!draw']) or
-                    is_drive_command
+
+
+@command_router.command('help', '幫助', records_history=False)
+async def help_command(ctx):
+    return static_flex_message(HELP_MESSAGE)
+
+
+@command_router.command('畫圖', '生成圖片', 'image', 'draw', records_history=False, slow=True, lane='image')
+async def image_command(ctx):
+    reply_msg = ""
+    # 圖片生成功能
+    logging.info(f"Image generation command detected: {ctx.text}")
+
+    if not await gcs_bucket.aget():
+        logging.error("Image generation requested but GCS not configured")
+        reply_msg = "抱歉，圖片生成功能目前無法使用，請聯繫管理員設定 Google Cloud Storage。"
+    else:
+        # 指令後的文字即為圖片描述
+        prompt = ctx.args
+
+        decision = None
+        if prompt:
+            decision = await admission.acquire('image', group=ctx.group_id, user=ctx.user_id)
+
+        if not prompt:
+            logging.warning("No prompt provided for image generation")
+            reply_msg = "請提供圖片描述，例如：!畫圖 可愛的貓咪在花園裡玩耍"
+        elif not decision.allowed:
+            logging.warning(f"Image quota exceeded ({decision.scope}), retry after {decision.retry_after_s:.0f}s")
+            reply_msg = quota.busy_message(decision, '圖片生成')
+        else:
+            logging.info(f"Starting image generation process with prompt: '{prompt}'")
+
+            # 不先發送"生成中"訊息，直接生成圖片後一次回覆
+            logging.info("Calling generate_image_with_gemini...")
+            success, result = await generate_image_with_gemini(prompt)
+            logging.info(f"Image generation result - success: {success}, result: {result}")
+
+            if success:
+                logging.info("Image generation successful, sending reply with image")
+                # 使用 reply_message 一次發送文字和圖片（避免 push_message 額度問題）
+                image_message = ImageMessage(
+                    original_content_url=result,
+                    preview_image_url=result
                 )
-                
-                if should_save_to_firebase:
+                success_text = create_flex_message(f"🎨 圖片生成完成：{prompt}", title="圖片生成", header_text="AI 畫家")
+
+                # 生成耗時較長，reply token 過期時自動改用 push
+                sent_via = await reply_sender.send(
+                    ctx.line_bot_api, ctx.event, [success_text, image_message], ctx.received_at
+                )
+                logging.info(f"Image and text sent successfully via {sent_via}")
+                reply_msg = ""  # 已經回覆了
+            else:
+                logging.error(f"Image generation failed: {result}")
+                # 使用 reply_message 發送錯誤訊息
+                reply_msg = f"❌ 圖片生成失敗：{result}"
+    return reply_msg
+
+
+@command_router.command('drive', records_history=False)
+async def drive_command(ctx):
+    """!drive bind | status | retry | off（群組）與 !drive link <BIND_CODE>（私訊）"""
+    event, user_id, fdb = ctx.event, ctx.user_id, ctx.fdb
+    tokens = ctx.args.split()
+    reply_msg = ""
+
+    if event.source.type == 'group':
+        group_id = event.source.group_id
+
+        if len(tokens) < 1:
+            reply_msg = "用法：!drive bind | !drive status | !drive retry | !drive off"
+        else:
+            subcmd = tokens[0].lower()
+            if subcmd == 'bind':
+                try:
+                    existing = await group_settings.aget(group_id, 'drive_export')
+                except Exception:
+                    existing = None
+
+                if isinstance(existing, dict) and existing.get('owner_line_user_id'):
+                    reply_msg = "此群組已有人綁定 Drive。請用 !drive status 查看，或請 owner 執行 !drive off 後再重新綁定。"
+                else:
+                    bind_code = drive_export.generate_bind_code()
+                    expires_at = int(time.time()) + 10 * 60
+                    record = {
+                        'group_id': group_id,
+                        'requested_by_line_user_id': user_id,
+                        'expires_at': expires_at,
+                    }
                     try:
-                        fdb.put(user_chat_path, 'messages', messages)
-                        logging.info(f"Saved message to Firebase: {user_chat_path}")
+                        fdb.put('drive_bind_codes', bind_code, record)
+                        group_settings.set_field(group_id, 'drive_export', 'bind', {
+                            'active_code': bind_code,
+                            'expires_at': expires_at,
+                            'requested_by_line_user_id': user_id,
+                        })
+                        reply_msg = (
+                            "請私訊我以下指令完成綁定（10 分鐘內有效）：\n"
+                            f"!drive link {bind_code}"
+                        )
                     except Exception as e:
-                        logging.error(f"Failed to save to Firebase: {e}")
+                        logging.error(f"Failed to create bind code: {e}")
+                        reply_msg = "建立綁定碼失敗，請稍後再試。"
+
+            elif subcmd == 'status':
+                try:
+                    cfg = await group_settings.aget(group_id, 'drive_export')
+                except Exception:
+                    cfg = None
+
+                if not isinstance(cfg, dict) or not cfg.get('enabled'):
+                    owner = cfg.get('owner_line_user_id') if isinstance(cfg, dict) else None
+                    bind = cfg.get('bind') if isinstance(cfg, dict) else None
+                    msg = "Drive 轉存：未啟用"
+                    if owner:
+                        msg += f"\nOwner: {owner}"
+                    if isinstance(bind, dict) and bind.get('active_code'):
+                        msg += f"\n綁定碼：{bind.get('active_code')}（到期：{bind.get('expires_at')}）"
+                    reply_msg = msg
                 else:
-                    logging.info(f"Skipped saving to Firebase (special command): {text[:50]}...")
-
-                # 發送回應（只有在需要回應且有訊息內容時）
-                if should_reply and reply_msg:
-                    await line_bot_api.reply_message(
-                        ReplyMessageRequest(
-                            reply_token=event.reply_token,
-                            messages=[create_flex_message(reply_msg)]
-                        ))
-    
-    finally:
-        # 關閉 async client
-        await async_api_client.close()
+                    drive_cfg = cfg.get('drive', {}) if isinstance(cfg.get('drive'), dict) else {}
+                    reply_msg = (
+                        "Drive 轉存：已啟用\n"
+                        f"Owner: {cfg.get('owner_line_user_id')}\n"
+                        f"Folder ID: {drive_cfg.get('folder_id')}"
+                    )
+
+            elif subcmd == 'off':
+                try:
+                    cfg = await group_settings.aget(group_id, 'drive_export')
+                except Exception:
+                    cfg = None
+
+                if not isinstance(cfg, dict) or not cfg.get('owner_line_user_id'):
+                    reply_msg = "此群組尚未啟用 Drive 轉存。"
+                elif cfg.get('owner_line_user_id') != user_id:
+                    reply_msg = "只有 owner 可以關閉 Drive 轉存。"
+                else:
+                    try:
+                        group_settings.delete(group_id, 'drive_export')
+                        drive_tokens.invalidate(group_id)
+                        reply_msg = "已關閉 Drive 轉存，群組已可重新綁定。"
+                    except Exception as e:
+                        logging.error(f"Failed to disable drive export: {e}")
+                        reply_msg = "關閉失敗，請稍後再試。"
+
+            elif subcmd == 'retry':
+                try:
+                    count = await drive_upload_queue.requeue_failed(group_id)
+                    reply_msg = f"已重新排入 {count} 個失敗的轉存檔案。" if count else "目前沒有失敗的轉存檔案。"
+                except Exception as e:
+                    logging.error(f"Failed to requeue drive uploads: {e}")
+                    reply_msg = "重新排入失敗，請稍後再試。"
+
+            else:
+                reply_msg = "用法：!drive bind | !drive status | !drive retry | !drive off"
+
+    else:
+        # Private chat
+        if len(tokens) < 2:
+            reply_msg = "用法：!drive link <BIND_CODE>"
+        else:
+            subcmd = tokens[0].lower()
+            if subcmd != 'link':
+                reply_msg = "用法：!drive link <BIND_CODE>"
+            else:
+                bind_code = tokens[1].strip()
+                code_record = fdb.get('drive_bind_codes', bind_code)
+                if not isinstance(code_record, dict):
+                    reply_msg = "綁定碼不存在。"
+                else:
+                    expires_at = code_record.get('expires_at')
+                    if not isinstance(expires_at, int) or int(time.time()) > expires_at:
+                        reply_msg = "綁定碼已過期，請回群組重新執行 !drive bind。"
+                    elif code_record.get('used_at'):
+                        reply_msg = "綁定碼已使用，請回群組重新執行 !drive bind。"
+                    elif code_record.get('requested_by_line_user_id') != user_id:
+                        reply_msg = "此綁定碼不是由你建立。請由建立者完成綁定或重新產生綁定碼。"
+                    else:
+                        client_id = os.getenv('GOOGLE_OAUTH_CLIENT_ID')
+                        redirect_base = os.getenv('OAUTH_REDIRECT_BASE')
+                        if not client_id or not redirect_base or not os.getenv('OAUTH_STATE_SIGNING_KEY'):
+                            reply_msg = "伺服器尚未設定 Google OAuth（缺少環境變數）。"
+                        else:
+                            redirect_uri = redirect_base.rstrip('/') + '/auth/google/callback'
+                            nonce = uuid.uuid4().hex
+                            exp = int(time.time()) + 10 * 60
+                            payload = {
+                                'group_id': code_record.get('group_id'),
+                                'line_user_id': user_id,
+                                'bind_code': bind_code,
+                                'nonce': nonce,
+                                'exp': exp,
+                            }
+                            state = drive_export.sign_state(payload)
+
+                            code_record['oauth_nonce'] = nonce
+                            fdb.put('drive_bind_codes', bind_code, code_record)
+
+                            oauth_url = drive_export.build_google_oauth_url(
+                                client_id=client_id,
+                                redirect_uri=redirect_uri,
+                                state=state,
+                            )
+                            reply_msg = f"請點選以下連結授權 Google Drive：\n{oauth_url}"
+    return reply_msg
+
+
+def chat_path(event):
+    """對話紀錄在 Firebase 的路徑，也是排程時同一對話依序處理的 key"""
+    if event.source.type == 'group':
+        return f'groups/{event.source.group_id}'
+    return f'users/{event.source.user_id}'
+
+
+def match_command(message, text=None):
+    """比對指令；以訊息的 mention 位置去除開頭的 @提及（顯示名稱可含空白）"""
+    mention = getattr(message, 'mention', None)
+    if text is None:
+        text = message.text
+    return command_router.match(text, getattr(mention, 'mentionees', None))
+
+
+def event_lane(event):
+    """
+    依工作量決定事件的執行 lane：
+
+    - asr：語音訊息（下載 + 轉文字）
+    - llm：私人對話、群組中 @ Bot 的問答，以及 lane='llm' 的指令（!摘要）
+    - image：!畫圖
+    - interactive：其餘（記錄群組訊息、!help、!drive、檔案轉存排隊）
+    """
+    message = event.message
+    if isinstance(message, AudioMessageContent):
+        return 'asr'
+    if not isinstance(message, TextMessageContent):
+        return 'interactive'
+    command = match_command(message)
+    if command:
+        return command.command.lane
+    if event.source.type != 'group' or is_bot_mentioned(event):
+        return 'llm'
+    return 'interactive'
+
+
+def event_key(event):
+    """
+    排程的依序 key：只有會讀寫對話紀錄的事件（一般訊息、問答、語音、會記錄的指令）
+    依對話排序；!help、!drive、!畫圖等不碰對話紀錄的指令與檔案轉存不需等待同一對話的其他工作
+    """
+    message = event.message
+    if isinstance(message, FileMessageContent):
+        return None
+    if isinstance(message, TextMessageContent):
+        command = match_command(message)
+        if command and not command.records_history:
+            return None
+    return chat_path(event)
+
+
+async def handle_queued_event(item):
+    """處理共用工作佇列取出的事件（可能由另一個程序或節點收到）"""
+    event = Event.from_json(item.payload)
+    # 各程序的 monotonic 時鐘不同，改以進入佇列的時間換算 reply token 年齡
+    received_at = time.monotonic() - max(0.0, time.time() - item.enqueued_at)
+    if item.attempts > 1:
+        logging.info(f"Retrying queued event {item.id} (attempt {item.attempts})")
+    await handle_event(event, received_at)
+
+
+async def handle_event(event, received_at):
+    user_id = event.source.user_id
+    text = ""
+
+    if isinstance(event.message, TextMessageContent):
+        text = event.message.text
+    elif isinstance(event.message, AudioMessageContent):
+        # Handle Audio
+        try:
+            message_id = event.message.id
+            decision = await admission.acquire(
+                'asr',
+                group=event.source.group_id if event.source.type == 'group' else None,
+                user=user_id,
+            )
+            if not decision.allowed:
+                logging.warning(f"ASR shed ({decision.scope}) for message {message_id}")
+                # 群組中的語音不一定是對 Bot 說的，只在 1:1 對話回覆忙碌訊息
+                if event.source.type == 'user':
+                    await reply_sender.send(
+                        line_bot_api, event, compose_reply(quota.busy_message(decision, '語音轉文字')), received_at
+                    )
+                return
+            await reply_sender.show_loading(line_bot_api, event)
+            # 下載一次，同時交給 ASR 與其他登記的消費者
+            extra_consumers = content_consumers.build('audio', {'event': event})
+            results = await content_ingest.ingest_message_content(
+                message_id=message_id,
+                access_token=channel_access_token,
+                consumers={'asr': content_ingest.collect_consumer(), **extra_consumers},
+            )
+            content_consumers.report(results, extra_consumers)
+            if isinstance(results['asr'], BaseException):
+                raise results['asr']
+            audio_bytes = results['asr']
+
+            # Transcribe straight from memory (no temp file to clean up)
+            logging.info(f"Transcribing audio message {message_id}: {len(audio_bytes)} bytes")
+            text = await (await asr_client.aget()).transcribe_async(
+                audio_bytes,
+                filename=f"{message_id}.m4a",
+                duration_ms=getattr(event.message, 'duration', None),
+            )
+            logging.info(f"Transcribed text: {text}")
+
+            if not text:
+                return
+
+        except Exception as e:
+            logging.error(f"Error handling audio message: {e}")
+            return
+    else:
+        if isinstance(event.message, FileMessageContent):
+            if event.source.type != 'group':
+                return
+
+            group_id = event.source.group_id
+            message_id = event.message.id
+            file_name = drive_export.safe_filename(
+                getattr(event.message, 'file_name', '') or getattr(event.message, 'fileName', ''),
+                fallback=f"line_file_{message_id}",
+            )
+            file_size = getattr(event.message, 'file_size', None)
+
+            # Size guard; uploads are streamed so this only bounds transfer time.
+            if isinstance(file_size, int) and file_size > drive_export_max_bytes:
+                logging.warning(f"File too large for Drive export: {file_size} bytes")
+                return
+
+            try:
+                cfg = await group_settings.aget(group_id, 'drive_export')
+            except Exception as e:
+                logging.error(f"Failed to read drive_export config: {e}")
+                return
+
+            if not isinstance(cfg, dict) or not cfg.get('enabled'):
+                return
+
+            fdb = firebase.FirebaseApplication(firebase_url, None)
+            uploads_path = drive_queue.uploads_path(group_id)
+            try:
+                existing = await asyncio.to_thread(fdb.get, uploads_path, message_id)
+            except Exception:
+                existing = None
+
+            if isinstance(existing, dict) and existing.get('status') in drive_queue.ACTIVE_STATUSES:
+                return
+
+            job = drive_queue.DriveJob(
+                group_id=group_id,
+                message_id=message_id,
+                file_name=file_name,
+                file_size=file_size if isinstance(file_size, int) else None,
+            )
+            decision = await admission.acquire('drive', group=group_id, user=user_id)
+            try:
+                if decision.allowed:
+                    await drive_upload_queue.enqueue(job)
+                else:
+                    # 超過上限的檔案記為失敗，稍後可用 !drive retry 重新排入
+                    logging.warning(f"Drive export shed ({decision.scope}) for message {message_id}")
+                    await drive_upload_queue.reject(job, f"rate limited ({decision.scope})")
+            except Exception as e:
+                logging.error(f"Failed to create upload record: {e}")
+
+            return
+
+        return
+
+    fdb = firebase.FirebaseApplication(firebase_url, None)
+
+    # 設定 Firebase 路徑
+    user_chat_path = chat_path(event)
+
+    # 決定是否要回應
+    should_reply = False
+    is_ai_question = False  # 是否為 AI 問答模式
+    command = match_command(event.message, text)
+
+    if event.source.type == 'group':
+        # 檢查是否真的提及了 Bot
+        bot_mentioned = is_bot_mentioned(event, text=text)
+
+        if command:
+            # 特殊指令
+            should_reply = True
+            logging.info(f"Group message with command !{command.command.name}: '{text}'")
+        elif bot_mentioned:
+            # Bot 被提及但不是特殊指令 = AI 問答模式
+            should_reply = True
+            is_ai_question = True
+            logging.info(f"Bot mentioned - AI question mode: '{text}'")
+        else:
+            logging.info(f"Recording group message (no reply): '{text}'")
+    else:
+        # 私人對話：所有訊息都回應
+        should_reply = True
+        if not command:
+            # 一般對話模式
+            logging.info(f"Private conversation mode: '{text}'")
+        else:
+            logging.info(f"Private message with command !{command.command.name}: '{text}'")
+
+    # 准入控制：LLM 路徑（一般對話、@ 問答、!摘要）超過上限時快速回覆，不讀取對話紀錄也不呼叫 Gemini
+    admission_path = None
+    if should_reply:
+        admission_path = command.command.quota if command else 'llm'
+    if admission_path:
+        decision = await admission.acquire(
+            admission_path,
+            group=event.source.group_id if event.source.type == 'group' else None,
+            user=user_id,
+        )
+        if not decision.allowed:
+            logging.warning(f"Shed {admission_path} request ({decision.scope}): '{text[:50]}'")
+            await reply_sender.send(
+                line_bot_api, event, compose_reply(quota.busy_message(decision, 'AI 回應')), received_at
+            )
+            return
+
+    # 需要呼叫 Gemini 的回應在 1:1 對話中先顯示載入動畫
+    if should_reply and (command is None or command.command.slow):
+        await reply_sender.show_loading(line_bot_api, event)
+
+    # 獲取現有對話記錄
+    try:
+        chatgpt = await asyncio.to_thread(fdb.get, user_chat_path, 'messages')
+        if chatgpt is None:
+            messages = []
+        else:
+            messages = chatgpt if isinstance(chatgpt, list) else []
+    except Exception as e:
+        logging.warning(f"Failed to get messages from Firebase: {e}")
+        messages = []
+
+    if text:
+        # 所有訊息都記錄到 Firebase
+        messages.append({'role': 'user', 'parts': [text], 'timestamp': str(event.timestamp)})
+
+        reply_msg = ""
+
+        # 只有在需要回應時才處理
+        if should_reply:
+            if command:
+                ctx = commands.CommandContext(
+                    event=event,
+                    text=text,
+                    args=command.args,
+                    user_id=user_id,
+                    fdb=fdb,
+                    user_chat_path=user_chat_path,
+                    line_bot_api=line_bot_api,
+                    messages=messages,
+                    received_at=received_at,
+                )
+                reply_msg = await command.command.handler(ctx)
+                messages = ctx.messages
+
+            elif is_ai_question:
+                # AI 問答模式：一次性回答，不記錄到對話歷史（群組中的 @ 提及）
+                try:
+                    model = (await gemini_llm.aget()).GenerativeModel(gemini_llm_model)
+                    # 移除 @ 提及部分，只保留問題
+                    clean_question = text
+                    if hasattr(event.message, 'mention') and event.message.mention:
+                        # 如果有 mention 資訊，移除被提及的部分
+                        mention = event.message.mention
+                        for mentioned_user in mention.mentionees:
+                            if mentioned_user.user_id:
+                                # 簡單的文字清理，移除可能的 @ 符號
+                                clean_question = text.replace('@', '').strip()
+
+                    response = await model.generate_content_async(f"請用繁體中文回答以下問題：{clean_question}")
+                    reply_msg = response.text
+                    # AI 問答不記錄到對話歷史，所以移除剛加入的訊息
+                    messages.pop()  # 移除剛才加入的用戶訊息
+                except Exception as e:
+                    logging.error(f"Error in AI question mode: {e}")
+                    reply_msg = "抱歉，處理您的問題時發生錯誤，請稍後再試。"
+                    messages.pop()  # 移除剛才加入的用戶訊息
+
+            else:
+                # 一般對話（私人對話或群組中的其他情況）
+                try:
+                    model = (await gemini_llm.aget()).GenerativeModel(gemini_llm_model)
+                    # 準備給 Gemini 的訊息格式（移除 timestamp 欄位）
+                    gemini_messages = []
+                    for msg in messages:
+                        gemini_msg = {
+                            'role': msg['role'],
+                            'parts': msg['parts']
+                        }
+                        gemini_messages.append(gemini_msg)
+
+                    response = await model.generate_content_async(gemini_messages)
+                    reply_msg = response.text
+                    messages.append({'role': 'model', 'parts': [reply_msg], 'timestamp': str(event.timestamp)})
+                    logging.info(f"Generated AI response for general conversation: {reply_msg[:50]}...")
+                except Exception as e:
+                    logging.error(f"Error in general conversation: {e}")
+                    reply_msg = "抱歉，處理您的訊息時發生錯誤，請稍後再試。"
+
+        # 更新 Firebase 中的對話紀錄
+        # AI 問答模式與 records_history=False 的指令（說明、畫圖、drive）不記錄到對話歷史
+        should_save_to_firebase = not is_ai_question and (command is None or command.records_history)
+
+        if should_save_to_firebase:
+            try:
+                await asyncio.to_thread(fdb.put, user_chat_path, 'messages', messages)
+                logging.info(f"Saved message to Firebase: {user_chat_path}")
+            except Exception as e:
+                logging.error(f"Failed to save to Firebase: {e}")
+        else:
+            logging.info(f"Skipped saving to Firebase (special command): {text[:50]}...")
+
+        # 發送回應（只有在需要回應且有訊息內容時）
+        if should_reply and reply_msg:
+            # 長回答依句子切成多則（最多 5 則或 carousel），仍只用一次 reply；
+            # reply token 已過期或被拒時改用 push
+            await reply_sender.send(
+                line_bot_api,
+                event,
+                [reply_msg] if isinstance(reply_msg, FlexMessage) else compose_reply(reply_msg),
+                received_at,
+            )
+
+
+@app.post("/webhooks/line")
+async def handle_callback(request: Request):
+    # 收到 webhook 的時間，用來判斷各事件 reply token 是否仍有效
+    received_at = time.monotonic()
+    if not accepting_events:
+        raise HTTPException(status_code=503, detail="Shutting down")
+    signature = request.headers['X-Line-Signature']
+
+    # get request body as text
+    body = await request.body()
+    body = body.decode()
+
+    try:
+        events = parser.parse(body, signature)
+    except InvalidSignatureError:
+        raise HTTPException(status_code=400, detail="Invalid signature")
+
+    # 事件依工作量分流到各 lane 背景執行，webhook 立即回應；
+    # 讀寫對話紀錄的事件依對話依序處理（避免互相覆寫），其餘（!help、!drive、!畫圖、檔案轉存）不需排序
+    for event in events:
+        logging.info(event)
+        if not isinstance(event, MessageEvent):
+            continue
+
+        lane = event_lane(event)
+        key = event_key(event)
+
+        if shared_queue is not None:
+            # 放進共用佇列，由任一 worker 依 lane 取出；同一對話仍依序處理，LINE 重送的事件只處理一次
+            try:
+                await asyncio.to_thread(
+                    shared_queue.put,
+                    lane,
+                    key or f'message:{event.message.id}',
+                    event.to_json(),
+                    dedup_id=getattr(event, 'webhook_event_id', None),
+                )
+                continue
+            except Exception as e:
+                logging.error(f"Failed to enqueue event to shared work queue, handling locally: {e}")
+
+        if lanes.submit(lane, functools.partial(handle_event, event, received_at), key=key):
+            continue
+
+        # lane 佇列已滿：需要回覆的工作直接回覆忙碌訊息（群組語音不一定是對 Bot 說的，不回覆）
+        if lane != 'interactive' and not (lane == 'asr' and event.source.type == 'group'):
+            try:
+                await reply_sender.send(line_bot_api, event, compose_reply(LANE_BUSY_MESSAGE), received_at)
+            except Exception as e:
+                logging.error(f"Failed to send busy reply: {e}")
 
     return 'OK'
 
@@ -1115,4 +1572,5 @@ if __name__ == "__main__":
     debug = True if os.environ.get(
         'API_ENV', default='develop') == 'develop' else False
     logging.info('Application will start...')
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=port, reload=debug)
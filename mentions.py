@@ -0,0 +1,39 @@
+import re
+from typing import Optional
+
+
+class BotMentionDetector:
+    """Decides whether a LINE message mentions this bot.
+
+    The primary check walks `message.mention.mentionees` and matches on
+    `is_self` or the bot's own userId (fetched once at startup via the
+    bot-info API), so it costs O(mentionees) and needs no text scanning.
+    Only messages without a matching mentionee fall back to one regex,
+    compiled once, for a typed `@<LINE ID>` such as `@377mwhqu`.
+    """
+
+    def __init__(self, bot_user_id: Optional[str] = None, bot_line_id: Optional[str] = None):
+        self.bot_user_id = bot_user_id
+        self._id_pattern = None
+        if bot_line_id:
+            bot_line_id = bot_line_id.lstrip("@")
+            ids = sorted({bot_line_id, bot_line_id.lower()}, key=len, reverse=True)
+            self._id_pattern = re.compile(
+                r"(?<![A-Za-z0-9])[@＠](?:%s)(?![A-Za-z0-9])" % "|".join(re.escape(i) for i in ids)
+            )
+
+    def is_mentioned(self, message, text: Optional[str] = None) -> bool:
+        mention = getattr(message, "mention", None)
+        for mentionee in getattr(mention, "mentionees", None) or ():
+            if getattr(mentionee, "is_self", False):
+                return True
+            if self.bot_user_id and getattr(mentionee, "user_id", None) == self.bot_user_id:
+                return True
+
+        if self._id_pattern is None:
+            return False
+        if text is None:
+            text = getattr(message, "text", None) or ""
+        if "@" not in text and "＠" not in text:
+            return False
+        return self._id_pattern.search(text) is not None
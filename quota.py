@@ -0,0 +1,293 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Scope shared by every request of a limiter, i.e. the bot as a whole.
+TOTAL_SCOPE = "total"
+TOTAL_ID = "all"
+
+
+@dataclass(frozen=True)
+class BucketRule:
+    """Token bucket shape: holds up to `capacity` tokens, refilled at `per_hour` tokens/hour."""
+
+    capacity: float
+    per_hour: float
+
+    @property
+    def refill_per_s(self) -> float:
+        return self.per_hour / 3600.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0 and self.per_hour > 0
+
+
+@dataclass(frozen=True)
+class Decision:
+    allowed: bool
+    retry_after_s: float = 0.0
+    scope: Optional[str] = None
+
+
+class InMemoryCounterStore:
+    """Process-local token buckets. Good enough for a single uvicorn worker."""
+
+    # No I/O: called inline from the event loop
+    blocking = False
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take_many(
+        self,
+        buckets: Sequence[Tuple[str, BucketRule]],
+        cost: float = 1.0,
+        now: Optional[float] = None,
+    ) -> Tuple[bool, float, Optional[str]]:
+        """Atomically take `cost` from every bucket, or from none of them.
+
+        Returns (allowed, retry_after_s, key_of_the_limiting_bucket).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            levels: List[float] = []
+            wait = 0.0
+            limiting = None
+            for key, rule in buckets:
+                tokens, ts = self._buckets.get(key, (rule.capacity, now))
+                tokens = min(rule.capacity, tokens + max(0.0, now - ts) * rule.refill_per_s)
+                levels.append(tokens)
+                if tokens < cost:
+                    needed = (cost - tokens) / rule.refill_per_s
+                    if needed > wait:
+                        wait = needed
+                        limiting = key
+            if limiting is not None:
+                return False, wait, limiting
+            for (key, _rule), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens - cost, now)
+            return True, 0.0, None
+
+
+# KEYS = bucket keys; ARGV = now, cost, then (capacity, refill_per_s) per key.
+_REDIS_TAKE_MANY = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local levels = {}
+local wait = 0
+local limiting = 0
+for i, key in ipairs(KEYS) do
+  local cap = tonumber(ARGV[1 + 2 * i])
+  local rate = tonumber(ARGV[2 + 2 * i])
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(state[1]) or cap
+  local ts = tonumber(state[2]) or now
+  tokens = math.min(cap, tokens + math.max(0, now - ts) * rate)
+  levels[i] = tokens
+  if tokens < cost then
+    local needed = (cost - tokens) / rate
+    if needed > wait then
+      wait = needed
+      limiting = i
+    end
+  end
+end
+if limiting > 0 then
+  return {0, tostring(wait), limiting}
+end
+for i, key in ipairs(KEYS) do
+  local cap = tonumber(ARGV[1 + 2 * i])
+  local rate = tonumber(ARGV[2 + 2 * i])
+  redis.call('HSET', key, 'tokens', tostring(levels[i] - cost), 'ts', tostring(now))
+  redis.call('EXPIRE', key, math.ceil(cap / rate) + 60)
+end
+return {1, '0', 0}
+"""
+
+
+class RedisCounterStore:
+    """Token buckets shared by every worker/node through Redis (one Lua call per check)."""
+
+    # Network round trip: limiters call it in a worker thread, never on the event loop
+    blocking = True
+
+    def __init__(self, url: str, prefix: str = "quota:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("redis is required for REDIS_URL quota storage") from e
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._script = self._client.register_script(_REDIS_TAKE_MANY)
+        self._prefix = prefix
+
+    def take_many(
+        self,
+        buckets: Sequence[Tuple[str, BucketRule]],
+        cost: float = 1.0,
+        now: Optional[float] = None,
+    ) -> Tuple[bool, float, Optional[str]]:
+        now = time.time() if now is None else now
+        keys = [self._prefix + key for key, _ in buckets]
+        args: List[float] = [now, cost]
+        for _key, rule in buckets:
+            args.extend([rule.capacity, rule.refill_per_s])
+        allowed, wait, limiting = self._script(keys=keys, args=args)
+        if int(allowed):
+            return True, 0.0, None
+        wait_s = float(wait.decode() if isinstance(wait, bytes) else wait)
+        return False, wait_s, buckets[int(limiting) - 1][0]
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_counter_store():
+    """Shared counter store: Redis when REDIS_URL is set, otherwise in-process."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            redis_url = os.getenv("REDIS_URL")
+            if redis_url:
+                try:
+                    _default_store = RedisCounterStore(redis_url)
+                    logger.info("Quota counters stored in Redis")
+                except Exception as e:
+                    logger.error(f"Failed to initialize Redis quota store, using memory: {e}")
+            if _default_store is None:
+                _default_store = InMemoryCounterStore()
+        return _default_store
+
+
+def rule_from_env(prefix: str, capacity: float, per_hour: float) -> BucketRule:
+    """Read `<prefix>_CAPACITY` / `<prefix>_PER_HOUR`; a zero value disables the bucket."""
+    return BucketRule(
+        capacity=float(os.getenv(f"{prefix}_CAPACITY", capacity)),
+        per_hour=float(os.getenv(f"{prefix}_PER_HOUR", per_hour)),
+    )
+
+
+def scoped_rules_from_env(prefix: str, **defaults: Tuple[float, float]) -> Dict[str, BucketRule]:
+    """Rules for each scope in `defaults`, read from `<prefix>_<SCOPE>_CAPACITY` / `_PER_HOUR`.
+
+    `scoped_rules_from_env('LLM_QUOTA', user=(10, 60))` reads LLM_QUOTA_USER_CAPACITY
+    and LLM_QUOTA_USER_PER_HOUR, falling back to 10 tokens refilled at 60/hour.
+    """
+    return {
+        scope: rule_from_env(f"{prefix}_{scope.upper()}", capacity=capacity, per_hour=per_hour)
+        for scope, (capacity, per_hour) in defaults.items()
+    }
+
+
+class TokenBucketLimiter:
+    """Admission control over several named scopes (e.g. group + user) checked together."""
+
+    def __init__(self, name: str, rules: Dict[str, BucketRule], store=None):
+        self.name = name
+        self.rules = {scope: rule for scope, rule in rules.items() if rule.enabled}
+        self._store = store
+        self._counts = Counter()
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = get_counter_store()
+        return self._store
+
+    async def acquire(self, cost: float = 1.0, **scopes: Optional[str]) -> Decision:
+        """Take one token per scope, e.g. `acquire(group=group_id, user=user_id)`.
+
+        Scopes whose id is None or that have no rule are skipped. Store errors
+        fail open so a Redis outage never blocks the bot.
+        """
+        buckets = []
+        for scope, ident in scopes.items():
+            rule = self.rules.get(scope)
+            if rule is None or not ident:
+                continue
+            buckets.append((f"{self.name}:{scope}:{ident}", rule))
+        if not buckets:
+            self._counts["admitted"] += 1
+            return Decision(True)
+
+        try:
+            store = self.store
+            if getattr(store, "blocking", True):
+                allowed, wait, limiting = await asyncio.to_thread(store.take_many, buckets, cost)
+            else:
+                allowed, wait, limiting = store.take_many(buckets, cost=cost)
+        except Exception as e:
+            logger.warning(f"Quota store error for {self.name}, allowing request: {e}")
+            self._counts["admitted"] += 1
+            self._counts["store_errors"] += 1
+            return Decision(True)
+
+        if allowed:
+            self._counts["admitted"] += 1
+            return Decision(True)
+        scope = limiting.split(":")[1] if limiting else None
+        self._counts[f"shed_{scope}"] += 1
+        return Decision(False, retry_after_s=wait, scope=scope)
+
+    def stats(self) -> Dict[str, int]:
+        """Admitted and shed counts (per limiting scope) since startup, for /metrics."""
+        shed = {scope: self._counts[f"shed_{scope}"] for scope in self.rules}
+        return {
+            "admitted": self._counts["admitted"],
+            "shed": sum(shed.values()),
+            "shed_by_scope": shed,
+            "store_errors": self._counts["store_errors"],
+        }
+
+
+class AdmissionController:
+    """Token-bucket limits in front of each expensive path (LLM, image, ASR, Drive).
+
+    Each path has its own limiter with up to three scopes checked together:
+    the user, the group and the bot in total. Paths without a limiter (cheap
+    commands such as !help) are always admitted.
+    """
+
+    def __init__(self, limiters: Dict[str, TokenBucketLimiter]):
+        self.limiters = limiters
+
+    async def acquire(
+        self, path: str, group: Optional[str] = None, user: Optional[str] = None, cost: float = 1.0
+    ) -> Decision:
+        limiter = self.limiters.get(path)
+        if limiter is None:
+            return Decision(True)
+        return await limiter.acquire(cost, **{TOTAL_SCOPE: TOTAL_ID, "group": group, "user": user})
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {path: limiter.stats() for path, limiter in self.limiters.items()}
+
+
+def format_retry_after(seconds: float) -> str:
+    seconds = max(1, math.ceil(seconds))
+    if seconds < 60:
+        return f"{seconds} 秒"
+    minutes = math.ceil(seconds / 60)
+    if minutes < 60:
+        return f"{minutes} 分鐘"
+    return f"{math.ceil(minutes / 60)} 小時"
+
+
+def busy_message(decision: Decision, action: str) -> str:
+    """Reply for a shed request, e.g. busy_message(d, '圖片生成')."""
+    retry = format_retry_after(decision.retry_after_s)
+    if decision.scope == "group":
+        return f"⏳ 此群組的{action}次數已達上限，請 {retry}後再試。"
+    if decision.scope == "user":
+        return f"⏳ 你的{action}次數已達上限，請 {retry}後再試。"
+    return f"⏳ 目前{action}的使用人數較多，請 {retry}後再試。"
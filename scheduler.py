@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[Any]]
+
+# Latency samples kept per lane for the percentiles in stats().
+_SAMPLES = 256
+
+
+@dataclass(frozen=True)
+class LaneConfig:
+    name: str
+    # Jobs of this lane running at once.
+    concurrency: int
+    # Queued (not yet running) jobs beyond which submit() rejects.
+    max_queue: int = 100
+    # Lower runs first when lanes compete for the scheduler-wide slots.
+    priority: int = 0
+
+
+def lane_from_env(name: str, concurrency: int, max_queue: int = 100, priority: int = 0) -> LaneConfig:
+    """Read `LANE_<NAME>_CONCURRENCY` / `LANE_<NAME>_QUEUE`, e.g. LANE_LLM_CONCURRENCY=8."""
+    prefix = f"LANE_{name.upper()}"
+    return LaneConfig(
+        name=name,
+        concurrency=max(1, int(os.getenv(f"{prefix}_CONCURRENCY", concurrency))),
+        max_queue=int(os.getenv(f"{prefix}_QUEUE", max_queue)),
+        priority=priority,
+    )
+
+
+def _percentile(samples: Iterable[float], q: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# (enqueued_at, job, key)
+_Entry = Tuple[float, Job, Optional[str]]
+
+
+class _Lane:
+    def __init__(self, config: LaneConfig):
+        self.config = config
+        self.queue: Deque[_Entry] = deque()
+        self.running = 0
+        # Jobs waiting behind an earlier job with the same key.
+        self.parked = 0
+        self.counts = Counter()
+        self.wait_ms: Deque[float] = deque(maxlen=_SAMPLES)
+        self.run_ms: Deque[float] = deque(maxlen=_SAMPLES)
+
+    @property
+    def has_capacity(self) -> bool:
+        return bool(self.queue) and self.running < self.config.concurrency
+
+
+class LaneScheduler:
+    """Runs webhook work in separate lanes so cheap work never waits on heavy work.
+
+    Each lane has its own queue and concurrency limit: recording a message or
+    answering `!help` goes to a wide `interactive` lane while Gemini, image
+    and ASR calls drain in narrow lanes of their own. When `max_running`
+    caps the total, free slots go to the lane with the lowest `priority`
+    value first. A full lane queue rejects new jobs instead of growing
+    without bound. Queue depth, running jobs and wait / run latency per lane
+    are reported by `stats()`.
+
+    Jobs submitted with the same `key` (e.g. one conversation) run one at a
+    time in submission order, even across lanes; a job waiting for its key
+    is parked outside the lanes so it never holds a slot.
+    """
+
+    def __init__(self, lanes: Iterable[LaneConfig], max_running: Optional[int] = None):
+        self._lanes: Dict[str, _Lane] = {lane.name: _Lane(lane) for lane in lanes}
+        self._order: List[_Lane] = sorted(self._lanes.values(), key=lambda lane: lane.config.priority)
+        self.max_running = max_running or sum(lane.config.concurrency for lane in self._order)
+        self._running = 0
+        self._tasks = set()
+        self._idle: Optional[asyncio.Event] = None
+        # key -> jobs parked behind the one currently queued or running
+        self._keys: Dict[str, Deque[Tuple[_Lane, _Entry]]] = {}
+        self._closed = False
+        self._inflight: Dict[asyncio.Task, Optional[str]] = {}
+
+    def lane(self, name: str) -> LaneConfig:
+        return self._lanes[name].config
+
+    def lane_names(self) -> List[str]:
+        """Lane names, highest priority first."""
+        return [lane.config.name for lane in self._order]
+
+    def free_slots(self, name: str) -> int:
+        """Jobs the lane could start right now without queueing."""
+        lane = self._lanes[name]
+        return max(0, lane.config.concurrency - lane.running - len(lane.queue))
+
+    def submit(self, lane_name: str, job: Job, key: Optional[str] = None) -> bool:
+        """Queue `job()` on a lane; returns False (and runs nothing) when the lane is full."""
+        lane = self._lanes[lane_name]
+        if self._closed:
+            lane.counts["rejected"] += 1
+            return False
+        depth = len(lane.queue) + lane.parked
+        if depth >= lane.config.max_queue:
+            lane.counts["rejected"] += 1
+            logger.warning(f"Lane {lane_name} full ({depth} queued), rejecting job")
+            return False
+        lane.counts["submitted"] += 1
+        entry = (time.monotonic(), job, key)
+        if key is not None:
+            if key in self._keys:
+                self._keys[key].append((lane, entry))
+                lane.parked += 1
+                return True
+            self._keys[key] = deque()
+        lane.queue.append(entry)
+        self._dispatch()
+        return True
+
+    def _release(self, key: str) -> None:
+        parked = self._keys.get(key)
+        if parked:
+            lane, entry = parked.popleft()
+            lane.parked -= 1
+            lane.queue.append(entry)
+        else:
+            self._keys.pop(key, None)
+
+    def _dispatch(self) -> None:
+        while self._running < self.max_running:
+            lane = next((lane for lane in self._order if lane.has_capacity), None)
+            if lane is None:
+                return
+            entry = lane.queue.popleft()
+            lane.running += 1
+            self._running += 1
+            if self._idle is not None:
+                self._idle.clear()
+            task = asyncio.get_running_loop().create_task(self._run(lane, entry))
+            self._tasks.add(task)
+            self._inflight[task] = entry[2]
+            task.add_done_callback(self._forget)
+
+    def _forget(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._inflight.pop(task, None)
+
+    async def _run(self, lane: _Lane, entry: _Entry) -> None:
+        enqueued_at, job, key = entry
+        started = time.monotonic()
+        lane.wait_ms.append((started - enqueued_at) * 1000)
+        try:
+            await job()
+            lane.counts["completed"] += 1
+        except asyncio.CancelledError:
+            lane.counts["cancelled"] += 1
+            raise
+        except Exception:
+            lane.counts["failed"] += 1
+            logger.exception(f"Job in lane {lane.config.name} failed")
+        finally:
+            lane.run_ms.append((time.monotonic() - started) * 1000)
+            lane.running -= 1
+            self._running -= 1
+            self._inflight.pop(asyncio.current_task(), None)
+            if key is not None:
+                self._release(key)
+            self._dispatch()
+            if self._running == 0 and self._idle is not None:
+                self._idle.set()
+
+    def pending(self) -> int:
+        return self._running + sum(len(lane.queue) + lane.parked for lane in self._order)
+
+    async def join(self) -> None:
+        """Wait until every queued and running job has finished."""
+        if self._idle is None:
+            self._idle = asyncio.Event()
+        while self.pending():
+            self._idle.clear()
+            await self._idle.wait()
+
+    async def drain(self, timeout_s: float) -> Dict[str, Any]:
+        """Stop accepting jobs, let queued and running ones finish within `timeout_s`, cancel the rest.
+
+        Returns how many jobs finished during the drain and the keys of the
+        ones that did not (queued, parked or cancelled while running).
+        """
+        self._closed = True
+        pending = self.pending()
+        if pending:
+            logger.info(f"Draining {pending} job(s) for up to {timeout_s:.0f}s")
+            try:
+                await asyncio.wait_for(self.join(), timeout_s)
+            except asyncio.TimeoutError:
+                pass
+        unfinished = [key for key in self._inflight.values()]
+        for lane in self._order:
+            unfinished.extend(entry[2] for entry in lane.queue)
+        for parked in self._keys.values():
+            unfinished.extend(entry[2] for _lane, entry in parked)
+        await self.stop()
+        return {"finished": pending - len(unfinished), "unfinished": len(unfinished), "unfinished_keys": unfinished}
+
+    async def stop(self) -> None:
+        """Drop queued jobs and cancel running ones."""
+        for lane in self._order:
+            lane.counts["dropped"] += len(lane.queue) + lane.parked
+            lane.queue.clear()
+            lane.parked = 0
+        self._keys.clear()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for lane in self._order:
+            counts = lane.counts
+            result[lane.config.name] = {
+                "queued": len(lane.queue),
+                "parked": lane.parked,
+                "running": lane.running,
+                "concurrency": lane.config.concurrency,
+                **{key: counts[key] for key in ("submitted", "completed", "failed", "rejected")},
+                "wait_ms_p50": round(_percentile(lane.wait_ms, 0.5), 1),
+                "wait_ms_p95": round(_percentile(lane.wait_ms, 0.95), 1),
+                "run_ms_p50": round(_percentile(lane.run_ms, 0.5), 1),
+                "run_ms_p95": round(_percentile(lane.run_ms, 0.95), 1),
+            }
+        return result
+
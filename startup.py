@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LazyClient:
+    """An external client built once, on first use or by `Warmup`.
+
+    `factory` runs in a worker thread when awaited through `aget()`, so the
+    imports and network checks it does never block the event loop. A
+    factory that raises is not cached and is tried again on the next use.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._built = False
+        self._value = None
+        self.init_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._built
+
+    def peek(self) -> Any:
+        """The client if it was already built, otherwise None (never builds)."""
+        return self._value if self._built else None
+
+    def get(self) -> Any:
+        if self._built:
+            return self._value
+        with self._lock:
+            if not self._built:
+                started = time.perf_counter()
+                try:
+                    self._value = self._factory()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.init_ms = (time.perf_counter() - started) * 1000
+                self.error = None
+                self._built = True
+                logger.info(f"{self.name} client ready in {self.init_ms:.0f}ms")
+        return self._value
+
+    async def aget(self) -> Any:
+        if self._built:
+            return self._value
+        return await asyncio.to_thread(self.get)
+
+
+class Warmup:
+    """Builds registered clients and runs startup steps in parallel, in the background.
+
+    The app starts serving as soon as lifespan startup returns; `ready`
+    turns true once every step has finished (successfully or not — a failed
+    client is built again on first use). `report()` backs the /ready
+    endpoint.
+    """
+
+    def __init__(self):
+        self._clients: List[LazyClient] = []
+        self._steps: List[Tuple[str, Callable[[], Awaitable[Any]]]] = []
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._elapsed_ms: Optional[float] = None
+
+    def add(self, client: LazyClient) -> None:
+        self._clients.append(client)
+
+    def add_step(self, name: str, step: Callable[[], Awaitable[Any]]) -> None:
+        self._steps.append((name, step))
+
+    @property
+    def ready(self) -> bool:
+        return self._task is not None and self._task.done()
+
+    def start(self) -> None:
+        if self._task is None:
+            steps = [(client.name, client.aget) for client in self._clients] + self._steps
+            for name, _ in steps:
+                self._status[name] = {"status": "pending"}
+            self._task = asyncio.create_task(self._run(steps))
+
+    async def _timed(self, name: str, step: Callable[[], Awaitable[Any]]) -> None:
+        started = time.perf_counter()
+        try:
+            await step()
+            self._status[name] = {"status": "ok"}
+        except Exception as e:
+            logger.error(f"Startup step {name} failed: {e}")
+            self._status[name] = {"status": "error", "error": str(e)[:200]}
+        self._status[name]["ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def _run(self, steps: List[Tuple[str, Callable[[], Awaitable[Any]]]]) -> None:
+        started = time.perf_counter()
+        await asyncio.gather(*(self._timed(name, step) for name, step in steps))
+        self._elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Warm-up finished in {self._elapsed_ms:.0f}ms")
+
+    async def wait(self, timeout_s: Optional[float] = None) -> None:
+        if self._task is not None:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout_s)
+
+    async def cancel(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "elapsed_ms": round(self._elapsed_ms, 1) if self._elapsed_ms is not None else None,
+            "components": dict(self._status),
+        }
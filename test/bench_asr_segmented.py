@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+語音分段平行轉錄 vs 單次轉錄的端到端延遲比較
+
+以模擬的 ASR 服務（延遲 = 固定開銷 + 與音訊長度成正比的處理時間）量測，
+不需要任何 API Key，也不需要 ffmpeg（直接使用 16 kHz WAV 輸入）。
+
+    python test/bench_asr_segmented.py [音訊秒數 ...]
+"""
+import asyncio
+import io
+import os
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from asr import ASRHandler, SEGMENT_SAMPLE_RATE
+
+# 模擬服務：每次呼叫 0.4 秒開銷，每秒音訊再花 0.02 秒（約 50 倍即時）
+BASE_LATENCY_S = 0.4
+PER_AUDIO_SECOND_S = 0.02
+
+
+def make_wav(seconds):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SEGMENT_SAMPLE_RATE)
+        w.writeframes(b'\x00\x00' * SEGMENT_SAMPLE_RATE * seconds)
+    return buf.getvalue()
+
+
+def fake_provider(audio, filename):
+    with wave.open(io.BytesIO(audio)) as w:
+        seconds = w.getnframes() / w.getframerate()
+    time.sleep(BASE_LATENCY_S + seconds * PER_AUDIO_SECOND_S)
+    return f"[{seconds:.0f}s]"
+
+
+def make_handler():
+    handler = ASRHandler()
+    handler.groq_client = object()
+    handler.transcribe_groq = fake_provider
+    handler.timeouts['groq'] = 600
+    return handler
+
+
+async def bench(seconds):
+    audio = make_wav(seconds)
+
+    handler = make_handler()
+    started = time.perf_counter()
+    await handler.transcribe_async(audio, filename='bench.wav')
+    single = time.perf_counter() - started
+
+    handler = make_handler()
+    started = time.perf_counter()
+    await handler.transcribe_async(audio, filename='bench.wav', duration_ms=seconds * 1000)
+    segmented = time.perf_counter() - started
+
+    return single, segmented
+
+
+def main():
+    durations = [int(arg) for arg in sys.argv[1:]] or [30, 90, 180, 300]
+    print(f"{'audio':>8} {'single':>10} {'segmented':>10} {'speedup':>8}")
+    for seconds in durations:
+        single, segmented = asyncio.run(bench(seconds))
+        print(f"{seconds:>7}s {single:>9.2f}s {segmented:>9.2f}s {single / segmented:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
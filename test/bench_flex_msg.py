@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Flex 回覆訊息建立成本：每次完整驗證 vs 預先驗證的樣板
+
+「建立」只量測產生 FlexMessage；「建立+序列化」再加上送出前的 to_dict()。
+需要安裝 line-bot-sdk。
+
+    python test/bench_flex_msg.py [次數]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from linebot.v3.messaging import FlexContainer, FlexMessage
+
+import flex_msg
+from flex_msg import create_flex_message, static_flex_message
+
+REPLY = "梯度下降是一種最佳化方法，" * 20
+HELP = "🤖 群組摘要王 使用說明\n" + "• !摘要：產生對話摘要\n" * 15
+
+
+def rebuild_and_validate(text):
+    # 改版前的做法：每次重建整個 dict 並完整驗證
+    return FlexMessage(
+        alt_text=text[:400],
+        contents=FlexContainer.from_dict(
+            flex_msg._bubble_json(text, flex_msg.DEFAULT_TITLE, flex_msg.DEFAULT_AUTHOR, flex_msg.DEFAULT_HEADER_TEXT)
+        ),
+    )
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    assert rebuild_and_validate(REPLY).to_dict() == create_flex_message(REPLY).to_dict()
+
+    cases = [
+        ("reply: rebuild + validate", lambda: rebuild_and_validate(REPLY)),
+        ("reply: template", lambda: create_flex_message(REPLY)),
+        ("help:  rebuild + validate", lambda: rebuild_and_validate(HELP)),
+        ("help:  cached", lambda: static_flex_message(HELP)),
+    ]
+    print(f"{'case':<28} {'build':>10} {'build+to_dict':>14}")
+    for name, build in cases:
+        build_us = timeit.timeit(build, number=number) / number * 1e6
+        total_us = timeit.timeit(lambda: build().to_dict(), number=number) / number * 1e6
+        print(f"{name:<28} {build_us:>8.1f}µs {total_us:>12.1f}µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+冷啟動成本：匯入 main.py 的時間，以及延遲建立的外部 client 若在匯入時載入會多花多少
+
+每次都在新的 Python 程序中量測（模擬 serverless 冷啟動），並以 -X importtime 列出最耗時的模組。
+需要安裝 requirements.txt 的套件；LINE 憑證以假值代入，不會連線。
+
+    python test/bench_startup.py [次數]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+HEAVY = "google.generativeai, google.genai, google.cloud.storage, groq, openai, uvicorn"
+ENV = dict(
+    os.environ,
+    API_ENV='production',
+    LINE_CHANNEL_SECRET='bench',
+    LINE_CHANNEL_ACCESS_TOKEN='bench',
+    STARTUP_WARMUP='false',
+)
+
+
+def run(code, *flags):
+    return subprocess.run(
+        [sys.executable, *flags, '-c', code], cwd=ROOT, env=ENV,
+        capture_output=True, text=True, check=True,
+    )
+
+
+def wall_ms(code, number):
+    timer = "import time; t = time.perf_counter(); {}; print((time.perf_counter() - t) * 1000)"
+    return statistics.median(float(run(timer.format(code)).stdout.split()[-1]) for _ in range(number))
+
+
+def top_imports(code, limit=15):
+    # -X importtime 的每一行：import time: self [us] | cumulative | imported package
+    rows = []
+    for line in run(code, '-X', 'importtime').stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    cases = [
+        ("import main (lazy clients)", "import main"),
+        ("import main + heavy SDKs", f"import main, {HEAVY}"),
+        ("heavy SDKs only", f"import {HEAVY}"),
+    ]
+    print(f"{'case':<30} {'median':>10}")
+    for name, code in cases:
+        print(f"{name:<30} {wall_ms(code, number):>8.0f}ms")
+
+    print(f"\n{'cumulative':>12}  module (import main)")
+    for cumulative_us, module in top_imports("import main"):
+        print(f"{cumulative_us / 1000:>10.1f}ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+測試 Gemini 語音轉文字：inline 與 File API 的選擇、處理狀態輪詢退避、上傳檔案一定會刪除
+"""
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import asr
+from asr import ASRHandler
+
+
+def uploaded(state, name='files/audio-1'):
+    return SimpleNamespace(name=name, state=SimpleNamespace(name=state))
+
+
+def make_handler(inline_limit=100, states=('ACTIVE',), generate=None, upload_s=0):
+    """只啟用 Gemini；SDK 呼叫以假的實作取代並記錄呼叫順序"""
+    handler = ASRHandler()
+    handler.groq_client = None
+    handler.openai_client = None
+    handler.gemini_key = 'test-key'
+    handler.gemini_inline_limit = inline_limit
+    handler.calls = []
+    remaining = list(states)
+
+    def fake_generate(audio_part):
+        handler.calls.append(('generate', 'inline' if isinstance(audio_part, dict) else audio_part.name))
+        if generate is not None:
+            return generate()
+        return 'transcript'
+
+    def fake_upload(data, mime_type, filename):
+        handler.calls.append(('upload', len(data)))
+        time.sleep(upload_s)
+        return uploaded('PROCESSING')
+
+    def fake_get_file(name):
+        handler.calls.append(('get', name))
+        return uploaded(remaining.pop(0) if len(remaining) > 1 else remaining[0], name)
+
+    handler._gemini_generate = fake_generate
+    handler._gemini_upload = fake_upload
+    handler._gemini_get_file = fake_get_file
+    handler._gemini_delete_file = lambda name: handler.calls.append(('delete', name))
+    return handler
+
+
+@pytest.mark.parametrize('size, inline', [(100, True), (101, False)])
+def test_inline_limit_boundary(size, inline):
+    """ASR_GEMINI_INLINE_LIMIT 以內直接夾帶音檔，超過才上傳到 File API"""
+    handler = make_handler(inline_limit=100)
+    assert asyncio.run(handler.transcribe_gemini_async(b'x' * size)) == 'transcript'
+    assert handler.transcribe_gemini(b'x' * size) == 'transcript'
+    if inline:
+        assert handler.calls == [('generate', 'inline')] * 2
+    else:
+        assert handler.calls.count(('upload', size)) == 2
+        assert ('generate', 'inline') not in handler.calls
+
+
+def test_polling_backs_off_exponentially_up_to_cap(monkeypatch):
+    handler = make_handler(inline_limit=0, states=['PROCESSING'] * 5 + ['ACTIVE'])
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(asr.asyncio, 'sleep', fake_sleep)
+    assert asyncio.run(handler.transcribe_gemini_async(b'audio')) == 'transcript'
+    assert delays == [0.25, 0.5, 1.0, 2.0, 2.0, 2.0]
+    assert delays[-1] == asr.GEMINI_POLL_MAX_S
+
+
+def test_uploaded_file_is_deleted_on_success_and_error():
+    handler = make_handler(inline_limit=0)
+    asyncio.run(handler.transcribe_gemini_async(b'audio'))
+    assert handler.calls[-1] == ('delete', 'files/audio-1')
+
+    handler = make_handler(inline_limit=0, states=['FAILED'])
+    with pytest.raises(Exception, match='processing failed'):
+        asyncio.run(handler.transcribe_gemini_async(b'audio'))
+    assert handler.calls[-1] == ('delete', 'files/audio-1')
+
+    def broken():
+        raise RuntimeError('quota exceeded')
+
+    handler = make_handler(inline_limit=0, generate=broken)
+    with pytest.raises(RuntimeError):
+        asyncio.run(handler.transcribe_gemini_async(b'audio'))
+    assert handler.calls[-1] == ('delete', 'files/audio-1')
+
+
+def test_uploaded_file_is_deleted_when_provider_timeout_cancels():
+    """處理一直未完成、被 ASR_TIMEOUT_GEMINI 取消時，上傳的檔案仍會刪除"""
+    handler = make_handler(inline_limit=0, states=['PROCESSING'])
+    handler.timeouts['gemini'] = 0.3
+    with pytest.raises(Exception, match='All ASR providers failed'):
+        asyncio.run(handler.transcribe_async(b'audio'))
+    assert ('get', 'files/audio-1') in handler.calls
+    assert handler.calls[-1] == ('delete', 'files/audio-1')
+    assert ('generate', 'files/audio-1') not in handler.calls
+
+
+def test_upload_cancelled_midway_is_deleted_once_it_finishes():
+    """上傳途中就逾時：上傳仍會在執行緒中完成，完成後刪除"""
+    handler = make_handler(inline_limit=0, upload_s=0.3)
+    handler.timeouts['gemini'] = 0.05
+    with pytest.raises(Exception, match='All ASR providers failed'):
+        asyncio.run(handler.transcribe_async(b'audio'))
+    assert handler.calls == [('upload', 5), ('delete', 'files/audio-1')]
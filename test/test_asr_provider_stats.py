@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+測試 ASR 服務延遲統計與斷路器
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from asr import ASRHandler, ProviderStats
+
+
+def make_handler():
+    handler = ASRHandler()
+    handler.groq_client = object()
+    handler.openai_client = object()
+    handler.gemini_key = None
+    return handler
+
+
+def test_breaker_opens_and_recovers():
+    stats = ProviderStats('groq', prior_latency_s=1.0, failure_threshold=2, cooldown_s=10)
+    stats.record(False, 0.1, now=0)
+    assert stats.state(now=0) == 'closed'
+    stats.record(False, 0.1, now=1)
+    assert stats.state(now=2) == 'open'
+    assert not stats.allow(now=2)
+    assert stats.state(now=11) == 'half_open'
+    stats.record(True, 0.5, now=11)
+    assert stats.state(now=11) == 'closed'
+
+
+def test_order_follows_measured_latency():
+    handler = make_handler()
+    handler.stats['groq'].record(True, 5.0)
+    handler.stats['openai'].record(True, 1.0)
+    assert handler._provider_order() == ['openai', 'groq']
+
+
+def test_failing_provider_is_deprioritised_then_skipped():
+    handler = make_handler()
+    handler.default_provider = 'groq'
+    calls = []
+
+    def broken(audio, filename):
+        calls.append('groq')
+        raise RuntimeError('down')
+
+    handler.transcribe_groq = broken
+    handler.transcribe_openai = lambda audio, filename: 'hello'
+
+    # 第一次失敗後 groq 的預期延遲變高，之後改由 openai 先處理
+    for _ in range(3):
+        assert asyncio.run(handler.transcribe_async(b'x')) == 'hello'
+    assert calls == ['groq']
+
+    # 斷路器開啟後完全不再嘗試
+    for _ in range(2):
+        handler.stats['groq'].record(False, 0.1)
+    assert handler.stats['groq'].state() == 'open'
+    assert handler._provider_order() == ['openai']
+    assert handler.provider_stats()['groq']['failures'] == 3
+
+
+def test_repeated_clip_is_served_from_cache():
+    handler = make_handler()
+    calls = []
+
+    def provider(audio, filename):
+        calls.append(filename)
+        return 'forwarded voice'
+
+    handler.transcribe_groq = provider
+    handler.transcribe_openai = provider
+
+    assert asyncio.run(handler.transcribe_async(b'same clip', filename='a.m4a')) == 'forwarded voice'
+    assert asyncio.run(handler.transcribe_async(b'same clip', filename='b.m4a')) == 'forwarded voice'
+    assert calls == ['a.m4a']
+    assert handler.provider_stats()['cache']['hits'] == 1
+
+
+def test_timed_out_call_does_not_starve_the_pool():
+    """逾時被放棄的呼叫仍佔著執行緒時，下一個服務的呼叫不必排在它後面"""
+    os.environ['ASR_MAX_CONCURRENCY'] = '1'
+    try:
+        handler = make_handler()
+    finally:
+        del os.environ['ASR_MAX_CONCURRENCY']
+    handler.default_provider = 'groq'
+    handler.timeouts.update(groq=0.05, openai=1.0)
+    stuck = threading.Event()
+
+    handler.transcribe_groq = lambda audio, filename: stuck.wait(5)
+    handler.transcribe_openai = lambda audio, filename: 'hello'
+    try:
+        assert asyncio.run(handler.transcribe_async(b'x')) == 'hello'
+    finally:
+        stuck.set()
+
+
+def test_cancelled_caller_does_not_cancel_shared_transcription():
+    """同一段語音同時被要求兩次時共用一次轉錄；第一個呼叫者被取消不影響第二個"""
+    handler = make_handler()
+    calls = []
+
+    def slow_provider(audio, filename):
+        calls.append(filename)
+        time.sleep(0.1)
+        return 'shared'
+
+    handler.transcribe_groq = slow_provider
+    handler.transcribe_openai = slow_provider
+
+    async def main():
+        first = asyncio.create_task(handler.transcribe_async(b'clip'))
+        second = asyncio.create_task(handler.transcribe_async(b'clip'))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        assert await second == 'shared'
+        assert first.cancelled()
+
+    asyncio.run(main())
+    assert len(calls) == 1
+    assert handler._inflight == {}
+
+
+if __name__ == "__main__":
+    test_breaker_opens_and_recovers()
+    test_order_follows_measured_latency()
+    test_failing_provider_is_deprioritised_then_skipped()
+    test_repeated_clip_is_served_from_cache()
+    test_timed_out_call_does_not_starve_the_pool()
+    test_cancelled_caller_does_not_cancel_shared_transcription()
+    print("✅ ASR provider stats tests passed")
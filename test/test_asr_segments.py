@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+測試長語音分段與轉錄結果拼接
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from asr import SEGMENT_SAMPLE_RATE, split_pcm_to_wav, stitch_transcripts
+
+
+def test_split_covers_audio_with_overlap():
+    pcm = b'\x00\x00' * SEGMENT_SAMPLE_RATE * 70  # 70 秒
+    segments = split_pcm_to_wav(pcm, segment_s=30, overlap_s=2)
+    # 0-30, 28-58, 56-70
+    assert len(segments) == 3
+
+
+def test_overlap_not_shorter_than_segment_still_advances():
+    """重疊設定 >= 分段長度時每段至少前進 1 秒，不會無窮迴圈或出錯"""
+    pcm = b'\x00\x00' * SEGMENT_SAMPLE_RATE * 5  # 5 秒
+    for overlap_s in (2, 3):
+        # 0-2, 1-3, 2-4, 3-5
+        assert len(split_pcm_to_wav(pcm, segment_s=2, overlap_s=overlap_s)) == 4
+
+
+def test_stitch_removes_overlap():
+    assert stitch_transcripts(['今天天氣很好我們一起去', '我們一起去公園散步']) == '今天天氣很好我們一起去公園散步'
+    assert stitch_transcripts(['hello there my friend', 'my friend how are you']) == 'hello there my friend how are you'
+    assert stitch_transcripts(['first part', '', 'second part']) == 'first part second part'
+
+
+if __name__ == "__main__":
+    test_split_covers_audio_with_overlap()
+    test_overlap_not_shorter_than_segment_still_advances()
+    test_stitch_removes_overlap()
+    print("✅ ASR segment tests passed")
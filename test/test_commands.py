@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+測試指令路由：正規化、別名比對、參數擷取與對話紀錄旗標
+"""
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+
+import commands
+
+
+def make_router():
+    router = commands.CommandRouter()
+
+    @router.command('清空', 'clean')
+    async def clear(ctx):
+        return 'cleared'
+
+    @router.command('help', '幫助', records_history=False)
+    async def help_(ctx):
+        return 'help'
+
+    @router.command('畫圖', '生成圖片', 'image', 'draw', records_history=False)
+    async def image(ctx):
+        return f"image:{ctx.args}"
+
+    @router.command('drive', records_history=False)
+    async def drive(ctx):
+        return f"drive:{ctx.args}"
+
+    return router
+
+
+def test_full_width_prefix_and_case_are_normalized():
+    router = make_router()
+    for text in ['!清空', '！清空', '  !CLEAN  ', '！Clean']:
+        match = router.match(text)
+        assert match and match.command.name == '清空', text
+
+
+def test_arguments_follow_alias():
+    router = make_router()
+    assert router.match('!畫圖 可愛的貓咪').args == '可愛的貓咪'
+    assert router.match('！畫圖可愛的貓咪').args == '可愛的貓咪'
+    assert router.match('!Draw A Red Fox').args == 'A Red Fox'
+    assert router.match('!drive link GDRIVE-ABCDE').args == 'link GDRIVE-ABCDE'
+
+
+def test_ascii_aliases_need_word_boundary():
+    router = make_router()
+    assert router.match('!cleanup') is None
+    assert router.match('!images of cats') is None
+    assert router.match('!clean!').command.name == '清空'
+
+
+def test_not_a_command():
+    router = make_router()
+    assert router.match('') is None
+    assert router.match('hello') is None
+    assert router.match('我想 !畫圖 一隻貓') is None
+    assert router.match('!unknown') is None
+
+
+def test_command_after_mention():
+    router = make_router()
+    match = router.match('@群組摘要王 !help')
+    assert match.command.name == 'help'
+    assert not match.records_history
+    assert router.match('@群組摘要王 @Bob  !清空').command.name == '清空'
+    # 提及某人後引用指令的一般訊息不是指令
+    assert router.match('@Alice 聽說 !clear 很好用嗎') is None
+    assert router.match('@Alice 你好 !清空') is None
+    assert router.match('@Alice 聽說 !clean 很好用嗎') is None
+
+
+def mentionee(text, name):
+    """依 LINE 的 mention 格式產生提及位置（UTF-16 單位）"""
+    index = len(text[:text.index(name)].encode('utf-16-le')) // 2
+    return SimpleNamespace(index=index, length=len(name.encode('utf-16-le')) // 2)
+
+
+def test_mentions_are_stripped_by_span():
+    """顯示名稱含空白或 emoji 時，依 mentionees 的 index/length 去除開頭的提及"""
+    router = make_router()
+    text = '@David Chen !清空'
+    assert router.match(text) is None
+    assert router.match(text, [mentionee(text, '@David Chen')]).command.name == '清空'
+
+    text = '@小明 😀 Lee @Bob Wu  !畫圖 貓'
+    spans = [mentionee(text, '@Bob Wu'), mentionee(text, '@小明 😀 Lee')]
+    assert router.match(text, spans).args == '貓'
+
+    # 提及之後先有其他文字，仍不是指令
+    text = '@David Chen 聽說 !清空 很好用'
+    assert router.match(text, [mentionee(text, '@David Chen')]) is None
+    text = '!清空 @David Chen'
+    assert router.match(text, [mentionee(text, '@David Chen')]).command.name == '清空'
+
+
+def test_dispatch_and_history_flags():
+    router = make_router()
+    match = router.match('!生成圖片 夕陽')
+    ctx = commands.CommandContext(
+        event=None, text='!生成圖片 夕陽', args=match.args, user_id='U1',
+        fdb=None, user_chat_path='users/U1', line_bot_api=None,
+    )
+    assert asyncio.run(match.command.handler(ctx)) == 'image:夕陽'
+    assert router.match('!清空').records_history
+    assert not router.match('!drive status').records_history
+
+
+def test_duplicate_alias_is_rejected():
+    router = make_router()
+    with pytest.raises(ValueError):
+        @router.command('help')
+        async def other(ctx):
+            return ''
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+測試內容下載扇出：一次下載、多個消費者、背壓與錯誤隔離
+"""
+import asyncio
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import content_ingest
+
+
+def make_source(n_chunks, size=4, produced=None, fail_at=None):
+    async def source():
+        for i in range(n_chunks):
+            if fail_at == i:
+                raise ConnectionError('download interrupted')
+            if produced is not None:
+                produced.append(i)
+            yield bytes([i % 256]) * size
+            await asyncio.sleep(0)
+    return source()
+
+
+def test_every_consumer_sees_the_whole_stream_once():
+    produced = []
+    expected = b''.join(bytes([i]) * 4 for i in range(10))
+
+    async def main():
+        return await content_ingest.fan_out(make_source(10, produced=produced), {
+            'body': content_ingest.collect_consumer(),
+            'sha256': content_ingest.sha256_consumer,
+        })
+
+    results = asyncio.run(main())
+    assert produced == list(range(10))
+    assert results['body'] == expected
+    assert results['sha256'] == (hashlib.sha256(expected).hexdigest(), len(expected))
+
+
+def test_stream_digest_hashes_while_forwarding():
+    """轉存的消費者自己邊轉送邊算雜湊，不需要第二個消費者或第二次下載"""
+    expected = b''.join(bytes([i]) * 4 for i in range(10))
+    digest = content_ingest.StreamDigest()
+
+    async def main():
+        collect = content_ingest.collect_consumer()
+        return await content_ingest.fan_out(make_source(10), {'body': lambda chunks: collect(digest.tap(chunks))})
+
+    assert asyncio.run(main())['body'] == expected
+    assert digest.hexdigest() == hashlib.sha256(expected).hexdigest()
+    assert digest.size == len(expected)
+
+
+def test_slow_consumer_applies_backpressure():
+    produced = []
+    lag = []
+
+    async def slow(chunks):
+        seen = 0
+        async for _ in chunks:
+            seen += 1
+            lag.append(len(produced) - seen)
+            await asyncio.sleep(0.005)
+        return seen
+
+    async def main():
+        return await content_ingest.fan_out(
+            make_source(20, produced=produced),
+            {'slow': slow, 'fast': content_ingest.sha256_consumer},
+            max_buffered_chunks=2,
+        )
+
+    results = asyncio.run(main())
+    assert results['slow'] == 20
+    # 下載最多領先慢速消費者「佇列長度 + 1」個區塊
+    assert max(lag) <= 3
+
+
+def test_failing_consumer_does_not_stop_others():
+    async def broken(chunks):
+        async for _ in chunks:
+            raise RuntimeError('summarizer crashed')
+
+    async def main():
+        return await content_ingest.fan_out(make_source(8), {
+            'broken': broken,
+            'body': content_ingest.collect_consumer(),
+        }, max_buffered_chunks=1)
+
+    results = asyncio.run(main())
+    assert isinstance(results['broken'], RuntimeError)
+    assert len(results['body']) == 32
+
+
+def test_source_failure_reaches_consumers_and_caller():
+    seen = {}
+
+    async def watcher(chunks):
+        try:
+            async for _ in chunks:
+                pass
+        except ConnectionError as e:
+            seen['error'] = e
+            raise
+
+    async def main():
+        await content_ingest.fan_out(make_source(5, fail_at=3), {'watcher': watcher})
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(main())
+    assert 'error' in seen
+
+
+def test_registry_builds_per_kind_and_skips_none():
+    registry = content_ingest.ConsumerRegistry()
+    registry.register('file', 'sha256', lambda ctx: content_ingest.sha256_consumer)
+    registry.register('file', 'pdf_only', lambda ctx: None if not ctx['name'].endswith('.pdf') else content_ingest.sha256_consumer)
+    registry.register('audio', 'body', lambda ctx: content_ingest.collect_consumer())
+
+    assert set(registry.build('file', {'name': 'a.txt'})) == {'sha256'}
+    assert set(registry.build('file', {'name': 'a.pdf'})) == {'sha256', 'pdf_only'}
+    assert set(registry.build('audio', {})) == {'body'}
+    assert registry.build('image', {}) == {}
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+測試 Drive 日期子資料夾的 folder ID 快取
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import drive_export_async
+
+
+def install_fake_ensure(monkeypatch):
+    calls = []
+
+    async def fake_ensure(*, access_token, name, parent_id=None):
+        calls.append((parent_id, name))
+        await asyncio.sleep(0.02)
+        return f"{parent_id}/{name}", name
+
+    monkeypatch.setattr(drive_export_async, 'drive_ensure_folder', fake_ensure)
+    return calls
+
+
+def test_burst_resolves_each_folder_once(monkeypatch):
+    calls = install_fake_ensure(monkeypatch)
+    cache = drive_export_async.FolderCache()
+
+    async def main():
+        return await asyncio.gather(*(
+            cache.ensure_path(access_token='t', parent_id='root', path='2026/10')
+            for _ in range(20)
+        ))
+
+    assert asyncio.run(main()) == ['root/2026/10'] * 20
+    assert calls == [('root', '2026'), ('root/2026', '10')]
+
+    # 下個月只需要建立新的月份資料夾
+    asyncio.run(cache.ensure_path(access_token='t', parent_id='root', path='2026/11'))
+    assert calls[2:] == [('root/2026', '11')]
+
+
+def test_invalidate_forces_lookup(monkeypatch):
+    calls = install_fake_ensure(monkeypatch)
+    cache = drive_export_async.FolderCache()
+
+    asyncio.run(cache.ensure_path(access_token='t', parent_id='root', path='2026/10'))
+    cache.invalidate()
+    asyncio.run(cache.ensure_path(access_token='t', parent_id='root', path='/2026//10/'))
+    assert len(calls) == 4
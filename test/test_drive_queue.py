@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+測試 Drive 轉存佇列：重試、永久失敗與 !drive retry
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import drive_queue
+from drive_queue import DriveJob, DriveUploadQueue, PermanentJobError
+
+
+class FakeFirebase:
+    """以巢狀 dict 模擬 python-firebase 的 get / put / delete"""
+
+    def __init__(self):
+        self.root = {}
+
+    def _node(self, path, create=False):
+        node = self.root
+        for part in [p for p in path.split('/') if p]:
+            if part not in node:
+                if not create:
+                    return None
+                node[part] = {}
+            node = node[part]
+        return node
+
+    def get(self, path, name):
+        node = self._node(path)
+        if node is None or name is None:
+            return node
+        return node.get(name)
+
+    def put(self, path, name, data):
+        self._node(path, create=True)[name] = data
+
+    def delete(self, path, name):
+        node = self._node(path)
+        if node is not None:
+            node.pop(name, None)
+
+
+def make_queue(fdb, runner, **kwargs):
+    kwargs.setdefault('retry_base_s', 0.01)
+    kwargs.setdefault('workers', 2)
+    return DriveUploadQueue(lambda: fdb, runner, poll_interval_s=0.01, **kwargs)
+
+
+async def wait_for_status(fdb, group_id, message_id, status, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        record = fdb.get(drive_queue.uploads_path(group_id), message_id)
+        if isinstance(record, dict) and record.get('status') == status:
+            return record
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"{message_id} never reached {status}: {record}")
+
+
+def test_transient_failure_is_retried_with_session_kept():
+    fdb = FakeFirebase()
+    seen = []
+
+    async def runner(job, checkpoint):
+        seen.append((job.attempts, job.session_uri, job.committed_bytes))
+        if job.attempts == 1:
+            job.session_uri = 'https://upload/session'
+            job.committed_bytes = 1024
+            await checkpoint(job)
+            raise RuntimeError('503 from Drive')
+        return 'drive-file-id'
+
+    async def main():
+        queue = make_queue(fdb, runner)
+        queue.start()
+        await queue.enqueue(DriveJob(group_id='G1', message_id='M1', file_name='a.pdf'))
+        record = await wait_for_status(fdb, 'G1', 'M1', 'success')
+        await queue.stop()
+        return record
+
+    record = asyncio.run(main())
+    assert record['drive_file_id'] == 'drive-file-id'
+    assert 'session_uri' not in record
+    # 第二次嘗試從上次確認的位置續傳
+    assert seen == [(1, None, 0), (2, 'https://upload/session', 1024)]
+    assert fdb.get(drive_queue.JOBS_INDEX_PATH, 'G1__M1') is None
+
+
+def test_permanent_failure_then_manual_retry():
+    fdb = FakeFirebase()
+    fail = [True]
+
+    async def runner(job, checkpoint):
+        if fail[0]:
+            raise PermanentJobError('line_content_unavailable')
+        return 'drive-file-id'
+
+    async def main():
+        queue = make_queue(fdb, runner)
+        queue.start()
+        await queue.enqueue(DriveJob(group_id='G1', message_id='M1', file_name='a.pdf'))
+        failed = await wait_for_status(fdb, 'G1', 'M1', 'failed')
+        assert failed['attempts'] == 1
+
+        fail[0] = False
+        assert await queue.requeue_failed('G1') == 1
+        await wait_for_status(fdb, 'G1', 'M1', 'success')
+        assert await queue.requeue_failed('G1') == 0
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_gives_up_after_max_attempts():
+    fdb = FakeFirebase()
+
+    async def runner(job, checkpoint):
+        raise RuntimeError('still broken')
+
+    async def main():
+        queue = make_queue(fdb, runner, max_attempts=3)
+        queue.start()
+        await queue.enqueue(DriveJob(group_id='G1', message_id='M1', file_name='a.pdf'))
+        record = await wait_for_status(fdb, 'G1', 'M1', 'failed')
+        await queue.stop()
+        return record
+
+    record = asyncio.run(main())
+    assert record['attempts'] == 3
+    assert record['error'] == 'still broken'
+
+
+def test_runner_fields_are_stored_on_success():
+    fdb = FakeFirebase()
+
+    async def runner(job, checkpoint):
+        return {'drive_file_id': 'original-id', 'duplicate_of': 'M0', 'content_sha256': 'abc'}
+
+    async def main():
+        queue = make_queue(fdb, runner)
+        queue.start()
+        await queue.enqueue(DriveJob(group_id='G1', message_id='M1', file_name='a.pdf', file_size=42))
+        record = await wait_for_status(fdb, 'G1', 'M1', 'success')
+        await queue.stop()
+        return record
+
+    record = asyncio.run(main())
+    assert record['drive_file_id'] == 'original-id'
+    assert record['duplicate_of'] == 'M0'
+    assert record['file_size'] == 42
+    assert drive_queue.hashes_path('G1', 42) == 'groups/G1/info/drive_export/hashes/42'
+
+
+def test_burst_fans_out_per_group():
+    fdb = FakeFirebase()
+    running = {}
+    peak = {}
+    finished = []
+
+    async def runner(job, checkpoint):
+        running[job.group_id] = running.get(job.group_id, 0) + 1
+        peak[job.group_id] = max(peak.get(job.group_id, 0), running[job.group_id])
+        await asyncio.sleep(0.05)
+        running[job.group_id] -= 1
+        finished.append(job.key)
+        return f"file-{job.message_id}"
+
+    async def main():
+        queue = make_queue(fdb, runner, workers=4, group_concurrency=2)
+        queue.start()
+        for i in range(6):
+            await queue.enqueue(DriveJob(group_id='G1', message_id=f'M{i}', file_name=f'{i}.pdf'))
+        await queue.enqueue(DriveJob(group_id='G2', message_id='X', file_name='x.pdf'))
+        for i in range(6):
+            await wait_for_status(fdb, 'G1', f'M{i}', 'success')
+        await wait_for_status(fdb, 'G2', 'X', 'success')
+        await queue.stop()
+
+    asyncio.run(main())
+    assert peak == {'G1': 2, 'G2': 1}
+    # 另一個群組不必等 G1 的整批檔案傳完
+    assert finished.index('G2__X') < len(finished) - 1
+
+
+def test_drain_finishes_fast_jobs_and_leaves_slow_ones_resumable():
+    """關機時：期限內完成的上傳記為成功，逾時的保留續傳進度並排回佇列（不計失敗次數）"""
+    fdb = FakeFirebase()
+    started = []
+
+    async def runner(job, checkpoint):
+        started.append(job.message_id)
+        if job.message_id == 'slow':
+            job.session_uri = 'https://upload/session'
+            job.committed_bytes = 4096
+            await checkpoint(job)
+            await asyncio.sleep(10)
+        await asyncio.sleep(0.01)
+        return f'drive-{job.message_id}'
+
+    async def main():
+        queue = make_queue(fdb, runner)
+        queue.start()
+        await queue.enqueue(DriveJob(group_id='G1', message_id='fast', file_name='a.pdf'))
+        await queue.enqueue(DriveJob(group_id='G1', message_id='slow', file_name='b.pdf'))
+        while len(started) < 2:
+            await asyncio.sleep(0.01)
+        report = await queue.drain(timeout_s=0.2)
+        # drain 開始後排入的工作不會在此程序執行
+        await queue.enqueue(DriveJob(group_id='G1', message_id='late', file_name='c.pdf'))
+        return report
+
+    report = asyncio.run(main())
+    assert report == {'finished': 1, 'interrupted': 1}
+    assert fdb.get(drive_queue.uploads_path('G1'), 'fast')['status'] == 'success'
+    slow = fdb.get(drive_queue.uploads_path('G1'), 'slow')
+    assert slow['status'] == 'queued'
+    assert slow['attempts'] == 0
+    assert slow['session_uri'] == 'https://upload/session'
+    assert slow['committed_bytes'] == 4096
+    assert fdb.get(drive_queue.JOBS_INDEX_PATH, 'G1__slow') is not None
+    assert fdb.get(drive_queue.JOBS_INDEX_PATH, 'G1__late') is not None
+    assert 'late' not in started
+
+
+def test_leased_job_is_not_run_twice_across_processes():
+    """兩個程序共用同一 Firebase：上傳時間超過重試間隔時，另一個程序仍不會重複上傳"""
+    fdb = FakeFirebase()
+    runs = []
+
+    async def runner(job, checkpoint):
+        runs.append(job.key)
+        await asyncio.sleep(0.3)
+        await checkpoint(job)
+        return 'drive-file-id'
+
+    async def main():
+        first = make_queue(fdb, runner, worker_id='w1', lease_s=0.1)
+        second = make_queue(fdb, runner, worker_id='w2', lease_s=0.1)
+        first.start()
+        await first.enqueue(DriveJob(group_id='G1', message_id='M1', file_name='a.pdf'))
+        while not runs:
+            await asyncio.sleep(0.01)
+        second.start()
+        record = await wait_for_status(fdb, 'G1', 'M1', 'success')
+        await first.stop()
+        await second.stop()
+        return record
+
+    record = asyncio.run(main())
+    assert runs == ['G1__M1']
+    assert record['attempts'] == 1
+    assert 'owner' not in record
+
+
+def test_expired_lease_is_taken_over():
+    """持有者當機（lease 過期）後由其他程序接手，仍持有中的工作則不動"""
+    fdb = FakeFirebase()
+    runs = []
+
+    async def runner(job, checkpoint):
+        runs.append(job.message_id)
+        return 'drive-file-id'
+
+    now = __import__('time').time()
+    for message_id, lease_until in (('crashed', now - 1), ('busy', now + 60)):
+        fdb.put(drive_queue.uploads_path('G1'), message_id, {
+            'status': 'running', 'file_name': 'a.pdf', 'attempts': 1,
+            'owner': 'dead-worker', 'lease_until': lease_until,
+        })
+        fdb.put(drive_queue.JOBS_INDEX_PATH, f'G1__{message_id}', {'next_attempt_at': 0})
+
+    async def main():
+        queue = make_queue(fdb, runner, worker_id='w2')
+        queue.start()
+        await wait_for_status(fdb, 'G1', 'crashed', 'success')
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+    asyncio.run(main())
+    assert runs == ['crashed']
+    assert fdb.get(drive_queue.uploads_path('G1'), 'busy')['owner'] == 'dead-worker'
+
+
+def test_lost_lease_stops_without_saving():
+    fdb = FakeFirebase()
+    aborted = []
+
+    async def runner(job, checkpoint):
+        # 另一個程序在此期間接手了這筆工作
+        record = dict(fdb.get(drive_queue.uploads_path('G1'), 'M1'), owner='w2')
+        fdb.put(drive_queue.uploads_path('G1'), 'M1', record)
+        job.committed_bytes = 1024
+        try:
+            await checkpoint(job)
+        except drive_queue.LeaseLostError:
+            aborted.append(job.key)
+            raise
+        return 'drive-file-id'
+
+    async def main():
+        queue = make_queue(fdb, runner, worker_id='w1')
+        queue.start()
+        await queue.enqueue(DriveJob(group_id='G1', message_id='M1', file_name='a.pdf'))
+        while not aborted:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+    asyncio.run(main())
+    record = fdb.get(drive_queue.uploads_path('G1'), 'M1')
+    assert record['status'] == 'running'
+    assert record['owner'] == 'w2'
+    assert 'drive_file_id' not in record
+
+
+if __name__ == "__main__":
+    test_transient_failure_is_retried_with_session_kept()
+    test_permanent_failure_then_manual_retry()
+    test_gives_up_after_max_attempts()
+    test_runner_fields_are_stored_on_success()
+    test_burst_fans_out_per_group()
+    test_drain_finishes_fast_jobs_and_leaves_slow_ones_resumable()
+    test_leased_job_is_not_run_twice_across_processes()
+    test_expired_lease_is_taken_over()
+    test_lost_lease_stops_without_saving()
+    print("✅ drive queue tests passed")
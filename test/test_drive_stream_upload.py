@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+測試 LINE → Drive 串流分段上傳
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import drive_export_async
+
+CHUNK = drive_export_async.DRIVE_CHUNK_ALIGNMENT
+
+
+class FakeDriveSession:
+    """模擬 resumable session：可設定某次 PUT 只收下部分資料"""
+
+    def __init__(self, short_commit_on=None):
+        self.data = bytearray()
+        self.puts = []
+        self.short_commit_on = short_commit_on
+
+    async def upload_chunk(self, *, upload_url, chunk, offset, final):
+        assert offset == len(self.data)
+        self.puts.append((len(chunk), final))
+        if not final:
+            assert len(chunk) % CHUNK == 0
+        if len(self.puts) == self.short_commit_on:
+            keep = len(chunk) - CHUNK
+            self.data += chunk[:keep]
+            return len(self.data), None
+        self.data += chunk
+        if final:
+            return len(self.data), 'file-id'
+        return len(self.data), None
+
+
+async def stream(payload, piece=100_000):
+    for i in range(0, len(payload), piece):
+        yield payload[i:i + piece]
+
+
+def run_upload(monkeypatch, payload, session):
+    monkeypatch.setattr(drive_export_async, 'drive_upload_chunk', session.upload_chunk)
+    return asyncio.run(drive_export_async.drive_stream_upload(
+        upload_url='https://upload', chunks=stream(payload), chunk_size=2 * CHUNK,
+    ))
+
+
+def test_stream_is_uploaded_in_aligned_chunks(monkeypatch):
+    payload = os.urandom(5 * CHUNK + 123)
+    session = FakeDriveSession()
+    assert run_upload(monkeypatch, payload, session) == 'file-id'
+    assert bytes(session.data) == payload
+    assert session.puts == [(2 * CHUNK, False), (2 * CHUNK, False), (CHUNK + 123, True)]
+
+
+def test_partially_committed_chunk_is_resent(monkeypatch):
+    payload = os.urandom(5 * CHUNK)
+    session = FakeDriveSession(short_commit_on=1)
+    assert run_upload(monkeypatch, payload, session) == 'file-id'
+    assert bytes(session.data) == payload
+
+
+def test_before_final_can_cancel_the_session(monkeypatch):
+    """串流結束、最後一段送出前可判定為重複並取消 session，不送出最後一段"""
+    payload = os.urandom(5 * CHUNK + 123)
+    session = FakeDriveSession()
+    totals, cancelled = [], []
+
+    async def before_final(total):
+        totals.append(total)
+        return False
+
+    async def cancel_upload(*, upload_url):
+        cancelled.append(upload_url)
+
+    monkeypatch.setattr(drive_export_async, 'drive_upload_chunk', session.upload_chunk)
+    monkeypatch.setattr(drive_export_async, 'drive_cancel_upload', cancel_upload)
+    assert asyncio.run(drive_export_async.drive_stream_upload(
+        upload_url='https://upload', chunks=stream(payload), chunk_size=2 * CHUNK, before_final=before_final,
+    )) is None
+    assert totals == [len(payload)]
+    assert cancelled == ['https://upload']
+    assert all(not final for _, final in session.puts)
+
+
+def test_before_final_true_completes_upload(monkeypatch):
+    payload = os.urandom(3 * CHUNK)
+    session = FakeDriveSession()
+
+    async def before_final(total):
+        return True
+
+    monkeypatch.setattr(drive_export_async, 'drive_upload_chunk', session.upload_chunk)
+    assert asyncio.run(drive_export_async.drive_stream_upload(
+        upload_url='https://upload', chunks=stream(payload), chunk_size=2 * CHUNK, before_final=before_final,
+    )) == 'file-id'
+    assert bytes(session.data) == payload
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+測試 Google Drive access token 快取
+"""
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import httpx
+
+import drive_export
+import drive_export_async
+import token_crypto
+
+CREDS = {'refresh_token_enc': 'enc', 'client_id': 'id', 'client_secret': 'secret'}
+
+
+def install_fake_refresh(monkeypatch, expires_in=3600):
+    calls = []
+
+    async def fake_refresh(**kwargs):
+        calls.append(kwargs['refresh_token'])
+        await asyncio.sleep(0.05)
+        return drive_export_async.OAuthTokens(
+            access_token=f"token-{len(calls)}",
+            expires_in=expires_in,
+            refresh_token=None,
+            scope=None,
+            token_type="Bearer",
+        )
+
+    monkeypatch.setattr(drive_export_async, 'refresh_oauth_tokens', fake_refresh)
+    monkeypatch.setattr(token_crypto, 'decrypt_refresh_token', lambda enc: f"plain-{enc}")
+    return calls
+
+
+def test_token_is_reused_until_expiry(monkeypatch):
+    calls = install_fake_refresh(monkeypatch)
+    cache = drive_export_async.AccessTokenCache()
+
+    async def main():
+        assert await cache.get('G1', **CREDS) == 'token-1'
+        assert await cache.get('G1', **CREDS) == 'token-1'
+        assert calls == ['plain-enc']
+
+        # 重新綁定（不同 refresh token）不可沿用舊 token
+        assert await cache.get('G1', **{**CREDS, 'refresh_token_enc': 'enc2'}) == 'token-2'
+
+    asyncio.run(main())
+
+
+def test_short_lived_token_is_not_cached(monkeypatch):
+    calls = install_fake_refresh(monkeypatch, expires_in=60)
+    cache = drive_export_async.AccessTokenCache(safety_margin_s=120)
+
+    async def main():
+        await cache.get('G1', **CREDS)
+        await cache.get('G1', **CREDS)
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+def test_concurrent_refresh_is_single_flight(monkeypatch):
+    calls = install_fake_refresh(monkeypatch)
+    cache = drive_export_async.AccessTokenCache()
+
+    async def main():
+        return await asyncio.gather(*(cache.get('G1', **CREDS) for _ in range(5)))
+
+    assert asyncio.run(main()) == ['token-1'] * 5
+    assert len(calls) == 1
+
+
+def test_unauthorized_invalidates_and_retries(monkeypatch):
+    install_fake_refresh(monkeypatch)
+    cache = drive_export_async.AccessTokenCache()
+    seen = []
+
+    async def upload(access_token):
+        seen.append(access_token)
+        if len(seen) == 1:
+            request = httpx.Request('PUT', 'https://www.googleapis.com/upload/drive/v3/files')
+            raise httpx.HTTPStatusError('401', request=request, response=httpx.Response(401, request=request))
+        return 'file-id'
+
+    assert asyncio.run(cache.call('G1', upload, **CREDS)) == 'file-id'
+    assert seen == ['token-1', 'token-2']
+
+
+def test_sync_cache_shares_async_single_flight(monkeypatch):
+    """同步版本委派給非同步快取：多執行緒同時取得 token 也只 refresh 一次，401 時重試"""
+    calls = install_fake_refresh(monkeypatch)
+    cache = drive_export.AccessTokenCache()
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(cache.get('G1', **CREDS))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert tokens == ['token-1'] * 4
+    assert len(calls) == 1
+
+    seen = []
+
+    def upload(access_token):
+        seen.append(access_token)
+        if len(seen) == 1:
+            request = httpx.Request('PUT', 'https://www.googleapis.com/upload/drive/v3/files')
+            raise httpx.HTTPStatusError('401', request=request, response=httpx.Response(401, request=request))
+        return 'file-id'
+
+    assert cache.call('G1', upload, **CREDS) == 'file-id'
+    assert seen == ['token-1', 'token-2']
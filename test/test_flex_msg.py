@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+測試預先驗證的 Flex 樣板：輸出與完整驗證一致，且不會互相影響
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from linebot.v3.messaging import FlexContainer
+
+import flex_msg
+from flex_msg import create_flex_message, static_flex_message
+
+
+def test_template_matches_full_validation():
+    args = ("內容" * 300, "圖片生成", "Gemini 3", "AI 畫家")
+    expected = FlexContainer.from_dict(flex_msg._bubble_json(*args)).to_dict()
+    message = create_flex_message(args[0], title=args[1], author=args[2], header_text=args[3])
+    assert message.contents.to_dict() == expected
+    assert len(message.alt_text) == 400
+
+
+def test_replies_do_not_share_text_fields():
+    first = create_flex_message("first")
+    second = create_flex_message("second", title="摘要")
+    assert first.contents.body.contents[3].text == "first"
+    assert first.contents.body.contents[0].text == flex_msg.DEFAULT_TITLE
+    assert second.contents.body.contents[3].text == "second"
+    assert flex_msg._REPLY_TEMPLATE.bubble.body.contents[3].text == flex_msg._PLACEHOLDER
+
+
+def test_static_message_is_built_once():
+    assert static_flex_message("說明") is static_flex_message("說明")
+    assert static_flex_message("說明") is not static_flex_message("說明", title="Help")
+
+
+def test_split_prefers_sentence_boundaries():
+    text = "第一句話說完了。" * 30 + "\n\n" + "Second paragraph. " * 40
+    parts = flex_msg.split_text(text, 200)
+    assert all(len(p) <= 200 for p in parts)
+    assert "".join("".join(parts).split()) == "".join(text.split())
+    assert all(p.endswith(("。", ".")) for p in parts[:-1])
+
+
+def test_split_hard_cuts_without_boundaries():
+    parts = flex_msg.split_text("a" * 450, 200)
+    assert [len(p) for p in parts] == [200, 200, 50]
+
+
+def test_short_answer_is_one_bubble():
+    assert len(flex_msg.compose_reply("短回答")) == 1
+
+
+def test_long_answer_uses_numbered_bubbles():
+    messages = flex_msg.compose_reply("這是一句測試。" * 100, part_chars=200)
+    assert 1 < len(messages) <= flex_msg.MAX_REPLY_MESSAGES
+    titles = [m.contents.body.contents[0].text for m in messages]
+    assert titles[0] == f"{flex_msg.DEFAULT_TITLE} (1/{len(messages)})"
+    body = "".join(m.contents.body.contents[3].text for m in messages)
+    assert body == "這是一句測試。" * 100
+
+
+def test_very_long_answer_packs_into_carousels():
+    text = "這是一句測試。" * 1000
+    messages = flex_msg.compose_reply(text, part_chars=200)
+    assert len(messages) <= flex_msg.MAX_REPLY_MESSAGES
+    assert messages[0].contents.type == "carousel"
+    bubbles = [b for m in messages for b in m.contents.contents]
+    assert all(len(b.body.contents[3].text) <= 200 for b in bubbles)
+    assert len(bubbles) == flex_msg.MAX_REPLY_MESSAGES * flex_msg.CAROUSEL_BUBBLES
+    assert bubbles[-1].body.contents[3].text.endswith(flex_msg.TRUNCATED_NOTICE)
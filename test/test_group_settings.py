@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+測試群組設定快取：TTL、寫入即失效、變更通知
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import group_settings
+from group_settings import GroupSettingsCache
+from test_drive_queue import FakeFirebase
+
+
+class CountingFirebase(FakeFirebase):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def get(self, path, name):
+        self.reads += 1
+        return super().get(path, name)
+
+
+def test_reads_are_cached_including_missing_nodes():
+    fdb = CountingFirebase()
+    fdb.put('groups/G1/info', 'drive_export', {'enabled': True})
+    cache = GroupSettingsCache(lambda: fdb, ttl_s=60)
+
+    async def main():
+        for _ in range(5):
+            assert (await cache.aget('G1', 'drive_export'))['enabled']
+            assert await cache.aget('G2', 'drive_export') is None
+
+    asyncio.run(main())
+    assert fdb.reads == 2
+    assert cache.stats()['hits'] == 8
+
+
+def test_ttl_zero_disables_cache():
+    fdb = CountingFirebase()
+    cache = GroupSettingsCache(lambda: fdb, ttl_s=0)
+    cache.get('G1', 'drive_export')
+    cache.get('G1', 'drive_export')
+    assert fdb.reads == 2
+
+
+def test_writes_invalidate_and_publish_change():
+    fdb = CountingFirebase()
+    cache = GroupSettingsCache(lambda: fdb, ttl_s=60)
+
+    assert cache.get('G1', 'drive_export') is None
+    cache.set('G1', 'drive_export', {'enabled': True, 'owner_line_user_id': 'U1'})
+    assert cache.get('G1', 'drive_export')['owner_line_user_id'] == 'U1'
+
+    cache.set_field('G1', 'drive_export', 'bind', {'active_code': 'GDRIVE-ABCDE'})
+    assert cache.get('G1', 'drive_export')['bind']['active_code'] == 'GDRIVE-ABCDE'
+
+    cache.delete('G1', 'drive_export')
+    assert cache.get('G1', 'drive_export') is None
+    assert isinstance(fdb.get(group_settings.CHANGES_PATH, 'G1'), int)
+
+
+def test_change_feed_events_invalidate_other_workers():
+    fdb = CountingFirebase()
+    cache = GroupSettingsCache(lambda: fdb, ttl_s=60)
+    cache.get('G1', 'drive_export')
+    cache.get('G2', 'drive_export')
+
+    cache.handle_event('keep-alive', {})
+    cache.handle_event('put', {'path': '/G1', 'data': 1700000000000})
+    assert cache.stats()['entries'] == 1
+
+    cache.handle_event('patch', {'path': '/', 'data': {'G2': 1700000000001}})
+    assert cache.stats()['entries'] == 0
+
+    cache.get('G1', 'drive_export')
+    cache.handle_event('put', {'path': '/', 'data': {'G1': 1}})
+    assert cache.stats()['entries'] == 0
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+測試回覆送出：依 reply token 年齡選擇 reply / push，失效時改用 push
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+from linebot.v3.messaging import TextMessage
+
+import line_reply
+
+
+class Source:
+    def __init__(self, type='group', group_id='G1', room_id=None, user_id='U1'):
+        self.type = type
+        self.group_id = group_id
+        self.room_id = room_id
+        self.user_id = user_id
+
+
+class Event:
+    def __init__(self, source=None, reply_token='token'):
+        self.source = source or Source()
+        self.reply_token = reply_token
+
+
+class FakeApiException(Exception):
+    def __init__(self, status, body):
+        super().__init__(f"({status})")
+        self.status = status
+        self.body = body
+
+
+class FakeLineApi:
+    def __init__(self, reply_error=None):
+        self.reply_error = reply_error
+        self.calls = []
+
+    async def reply_message(self, request):
+        self.calls.append(('reply', request.reply_token))
+        if self.reply_error:
+            raise self.reply_error
+
+    async def push_message(self, request):
+        self.calls.append(('push', request.to))
+
+    async def show_loading_animation(self, request):
+        self.calls.append(('loading', request.chat_id, request.loading_seconds))
+
+
+def send(sender, api, event, age):
+    return asyncio.run(sender.send(api, event, [TextMessage(text='hi')], time.monotonic() - age))
+
+
+def test_fresh_token_replies():
+    sender, api = line_reply.ReplySender(reply_ttl_s=50), FakeLineApi()
+    assert send(sender, api, Event(), age=1) == 'reply'
+    assert api.calls == [('reply', 'token')]
+    assert sender.stats()['reply'] == 1
+
+
+def test_old_token_goes_straight_to_push():
+    sender, api = line_reply.ReplySender(reply_ttl_s=50), FakeLineApi()
+    assert send(sender, api, Event(Source(type='room', room_id='R1')), age=55) == 'push'
+    assert api.calls == [('push', 'R1')]
+    assert sender.stats()['push_expired'] == 1
+
+
+def test_invalid_token_falls_back_to_push():
+    error = FakeApiException(400, '{"message":"Invalid reply token"}')
+    sender, api = line_reply.ReplySender(), FakeLineApi(reply_error=error)
+    assert send(sender, api, Event(), age=5) == 'push'
+    assert api.calls == [('reply', 'token'), ('push', 'G1')]
+    assert sender.stats()['push_invalid_token'] == 1
+
+
+def test_other_reply_errors_are_raised():
+    error = FakeApiException(500, 'internal error')
+    sender, api = line_reply.ReplySender(), FakeLineApi(reply_error=error)
+    with pytest.raises(FakeApiException):
+        send(sender, api, Event(), age=1)
+    assert sender.stats()['failed'] == 1
+    assert ('push', 'G1') not in api.calls
+
+
+def test_loading_animation_only_in_one_to_one_chats():
+    sender, api = line_reply.ReplySender(loading_seconds=23), FakeLineApi()
+    asyncio.run(sender.show_loading(api, Event(Source(type='group'))))
+    asyncio.run(sender.show_loading(api, Event(Source(type='user', user_id='U9'))))
+    assert api.calls == [('loading', 'U9', 20)]
+
+
+def test_loading_animation_can_be_disabled():
+    for seconds in (0, -5):
+        sender, api = line_reply.ReplySender(loading_seconds=seconds), FakeLineApi()
+        asyncio.run(sender.show_loading(api, Event(Source(type='user', user_id='U9'))))
+        assert api.calls == []
+    assert line_reply.ReplySender(loading_seconds=3).loading_seconds == 5
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+測試圖片生成配額（token bucket）
+"""
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from quota import (
+    AdmissionController,
+    BucketRule,
+    Decision,
+    InMemoryCounterStore,
+    TokenBucketLimiter,
+    busy_message,
+    scoped_rules_from_env,
+)
+
+
+def test_bucket_allows_capacity_then_rejects():
+    store = InMemoryCounterStore()
+    limiter = TokenBucketLimiter('image', {'group': BucketRule(capacity=2, per_hour=3600)}, store=store)
+
+    assert asyncio.run(limiter.acquire(group='G1')).allowed
+    assert asyncio.run(limiter.acquire(group='G1')).allowed
+    decision = asyncio.run(limiter.acquire(group='G1'))
+    assert not decision.allowed
+    assert decision.scope == 'group'
+    assert 0 < decision.retry_after_s <= 1
+
+    # 其他群組不受影響
+    assert asyncio.run(limiter.acquire(group='G2')).allowed
+
+
+def test_bucket_refills_over_time():
+    store = InMemoryCounterStore()
+    rule = BucketRule(capacity=1, per_hour=3600)
+    assert store.take_many([('k', rule)], now=100.0)[0]
+    assert not store.take_many([('k', rule)], now=100.5)[0]
+    assert store.take_many([('k', rule)], now=101.0)[0]
+
+
+def test_multi_scope_is_all_or_nothing():
+    store = InMemoryCounterStore()
+    limiter = TokenBucketLimiter('image', {
+        'group': BucketRule(capacity=5, per_hour=1),
+        'user': BucketRule(capacity=1, per_hour=1),
+    }, store=store)
+
+    assert asyncio.run(limiter.acquire(group='G1', user='U1')).allowed
+    decision = asyncio.run(limiter.acquire(group='G1', user='U1'))
+    assert not decision.allowed
+    assert decision.scope == 'user'
+
+    # 被使用者上限擋下時不應消耗群組額度：其他 4 位成員仍可各用一次
+    for i in range(4):
+        assert asyncio.run(limiter.acquire(group='G1', user=f'U{i + 2}')).allowed
+    assert asyncio.run(limiter.acquire(group='G1', user='U9')).scope == 'group'
+
+
+def test_disabled_rule_and_missing_scope_are_skipped():
+    limiter = TokenBucketLimiter('image', {
+        'group': BucketRule(capacity=0, per_hour=0),
+        'user': BucketRule(capacity=1, per_hour=1),
+    }, store=InMemoryCounterStore())
+    assert asyncio.run(limiter.acquire(group='G1', user=None)).allowed
+    assert asyncio.run(limiter.acquire(group='G1', user=None)).allowed
+
+
+def test_blocking_store_is_called_off_the_event_loop():
+    """Redis 等需要網路的計數儲存在執行緒中呼叫，不阻塞事件迴圈"""
+    class SlowStore:
+        blocking = True
+        threads = []
+
+        def take_many(self, buckets, cost=1.0):
+            self.threads.append(threading.get_ident())
+            return True, 0.0, None
+
+    limiter = TokenBucketLimiter('llm', {'group': BucketRule(capacity=1, per_hour=1)}, store=SlowStore())
+    assert asyncio.run(limiter.acquire(group='G1')).allowed
+    assert SlowStore.threads and SlowStore.threads[0] != threading.get_ident()
+
+
+def test_admission_total_scope_sheds_across_groups():
+    """全體上限：不同群組共用同一個 bucket，超過時計入 shed 統計"""
+    admission = AdmissionController({
+        'llm': TokenBucketLimiter('llm', {
+            'total': BucketRule(capacity=3, per_hour=1),
+            'group': BucketRule(capacity=2, per_hour=1),
+        }, store=InMemoryCounterStore()),
+    })
+
+    assert asyncio.run(admission.acquire('llm', group='G1', user='U1')).allowed
+    assert asyncio.run(admission.acquire('llm', group='G1', user='U2')).allowed
+    assert asyncio.run(admission.acquire('llm', group='G1', user='U3')).scope == 'group'
+    assert asyncio.run(admission.acquire('llm', group='G2', user='U4')).allowed
+    assert asyncio.run(admission.acquire('llm', group='G3', user='U5')).scope == 'total'
+
+    stats = admission.stats()['llm']
+    assert stats['admitted'] == 3
+    assert stats['shed'] == 2
+    assert stats['shed_by_scope'] == {'total': 1, 'group': 1}
+
+
+def test_admission_unknown_path_is_always_admitted():
+    admission = AdmissionController({})
+    for _ in range(100):
+        assert asyncio.run(admission.acquire('help', group='G1', user='U1')).allowed
+
+
+def test_scoped_rules_from_env(monkeypatch):
+    monkeypatch.setenv('LLM_QUOTA_GROUP_CAPACITY', '7')
+    monkeypatch.setenv('LLM_QUOTA_TOTAL_PER_HOUR', '0')
+    rules = scoped_rules_from_env('LLM_QUOTA', user=(1, 2), group=(3, 4), total=(5, 6))
+    assert rules['user'] == BucketRule(capacity=1, per_hour=2)
+    assert rules['group'] == BucketRule(capacity=7, per_hour=4)
+    # per_hour 為 0 時該 scope 停用
+    assert 'total' not in TokenBucketLimiter('llm', rules).rules
+
+
+def test_busy_message_names_the_limiting_scope():
+    assert '此群組' in busy_message(Decision(False, 30, 'group'), '圖片生成')
+    assert '你的' in busy_message(Decision(False, 30, 'user'), '圖片生成')
+    assert '使用人數較多' in busy_message(Decision(False, 90, 'total'), 'AI 回應')
+    assert '2 分鐘' in busy_message(Decision(False, 90, 'total'), 'AI 回應')
+
+
+if __name__ == "__main__":
+    test_bucket_allows_capacity_then_rejects()
+    test_bucket_refills_over_time()
+    test_multi_scope_is_all_or_nothing()
+    test_disabled_rule_and_missing_scope_are_skipped()
+    test_blocking_store_is_called_off_the_event_loop()
+    test_admission_total_scope_sheds_across_groups()
+    test_admission_unknown_path_is_always_admitted()
+    test_busy_message_names_the_limiting_scope()
+    print("✅ quota tests passed")
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+測試執行 lane：便宜工作不會被耗時工作擋住、同一對話依序執行、佇列上限
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scheduler import LaneConfig, LaneScheduler
+
+
+def make_scheduler(**kwargs):
+    return LaneScheduler([
+        LaneConfig('interactive', concurrency=4, max_queue=10, priority=0),
+        LaneConfig('llm', concurrency=1, max_queue=2, priority=1),
+    ], **kwargs)
+
+
+def test_interactive_work_does_not_wait_for_heavy_lane():
+    """LLM lane 滿載時，interactive lane 的工作仍立即完成"""
+    async def main():
+        lanes = make_scheduler()
+        release = asyncio.Event()
+        done = []
+
+        async def heavy():
+            await release.wait()
+            done.append('heavy')
+
+        async def cheap():
+            done.append('cheap')
+
+        assert lanes.submit('llm', heavy)
+        assert lanes.submit('llm', heavy)
+        assert lanes.submit('interactive', cheap)
+        await asyncio.sleep(0.01)
+        assert done == ['cheap']
+        stats = lanes.stats()
+        assert stats['llm']['running'] == 1
+        assert stats['llm']['queued'] == 1
+
+        release.set()
+        await lanes.join()
+        assert done == ['cheap', 'heavy', 'heavy']
+        assert lanes.stats()['llm']['completed'] == 2
+
+    asyncio.run(main())
+
+
+def test_same_key_runs_in_order_across_lanes():
+    """同一對話的事件即使分屬不同 lane 也依送出順序執行，等待時不佔 lane 名額"""
+    async def main():
+        lanes = make_scheduler()
+        order = []
+
+        def job(name, delay):
+            async def run():
+                await asyncio.sleep(delay)
+                order.append(name)
+            return run
+
+        lanes.submit('llm', job('g1-summary', 0.03), key='groups/G1')
+        lanes.submit('interactive', job('g1-message', 0), key='groups/G1')
+        lanes.submit('interactive', job('g2-message', 0), key='groups/G2')
+        await asyncio.sleep(0)
+        assert lanes.stats()['interactive']['parked'] == 1
+        await lanes.join()
+        assert order == ['g2-message', 'g1-summary', 'g1-message']
+
+    asyncio.run(main())
+
+
+def test_full_lane_rejects_and_failures_are_counted():
+    async def main():
+        lanes = make_scheduler()
+        release = asyncio.Event()
+
+        async def heavy():
+            await release.wait()
+
+        async def broken():
+            raise RuntimeError('boom')
+
+        assert lanes.submit('llm', heavy)      # running
+        assert lanes.submit('llm', heavy)      # queued
+        assert lanes.submit('llm', broken)     # queued
+        assert not lanes.submit('llm', heavy)  # max_queue=2
+        release.set()
+        await lanes.join()
+
+        stats = lanes.stats()['llm']
+        assert stats['rejected'] == 1
+        assert stats['failed'] == 1
+        assert stats['completed'] == 2
+        assert stats['wait_ms_p95'] >= stats['wait_ms_p50'] >= 0
+
+    asyncio.run(main())
+
+
+def test_max_running_prefers_higher_priority_lane():
+    """總名額不足時，先分給 priority 較小的 lane"""
+    async def main():
+        lanes = make_scheduler(max_running=1)
+        release = asyncio.Event()
+        order = []
+
+        def job(name):
+            async def run():
+                order.append(name)
+                await release.wait()
+            return run
+
+        lanes.submit('llm', job('llm-1'))
+        lanes.submit('llm', job('llm-2'))
+        lanes.submit('interactive', job('cheap'))
+        await asyncio.sleep(0)
+        release.set()
+        await lanes.join()
+        assert order == ['llm-1', 'cheap', 'llm-2']
+
+    asyncio.run(main())
+
+
+def test_drain_waits_then_reports_unfinished_keys():
+    async def main():
+        lanes = make_scheduler()
+        done = []
+
+        def job(name, delay):
+            async def run():
+                await asyncio.sleep(delay)
+                done.append(name)
+            return run
+
+        lanes.submit('interactive', job('quick', 0.01), key='users/U1')
+        lanes.submit('llm', job('slow', 10), key='groups/G1')
+        lanes.submit('interactive', job('behind-slow', 0), key='groups/G1')
+        report = await lanes.drain(timeout_s=0.1)
+
+        assert done == ['quick']
+        assert report['finished'] == 1
+        assert sorted(report['unfinished_keys']) == ['groups/G1', 'groups/G1']
+        # drain 之後不再接受新工作
+        assert not lanes.submit('interactive', job('late', 0))
+        assert lanes.pending() == 0
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    test_interactive_work_does_not_wait_for_heavy_lane()
+    test_same_key_runs_in_order_across_lanes()
+    test_full_lane_rejects_and_failures_are_counted()
+    test_max_running_prefers_higher_priority_lane()
+    test_drain_waits_then_reports_unfinished_keys()
+    print("✅ scheduler tests passed")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+測試啟動預熱：外部 client 只建立一次、失敗可重試、多個 client 平行預熱並回報就緒狀態
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from startup import LazyClient, Warmup
+
+
+def test_client_is_built_once_across_threads():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.02)
+        return object()
+
+    client = LazyClient('slow', factory)
+    assert not client.ready and client.peek() is None
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.get())) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert len({id(r) for r in results}) == 1
+    assert client.ready and client.init_ms >= 0
+
+
+def test_failed_factory_is_retried_on_next_use():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError('network down')
+        return 'client'
+
+    client = LazyClient('flaky', factory)
+    try:
+        client.get()
+        assert False, 'expected failure'
+    except RuntimeError:
+        pass
+    assert not client.ready and client.error == 'network down'
+    assert asyncio.run(client.aget()) == 'client'
+    assert client.error is None
+
+
+def test_warmup_runs_clients_in_parallel_and_reports():
+    """各 client 在不同執行緒同時建立，總耗時接近最慢的一個而非總和"""
+    async def main():
+        def slow(value):
+            def factory():
+                time.sleep(0.1)
+                return value
+            return factory
+
+        async def failing_step():
+            raise RuntimeError('bot info unavailable')
+
+        warmup = Warmup()
+        clients = [LazyClient(f'c{n}', slow(n)) for n in range(3)]
+        for client in clients:
+            warmup.add(client)
+        warmup.add_step('line_bot_info', failing_step)
+        assert not warmup.ready
+
+        started = time.perf_counter()
+        warmup.start()
+        assert not warmup.report()['ready']
+        await warmup.wait(timeout_s=2)
+        assert time.perf_counter() - started < 0.25
+
+        report = warmup.report()
+        assert report['ready']
+        assert all(report['components'][f'c{n}']['status'] == 'ok' for n in range(3))
+        assert report['components']['line_bot_info']['status'] == 'error'
+        assert [client.peek() for client in clients] == [0, 1, 2]
+
+    asyncio.run(main())
+
+
+def test_cancel_stops_pending_warmup():
+    async def main():
+        async def forever():
+            await asyncio.sleep(10)
+
+        warmup = Warmup()
+        warmup.add_step('stuck', forever)
+        warmup.start()
+        await asyncio.sleep(0)
+        await warmup.cancel()
+        assert warmup.report()['components']['stuck']['status'] == 'pending'
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    test_client_is_built_once_across_threads()
+    test_failed_factory_is_retried_on_next_use()
+    test_warmup_runs_clients_in_parallel_and_reports()
+    test_cancel_stops_pending_warmup()
+    print("✅ startup tests passed")
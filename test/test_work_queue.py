@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+測試共用工作佇列（SQLite）：同一對話依序、worker 當機後接手、重送去重、重試與放棄
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scheduler import LaneConfig, LaneScheduler
+from work_queue import SQLiteWorkQueue, WorkQueueConsumer, open_work_queue
+
+
+def make_queue(tmp_path):
+    return SQLiteWorkQueue(str(tmp_path / 'queue.db'))
+
+
+def test_same_key_is_claimed_one_at_a_time_in_order(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.put('llm', 'groups/G1', 'first', now=100)
+    queue.put('interactive', 'groups/G1', 'second', now=101)
+    queue.put('interactive', 'groups/G2', 'other', now=102)
+
+    a = queue.claim('w1', ['llm', 'interactive'], now=200)
+    assert a.payload == 'first'
+    # G1 的第二則要等第一則完成，先拿到 G2
+    b = queue.claim('w2', ['llm', 'interactive'], now=200)
+    assert b.payload == 'other'
+    assert queue.claim('w2', ['llm', 'interactive'], now=200) is None
+
+    assert queue.ack('w1', a, now=201)
+    c = queue.claim('w2', ['interactive'], now=202)
+    assert c.payload == 'second'
+
+
+def test_expired_lease_is_taken_over_by_another_process(tmp_path):
+    """worker 當機（未續約）後，其他程序可接手同一筆工作"""
+    first = make_queue(tmp_path)
+    second = SQLiteWorkQueue(str(tmp_path / 'queue.db'))
+    first.put('llm', 'users/U1', 'hello', now=100)
+
+    item = first.claim('crashed', ['llm'], lease_s=30, now=100)
+    assert second.claim('w2', ['llm'], lease_s=30, now=120) is None
+    taken = second.claim('w2', ['llm'], lease_s=30, now=131)
+    assert taken.id == item.id
+    assert taken.attempts == 2
+    # 原 worker 的 lease 已失效，不能再 ack
+    assert not first.ack('crashed', item, now=132)
+    assert second.ack('w2', taken, now=132)
+
+
+def test_lease_extension_keeps_item(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.put('asr', 'users/U1', 'voice', now=100)
+    item = queue.claim('w1', ['asr'], lease_s=30, now=100)
+    queue.extend('w1', [item.id], lease_s=30, now=125)
+    assert queue.claim('w2', ['asr'], now=140) is None
+
+
+def test_redelivered_event_is_dropped(tmp_path):
+    queue = make_queue(tmp_path)
+    assert queue.put('llm', 'users/U1', 'x', dedup_id='01HWEBHOOK')
+    item = queue.claim('w1', ['llm'])
+    queue.ack('w1', item)
+    assert not queue.put('llm', 'users/U1', 'x', dedup_id='01HWEBHOOK')
+    assert queue.claim('w1', ['llm']) is None
+
+
+def test_failed_item_is_retried_then_buried_without_blocking_key(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.put('llm', 'groups/G1', 'bad', now=100)
+    queue.put('llm', 'groups/G1', 'next', now=101)
+
+    item = queue.claim('w1', ['llm'], now=100)
+    queue.fail('w1', item, 'boom', retry_in_s=10, now=100)
+    # 重試前同一對話的下一則仍需等待
+    assert queue.claim('w1', ['llm'], now=105) is None
+    item = queue.claim('w1', ['llm'], now=111)
+    assert item.payload == 'bad'
+
+    queue.fail('w1', item, 'boom', retry_in_s=None, now=112)
+    assert queue.claim('w1', ['llm'], now=113).payload == 'next'
+    stats = queue.stats()
+    assert stats['dead'] == 1
+    assert stats['leased'] == 1
+
+
+def test_consumer_feeds_lanes_and_acks(tmp_path):
+    async def main():
+        queue = make_queue(tmp_path)
+        lanes = LaneScheduler([
+            LaneConfig('interactive', concurrency=2),
+            LaneConfig('llm', concurrency=1),
+        ])
+        handled = []
+
+        async def handler(item):
+            if item.payload == 'broken':
+                raise RuntimeError('boom')
+            handled.append(item.payload)
+
+        for n in range(3):
+            queue.put('interactive', 'groups/G1', f'g1-{n}')
+        queue.put('llm', 'users/U1', 'question')
+        queue.put('llm', 'users/U2', 'broken')
+
+        consumer = WorkQueueConsumer(
+            queue, lanes, handler, worker_id='w1', poll_interval_s=0.01, max_attempts=1
+        )
+        consumer.start()
+        for _ in range(200):
+            if len(handled) == 4 and not consumer.inflight:
+                break
+            await asyncio.sleep(0.01)
+        await consumer.stop()
+        await lanes.join()
+
+        assert [p for p in handled if p.startswith('g1')] == ['g1-0', 'g1-1', 'g1-2']
+        assert 'question' in handled
+        stats = queue.stats()
+        assert stats['ready'] == {}
+        assert stats['leased'] == 0
+        assert stats['dead'] == 1
+
+    asyncio.run(main())
+
+
+def test_cancelled_item_is_released_without_counting_attempt(tmp_path):
+    """關機逾時被取消的事件立即交還，其他 worker 不必等 lease 到期"""
+    async def main():
+        queue = make_queue(tmp_path)
+        lanes = LaneScheduler([LaneConfig('llm', concurrency=1)])
+        started = asyncio.Event()
+
+        async def handler(item):
+            started.set()
+            await asyncio.sleep(10)
+
+        queue.put('llm', 'users/U1', 'question')
+        consumer = WorkQueueConsumer(queue, lanes, handler, worker_id='w1', poll_interval_s=0.01)
+        consumer.start()
+        await started.wait()
+        await consumer.pause()
+        report = await lanes.drain(timeout_s=0.05)
+        await consumer.stop()
+        assert report['unfinished'] == 1
+
+        item = queue.claim('w2', ['llm'], lease_s=30)
+        assert item.payload == 'question'
+        assert item.attempts == 1
+
+    asyncio.run(main())
+
+
+def test_open_work_queue(tmp_path):
+    assert open_work_queue(None) is None
+    assert isinstance(open_work_queue(f"sqlite:///{tmp_path / 'q.db'}"), SQLiteWorkQueue)
+
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+
+    for test in (
+        test_same_key_is_claimed_one_at_a_time_in_order,
+        test_expired_lease_is_taken_over_by_another_process,
+        test_lease_extension_keeps_item,
+        test_redelivered_event_is_dropped,
+        test_failed_item_is_retried_then_buried_without_blocking_key,
+        test_consumer_feeds_lanes_and_acks,
+        test_cancelled_item_is_released_without_counting_attempt,
+        test_open_work_queue,
+    ):
+        with tempfile.TemporaryDirectory() as d:
+            test(pathlib.Path(d))
+    print("✅ work queue tests passed")
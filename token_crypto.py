@@ -0,0 +1,25 @@
+import importlib
+import os
+
+
+def get_encryption_key() -> str:
+    key = os.getenv("TOKEN_ENCRYPTION_KEY")
+    if not key:
+        raise RuntimeError("TOKEN_ENCRYPTION_KEY is required")
+    return key
+
+
+def _fernet():
+    try:
+        Fernet = importlib.import_module("cryptography.fernet").Fernet
+    except Exception as e:
+        raise RuntimeError("cryptography is required for token encryption") from e
+    return Fernet(get_encryption_key().encode("ascii"))
+
+
+def encrypt_refresh_token(refresh_token: str) -> str:
+    return _fernet().encrypt(refresh_token.encode("utf-8")).decode("ascii")
+
+
+def decrypt_refresh_token(refresh_token_enc: str) -> str:
+    return _fernet().decrypt(refresh_token_enc.encode("ascii")).decode("utf-8")
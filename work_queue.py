@@ -0,0 +1,513 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# How long a claimed item stays with its worker without a heartbeat; after
+# that another worker may take it over (the first one is presumed dead).
+DEFAULT_LEASE_S = 120.0
+# Webhook event ids are remembered this long to drop LINE redeliveries.
+DEFAULT_RETENTION_S = 24 * 3600.0
+
+
+@dataclass
+class WorkItem:
+    id: str
+    lane: str
+    key: str
+    payload: str
+    # time.time() when the item was queued
+    enqueued_at: float
+    # claims so far, including the current one
+    attempts: int = 1
+
+
+class SQLiteWorkQueue:
+    """Work queue in a SQLite file, shared by every process on one host.
+
+    Items of the same `key` are handed out strictly one at a time in queue
+    order: only the oldest unfinished item of a key can be claimed. A claim
+    is a lease; items whose lease runs out (worker crashed or was killed)
+    become claimable again. Finished items are kept for `retention_s` so a
+    redelivered `dedup_id` is ignored.
+    """
+
+    def __init__(self, path: str, retention_s: float = DEFAULT_RETENTION_S):
+        self.path = path
+        self.retention_s = retention_s
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS work_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lane TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                dedup_id TEXT UNIQUE,
+                status TEXT NOT NULL DEFAULT 'ready',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                enqueued_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_until REAL,
+                finished_at REAL,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS work_items_key ON work_items (key, status, id);
+            CREATE INDEX IF NOT EXISTS work_items_lane ON work_items (lane, status, available_at);
+        """)
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def put(self, lane: str, key: str, payload: str, dedup_id: Optional[str] = None, now: Optional[float] = None) -> bool:
+        """Queue an item; False when `dedup_id` was already queued."""
+        now = time.time() if now is None else now
+
+        def insert(conn):
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO work_items (lane, key, payload, dedup_id, enqueued_at, available_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (lane, key, payload, dedup_id, now, now),
+            )
+            return cur.rowcount == 1
+
+        return self._transaction(insert)
+
+    def claim(self, owner: str, lanes: Sequence[str], lease_s: float = DEFAULT_LEASE_S, now: Optional[float] = None) -> Optional[WorkItem]:
+        """Lease the oldest claimable item of `lanes`, or None."""
+        now = time.time() if now is None else now
+
+        def take(conn):
+            conn.execute(
+                "UPDATE work_items SET status = 'ready', lease_owner = NULL"
+                " WHERE status = 'leased' AND lease_until < ?",
+                (now,),
+            )
+            row = conn.execute(
+                "SELECT id, lane, key, payload, enqueued_at, attempts FROM work_items AS i"
+                " WHERE i.status = 'ready' AND i.available_at <= ?"
+                f" AND i.lane IN ({','.join('?' * len(lanes))})"
+                " AND NOT EXISTS (SELECT 1 FROM work_items AS e"
+                "   WHERE e.key = i.key AND e.id < i.id AND e.status IN ('ready', 'leased'))"
+                " ORDER BY i.id LIMIT 1",
+                (now, *lanes),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE work_items SET status = 'leased', lease_owner = ?, lease_until = ?, attempts = attempts + 1"
+                " WHERE id = ?",
+                (owner, now + lease_s, row[0]),
+            )
+            return WorkItem(id=str(row[0]), lane=row[1], key=row[2], payload=row[3], enqueued_at=row[4], attempts=row[5] + 1)
+
+        return self._transaction(take)
+
+    def extend(self, owner: str, ids: Sequence[str], lease_s: float = DEFAULT_LEASE_S, now: Optional[float] = None) -> None:
+        if not ids:
+            return
+        now = time.time() if now is None else now
+        self._transaction(lambda conn: conn.execute(
+            f"UPDATE work_items SET lease_until = ? WHERE lease_owner = ? AND status = 'leased'"
+            f" AND id IN ({','.join('?' * len(ids))})",
+            (now + lease_s, owner, *[int(i) for i in ids]),
+        ))
+
+    def ack(self, owner: str, item: WorkItem, now: Optional[float] = None) -> bool:
+        """Mark a leased item done; False if the lease was lost to another worker."""
+        now = time.time() if now is None else now
+
+        def done(conn):
+            cur = conn.execute(
+                "UPDATE work_items SET status = 'done', lease_owner = NULL, finished_at = ?, payload = ''"
+                " WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                (now, int(item.id), owner),
+            )
+            conn.execute(
+                "DELETE FROM work_items WHERE status = 'done' AND finished_at < ?",
+                (now - self.retention_s,),
+            )
+            return cur.rowcount == 1
+
+        return self._transaction(done)
+
+    def release(self, owner: str, item: WorkItem, now: Optional[float] = None) -> None:
+        """Hand an unfinished item back at once (e.g. on shutdown); the claim does not count as an attempt."""
+        now = time.time() if now is None else now
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE work_items SET status = 'ready', lease_owner = NULL, attempts = attempts - 1, available_at = ?"
+            " WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (now, int(item.id), owner),
+        ))
+
+    def fail(self, owner: str, item: WorkItem, error: str, retry_in_s: Optional[float], now: Optional[float] = None) -> None:
+        """Give a leased item back for a retry in `retry_in_s`, or bury it (None)."""
+        now = time.time() if now is None else now
+        if retry_in_s is None:
+            sql = ("UPDATE work_items SET status = 'dead', lease_owner = NULL, finished_at = ?, error = ?"
+                   " WHERE id = ? AND lease_owner = ?")
+            args = (now, error[:500], int(item.id), owner)
+        else:
+            sql = ("UPDATE work_items SET status = 'ready', lease_owner = NULL, available_at = ?, error = ?"
+                   " WHERE id = ? AND lease_owner = ?")
+            args = (now + retry_in_s, error[:500], int(item.id), owner)
+        self._transaction(lambda conn: conn.execute(sql, args))
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT lane, status, COUNT(*) FROM work_items WHERE status IN ('ready', 'leased', 'dead')"
+                " GROUP BY lane, status"
+            ).fetchall()
+        ready: Dict[str, int] = {}
+        totals = {"leased": 0, "dead": 0}
+        for lane, status, count in rows:
+            if status == "ready":
+                ready[lane] = count
+            else:
+                totals[status] += count
+        return {"backend": "sqlite", "ready": ready, **totals}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# Redis layout (prefix p):
+#   p..'seq'           id counter
+#   p..'item:'..id     hash: lane, key, payload, enqueued_at, attempts, owner, error
+#   p..'key:'..key     list of unfinished ids of a key; only its head is ever ready
+#   p..'ready:'..lane  zset of claimable head ids, scored by available_at
+#   p..'leases'        zset of leased ids, scored by lease expiry
+#   p..'dead'          list of buried ids
+#   p..'dedup:'..id    marker for redelivery detection (expires after retention)
+_REDIS_LIB = """
+local function advance(p, key, now)
+  local nxt = redis.call('LINDEX', p .. 'key:' .. key, 0)
+  if nxt then
+    local lane = redis.call('HGET', p .. 'item:' .. nxt, 'lane')
+    redis.call('ZADD', p .. 'ready:' .. lane, now, nxt)
+  end
+end
+"""
+
+# ARGV: prefix, lane, key, payload, now, dedup_id, retention_s
+_REDIS_PUT = """
+local p = ARGV[1]
+if ARGV[6] ~= '' then
+  if not redis.call('SET', p .. 'dedup:' .. ARGV[6], '1', 'NX', 'EX', ARGV[7]) then
+    return 0
+  end
+end
+local id = redis.call('INCR', p .. 'seq')
+redis.call('HSET', p .. 'item:' .. id, 'lane', ARGV[2], 'key', ARGV[3], 'payload', ARGV[4],
+  'enqueued_at', ARGV[5], 'attempts', 0)
+if redis.call('RPUSH', p .. 'key:' .. ARGV[3], id) == 1 then
+  redis.call('ZADD', p .. 'ready:' .. ARGV[2], ARGV[5], id)
+end
+return id
+"""
+
+# ARGV: prefix, now, lease_until, owner, lane...
+_REDIS_CLAIM = """
+local p = ARGV[1]
+local now = ARGV[2]
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', p .. 'leases', '-inf', now)) do
+  redis.call('ZREM', p .. 'leases', id)
+  local lane = redis.call('HGET', p .. 'item:' .. id, 'lane')
+  if lane then
+    redis.call('HDEL', p .. 'item:' .. id, 'owner')
+    redis.call('ZADD', p .. 'ready:' .. lane, now, id)
+  end
+end
+for i = 5, #ARGV do
+  local ready = redis.call('ZRANGEBYSCORE', p .. 'ready:' .. ARGV[i], '-inf', now, 'LIMIT', 0, 1)
+  if #ready > 0 then
+    local id = ready[1]
+    local item = p .. 'item:' .. id
+    redis.call('ZREM', p .. 'ready:' .. ARGV[i], id)
+    redis.call('ZADD', p .. 'leases', ARGV[3], id)
+    redis.call('HSET', item, 'owner', ARGV[4])
+    local attempts = redis.call('HINCRBY', item, 'attempts', 1)
+    local f = redis.call('HMGET', item, 'lane', 'key', 'payload', 'enqueued_at')
+    return {id, f[1], f[2], f[3], f[4], attempts}
+  end
+end
+return false
+"""
+
+# ARGV: prefix, owner, now, id
+_REDIS_ACK = _REDIS_LIB + """
+local p = ARGV[1]
+local item = p .. 'item:' .. ARGV[4]
+if redis.call('HGET', item, 'owner') ~= ARGV[2] then
+  return 0
+end
+local key = redis.call('HGET', item, 'key')
+redis.call('ZREM', p .. 'leases', ARGV[4])
+redis.call('DEL', item)
+redis.call('LREM', p .. 'key:' .. key, 1, ARGV[4])
+advance(p, key, ARGV[3])
+return 1
+"""
+
+# ARGV: prefix, owner, now, id, error, available_at ('' = bury)
+_REDIS_FAIL = _REDIS_LIB + """
+local p = ARGV[1]
+local item = p .. 'item:' .. ARGV[4]
+if redis.call('HGET', item, 'owner') ~= ARGV[2] then
+  return 0
+end
+redis.call('ZREM', p .. 'leases', ARGV[4])
+redis.call('HDEL', item, 'owner')
+redis.call('HSET', item, 'error', ARGV[5])
+if ARGV[6] == '' then
+  local key = redis.call('HGET', item, 'key')
+  redis.call('HDEL', item, 'payload')
+  redis.call('RPUSH', p .. 'dead', ARGV[4])
+  redis.call('LREM', p .. 'key:' .. key, 1, ARGV[4])
+  advance(p, key, ARGV[3])
+else
+  local lane = redis.call('HGET', item, 'lane')
+  redis.call('ZADD', p .. 'ready:' .. lane, ARGV[6], ARGV[4])
+end
+return 1
+"""
+
+# ARGV: prefix, owner, now, id
+_REDIS_RELEASE = """
+local p = ARGV[1]
+local item = p .. 'item:' .. ARGV[4]
+if redis.call('HGET', item, 'owner') ~= ARGV[2] then
+  return 0
+end
+redis.call('ZREM', p .. 'leases', ARGV[4])
+redis.call('HDEL', item, 'owner')
+redis.call('HINCRBY', item, 'attempts', -1)
+redis.call('ZADD', p .. 'ready:' .. redis.call('HGET', item, 'lane'), ARGV[3], ARGV[4])
+return 1
+"""
+
+# ARGV: prefix, owner, lease_until, id...
+_REDIS_EXTEND = """
+local p = ARGV[1]
+for i = 4, #ARGV do
+  if redis.call('HGET', p .. 'item:' .. ARGV[i], 'owner') == ARGV[2] then
+    redis.call('ZADD', p .. 'leases', 'XX', ARGV[3], ARGV[i])
+  end
+end
+return 1
+"""
+
+
+class RedisWorkQueue:
+    """The same queue semantics as SQLiteWorkQueue, shared across nodes through Redis.
+
+    Every operation is one Lua script, so ordering per key and lease
+    hand-over stay atomic without client-side locking.
+    """
+
+    def __init__(self, url: str, prefix: str = "workq:", retention_s: float = DEFAULT_RETENTION_S):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("redis is required for a redis:// WORK_QUEUE_URL") from e
+        self._client = redis.Redis.from_url(url, socket_timeout=5, socket_connect_timeout=5)
+        self._prefix = prefix
+        self.retention_s = retention_s
+        self._put = self._client.register_script(_REDIS_PUT)
+        self._claim = self._client.register_script(_REDIS_CLAIM)
+        self._ack = self._client.register_script(_REDIS_ACK)
+        self._fail = self._client.register_script(_REDIS_FAIL)
+        self._release = self._client.register_script(_REDIS_RELEASE)
+        self._extend = self._client.register_script(_REDIS_EXTEND)
+
+    @staticmethod
+    def _str(value) -> str:
+        return value.decode() if isinstance(value, bytes) else str(value)
+
+    def put(self, lane: str, key: str, payload: str, dedup_id: Optional[str] = None, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        args = [self._prefix, lane, key, payload, now, dedup_id or "", int(self.retention_s)]
+        return int(self._put(args=args)) != 0
+
+    def claim(self, owner: str, lanes: Sequence[str], lease_s: float = DEFAULT_LEASE_S, now: Optional[float] = None) -> Optional[WorkItem]:
+        now = time.time() if now is None else now
+        row = self._claim(args=[self._prefix, now, now + lease_s, owner, *lanes])
+        if not row:
+            return None
+        item_id, lane, key, payload, enqueued_at, attempts = row
+        return WorkItem(
+            id=self._str(item_id),
+            lane=self._str(lane),
+            key=self._str(key),
+            payload=self._str(payload),
+            enqueued_at=float(self._str(enqueued_at)),
+            attempts=int(attempts),
+        )
+
+    def extend(self, owner: str, ids: Sequence[str], lease_s: float = DEFAULT_LEASE_S, now: Optional[float] = None) -> None:
+        if not ids:
+            return
+        now = time.time() if now is None else now
+        self._extend(args=[self._prefix, owner, now + lease_s, *ids])
+
+    def ack(self, owner: str, item: WorkItem, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        return int(self._ack(args=[self._prefix, owner, now, item.id])) == 1
+
+    def release(self, owner: str, item: WorkItem, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        self._release(args=[self._prefix, owner, now, item.id])
+
+    def fail(self, owner: str, item: WorkItem, error: str, retry_in_s: Optional[float], now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        available_at = "" if retry_in_s is None else now + retry_in_s
+        self._fail(args=[self._prefix, owner, now, item.id, error[:500], available_at])
+
+    def stats(self) -> Dict[str, object]:
+        p = self._prefix
+        ready = {}
+        for name in self._client.scan_iter(match=f"{p}ready:*"):
+            name = self._str(name)
+            ready[name[len(p) + len("ready:"):]] = self._client.zcard(name)
+        return {
+            "backend": "redis",
+            "ready": ready,
+            "leased": self._client.zcard(f"{p}leases"),
+            "dead": self._client.llen(f"{p}dead"),
+        }
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def open_work_queue(url: Optional[str]):
+    """`sqlite:///path/to/queue.db` or `redis://host:6379/0`; None when unset."""
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return SQLiteWorkQueue(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisWorkQueue(url)
+    raise ValueError(f"Unsupported WORK_QUEUE_URL scheme: {url}")
+
+
+class WorkQueueConsumer:
+    """Feeds claimed work items into the local lanes of a LaneScheduler.
+
+    A lane is only asked for more work while it has an idle slot, so lane
+    priorities and concurrency limits hold per process, and a busy worker
+    leaves items for others. Leases of in-flight items are renewed every
+    third of `lease_s`; a failed item is retried with exponential backoff
+    and buried after `max_attempts`. An item cancelled mid-run (shutdown
+    past its drain deadline) is released at once for another worker.
+    """
+
+    def __init__(
+        self,
+        queue,
+        lanes,
+        handler: Callable[[WorkItem], Awaitable[None]],
+        *,
+        worker_id: Optional[str] = None,
+        lease_s: float = DEFAULT_LEASE_S,
+        poll_interval_s: float = 0.5,
+        max_attempts: int = 5,
+        retry_base_s: float = 5.0,
+    ):
+        self.queue = queue
+        self.lanes = lanes
+        self.handler = handler
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_s = lease_s
+        self.poll_interval_s = poll_interval_s
+        self.max_attempts = max_attempts
+        self.retry_base_s = retry_base_s
+        self._inflight: Dict[str, WorkItem] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._claim_loop()), asyncio.create_task(self._heartbeat())]
+
+    async def pause(self) -> None:
+        """Stop claiming new items; leases of running ones keep being renewed."""
+        if self._tasks:
+            self._tasks[0].cancel()
+            await asyncio.gather(self._tasks[0], return_exceptions=True)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    async def _claim_loop(self) -> None:
+        while True:
+            claimed = False
+            try:
+                for lane in self.lanes.lane_names():
+                    while self.lanes.free_slots(lane) > 0:
+                        item = await asyncio.to_thread(self.queue.claim, self.worker_id, [lane], self.lease_s)
+                        if item is None:
+                            break
+                        claimed = True
+                        self._inflight[item.id] = item
+                        self.lanes.submit(lane, lambda item=item: self._run(item))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Work queue claim failed: {e}")
+            if not claimed:
+                await asyncio.sleep(self.poll_interval_s)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_s / 3)
+            try:
+                await asyncio.to_thread(self.queue.extend, self.worker_id, list(self._inflight), self.lease_s)
+            except Exception as e:
+                logger.warning(f"Work queue lease renewal failed: {e}")
+
+    async def _run(self, item: WorkItem) -> None:
+        try:
+            await self.handler(item)
+        except asyncio.CancelledError:
+            await asyncio.shield(asyncio.to_thread(self.queue.release, self.worker_id, item))
+            raise
+        except Exception as e:
+            retry_in = None
+            if item.attempts < self.max_attempts:
+                retry_in = self.retry_base_s * (2 ** (item.attempts - 1))
+            logger.error(f"Work item {item.id} ({item.lane}) failed on attempt {item.attempts}: {e}")
+            await asyncio.to_thread(self.queue.fail, self.worker_id, item, str(e), retry_in)
+            raise
+        else:
+            if not await asyncio.to_thread(self.queue.ack, self.worker_id, item):
+                logger.warning(f"Work item {item.id} finished after its lease was taken over")
+        finally:
+            self._inflight.pop(item.id, None)
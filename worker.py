@@ -0,0 +1,32 @@
+"""
+只處理共用工作佇列的 worker 程序（不開 HTTP 連接埠）
+
+    WORK_QUEUE_URL=redis://redis:6379/0 WORKER_ROLE=worker python worker.py
+
+webhook 由設定 WORKER_ROLE=intake（或 all）的 uvicorn 程序接收並放進佇列，
+worker 可在任意台機器上執行多個，啟動、關閉流程與 main.py 的 lifespan 相同。
+"""
+import asyncio
+import logging
+import signal
+
+import main
+
+
+async def run():
+    if main.shared_queue is None:
+        raise SystemExit("WORK_QUEUE_URL is required to run a standalone worker")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with main.lifespan(main.app):
+        logging.info("Worker started")
+        await stop.wait()
+        logging.info("Worker stopping")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())